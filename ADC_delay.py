@@ -12,11 +12,19 @@ Created on Tue Nov 21 11:11:04 2017
 @author: tbeleyur
 """
 from __future__ import division
+import argparse
+import concurrent.futures
+import glob
 import itertools,os
+import json
+import numbers
+import re
 import warnings
 from scipy import signal
 import scipy.io.wavfile
+import scipy.fftpack
 import numpy as np
+import soundfile
 import peakutils
 import datetime,time
 from matplotlib import pyplot as plt
@@ -66,6 +74,11 @@ def timealign_channels(multich_rec,fs=192000,channels2devices={'1':range(12),'2'
                         with the time-aligned sync channel too. Otherwise, only the
                         audio channels are returned
 
+            sync_log : dictionary or None. The log the recorder saved with the recording,
+                       see read_sync_log. If it holds cut points for syncch2device they
+                       are used directly, and the sync channels are only searched
+                       for their first rising edges when there are none.
+
     Returns :
 
         timealigned_audio :  adjusted_nsamples x nchannels (or less channels).
@@ -92,7 +105,6 @@ def timealign_channels(multich_rec,fs=192000,channels2devices={'1':range(12),'2'
     # estimate delay between different ADC devices
 
     sync_chlist = [ch_index for eachdevice,ch_index in syncch2device.items()]
-    sync_channels = select_channels(sync_chlist,multich_rec)
 
 #    rec_durn = multich_rec.shape[0]/fs
 
@@ -101,9 +113,13 @@ def timealign_channels(multich_rec,fs=192000,channels2devices={'1':range(12),'2'
 #    else:
 #        samples2use = 10**5
 
-    rising_edges = np.apply_along_axis(detect_first_rising_edge,0,sync_channels,fs)
+    cutpoints = cutpoints_from_sync_log(kwargs.get('sync_log', None), syncch2device)
+    if cutpoints is None:
+        sync_channels = select_channels(sync_chlist,multich_rec)
+        rising_edges = np.apply_along_axis(detect_first_rising_edge,0,sync_channels,fs)
 
-    cutpoints= { devs: rising_edges[index] for index,devs in enumerate(channels2devices)}
+        cutpoints= { devs: rising_edges[index] for index,devs in enumerate(channels2devices)}
+        cutpoints = match_sync_periods(cutpoints, int(fs/25))
 
     # remove the sync channels and select only the audio channels
     all_channels = set( range(multich_rec.shape[1]) )
@@ -174,7 +190,7 @@ def select_channels(channel_list,multichannel_rec):
 
     return(subset_channels)
 
-def estimate_delay(chB,chA,samples_to_use=10**5):
+def estimate_delay(chB,chA,samples_to_use=10**5,**kwargs):
     '''
     estimates delay by looking at the peak in the cross-correlation function
     The function provides the delay in samples wrt channel A.
@@ -182,21 +198,105 @@ def estimate_delay(chB,chA,samples_to_use=10**5):
     eg. if estimate_delay gives +3, this means chB is +3 indices delay with ref
     -erence to channel A.
 
+    The cross-correlation is calculated with FFTs, see estimate_delays.
+
     Inputs:
         chA,chB : np.array. the two signals to be compared
         samples_to_use: integer. number of samples to use for the actual cross correlation
 
-    '''
+    **kwargs:
+        weighting, interpolation : see estimate_delays
 
+    '''
     chB_chunk, chA_chunk = chB[:samples_to_use], chA[:samples_to_use]
 
-    cross_corn = np.correlate(chB_chunk,chA_chunk,mode='same')
-
-    peak_index = np.argmax(cross_corn)
-    delay = peak_index - (cross_corn.size/2.0 )
+    delays = estimate_delays(chB_chunk.reshape(-1,1), chA_chunk.reshape(-1,1),
+                             **kwargs)
+    delay = delays[0]
 
     return(delay)
 
+def estimate_delays(chBs, chAs, samples_to_use=None, **kwargs):
+    '''
+    estimates the delays of many channel pairs at once with a generalised
+    cross-correlation (GCC) calculated with FFTs.
+
+    The delays are given in samples wrt the channels in chAs, and are searched
+    within +/- half the number of samples used, like the 'same' mode
+    cross-correlation of estimate_delay.
+
+    Inputs:
+        chBs, chAs : nsamples x npairs np.arrays. Column i of chBs is compared
+                     with column i of chAs. A single column of chAs is compared
+                     with all columns of chBs.
+        samples_to_use : integer or None. Number of samples to use from the start
+                         of the channels. Defaults to None, which uses all samples.
+
+    **kwargs:
+        weighting : string. 'cc' for the plain cross-correlation or 'phat' for the
+                    phase transform weighted cross-correlation (GCC-PHAT), which gives
+                    a sharper peak for broadband signals in reverberant conditions.
+                    Defaults to 'cc'.
+        interpolation : string or None. 'parabolic' fits a parabola through the
+                        cross-correlation peak and its two neighbours to give a
+                        sub-sample delay. Defaults to None - which gives whole sample delays.
+    Returns:
+        delays : npairs np.array with the delay in samples of each channel pair
+    '''
+    weighting = kwargs.get('weighting', 'cc')
+    interpolation = kwargs.get('interpolation', None)
+
+    chBs, chAs = chBs[:samples_to_use], chAs[:samples_to_use]
+    nsamples = chBs.shape[0]
+    fft_length = scipy.fftpack.next_fast_len(2*nsamples - 1)
+
+    spectrum_B = np.fft.rfft(chBs, fft_length, axis=0)
+    spectrum_A = np.fft.rfft(chAs, fft_length, axis=0)
+    cross_spectrum = spectrum_B*np.conj(spectrum_A)
+
+    if weighting == 'phat':
+        cross_spectrum /= np.abs(cross_spectrum) + np.finfo(float).eps
+    elif not weighting == 'cc':
+        raise ValueError('Unknown weighting: '+str(weighting))
+
+    cross_corn = np.fft.irfft(cross_spectrum, fft_length, axis=0)
+
+    # bring the lags from -nsamples/2 to +nsamples/2 into one contiguous block
+    min_lag = -(nsamples//2)
+    max_lag = nsamples - nsamples//2 - 1
+    cross_corn = np.concatenate((cross_corn[min_lag:], cross_corn[:max_lag+1]))
+
+    peak_indices = np.argmax(cross_corn, axis=0)
+    delays = np.float64(peak_indices + min_lag)
+
+    if interpolation == 'parabolic':
+        delays += parabolic_peak_offset(cross_corn, peak_indices)
+    elif interpolation is not None:
+        raise ValueError('Unknown interpolation: '+str(interpolation))
+
+    return(delays)
+
+def parabolic_peak_offset(cross_corn, peak_indices):
+    '''
+    fits a parabola through each peak and its two neighbours and returns the
+    offset of the parabola's vertex from the peak index (-0.5 to +0.5).
+    Peaks at the edges get an offset of 0.
+    '''
+    columns = np.arange(cross_corn.shape[1])
+    inner = (peak_indices > 0) & (peak_indices < cross_corn.shape[0]-1)
+    offsets = np.zeros(peak_indices.size)
+
+    before = cross_corn[peak_indices[inner]-1, columns[inner]]
+    peak = cross_corn[peak_indices[inner], columns[inner]]
+    after = cross_corn[peak_indices[inner]+1, columns[inner]]
+
+    curvature = before - 2*peak + after
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inner_offsets = np.where(curvature < 0, 0.5*(before - after)/curvature, 0.0)
+    offsets[inner] = inner_offsets
+
+    return(offsets)
+
 
 def cut_out_same_sections(channel,start_index,stop_index):
     '''
@@ -226,9 +326,20 @@ def detect_first_rising_edge(recording,fs=192000,**kwargs):
     Convolves the recording with an input template signal
     . The first peak arising from this convolved signal is output.
 
+    The convolution is done with FFTs, and by default only over the first
+    few sync periods of the recording. The searched part of the recording is
+    doubled until it holds regularly spaced peaks, or the whole recording
+    has been searched.
+
     When no template is given, a square wave signal
     with 50% duty cycle and 25 Hz frequency is assumed.
 
+    Rising edges in the first half template length are ignored, as the template
+    only partly overlaps the recording there and whether they are found
+    depends on the noise. The first rising edge is therefore the first one with
+    at least half a sync period of recording before it, as in the cut points of
+    the sync logs (see fieldrecorder.drift_tracker).
+
     Inputs:
         recording: np.array with signal
         fs: int. sampling rate 192000
@@ -241,6 +352,9 @@ def detect_first_rising_edge(recording,fs=192000,**kwargs):
                         by pi radians)
         fps : integer. frames per second in Hertz, this is the frequency at which the
                         template signal repeats itself.
+        search_periods : integer or None. Number of sync periods at the start of
+                        the recording that are searched first. Defaults to 10.
+                        If None the whole recording is searched.
     Output:
         first_peak: integer. index of the the first rising edge
 
@@ -254,15 +368,28 @@ def detect_first_rising_edge(recording,fs=192000,**kwargs):
 
     if not 'fps' in kwargs.keys():
         print('no fps arguments found in kwargs, using 25 fps')
-        mindist_pk2pk = (1.0/25)*fs -1
+        fps = 25
     else:
         print('fps argument found in kwargs, using '+str(kwargs['fps'])+' Hz fps')
-        mindist_pk2pk = (1.0/kwargs['fps'])*fs -1
+        fps = kwargs['fps']
+    mindist_pk2pk = (1.0/fps)*fs -1
+    period_samples = int(fs/fps)
 
-    conv_sig = np.convolve(template[::-1],recording,'same')
-    conv_sig *= 1.0/np.max(conv_sig)
-
-    pks_conv = peakutils.indexes(conv_sig,thres=0.6,min_dist=mindist_pk2pk)
+    search_periods = kwargs.get('search_periods', 10)
+    if search_periods is None:
+        search_samples = recording.size
+    else:
+        search_samples = min(int(search_periods*period_samples), recording.size)
+
+    while True:
+        pks_conv = find_template_peaks(recording[:search_samples], template,
+                                       mindist_pk2pk, partial_start=True,
+                                       partial_end=search_samples<recording.size)
+        if search_samples >= recording.size:
+            break
+        if check_regular_peaks(pks_conv, period_samples, search_samples):
+            break
+        search_samples = min(2*search_samples, recording.size)
 
     # check if the pks_conv are all regularly spaced - indicates a well recorded
     # signal
@@ -281,6 +408,83 @@ def detect_first_rising_edge(recording,fs=192000,**kwargs):
 
     return(first_peak)
 
+def find_template_peaks(recording, template, mindist_pk2pk, partial_start=False,
+                        partial_end=False):
+    '''
+    Convolves the recording with the time-reversed template with FFTs and
+    finds the peaks in the normalised output.
+
+    Inputs:
+        recording, template : np.arrays
+        mindist_pk2pk : float. minimum number of samples between peaks
+        partial_start : Boolean. If True, the recording starts in the middle of a longer
+                        signal, and peaks in the first half template length are ignored.
+        partial_end : Boolean. If True, the recording is a cut out part of a longer
+                      recording, and peaks in the last half template length, where
+                      the template only partly overlaps the recording, are ignored.
+    Output:
+        pks_conv : np.array with the peak indices
+    '''
+    conv_sig = signal.fftconvolve(recording, template[::-1], 'same')
+    if partial_end:
+        conv_sig = conv_sig[:recording.size - template.size//2]
+    conv_sig *= 1.0/np.max(conv_sig)
+
+    pks_conv = peakutils.indexes(conv_sig,thres=0.6,min_dist=mindist_pk2pk)
+    if partial_start:
+        pks_conv = pks_conv[pks_conv >= template.size//2]
+    return(pks_conv)
+
+def check_regular_peaks(pks_conv, period_samples, search_samples, tolerance=2):
+    '''
+    Checks if the peaks look like they come from a recorded sync signal : there
+    are at least two peaks, they are one period apart (+/- tolerance samples),
+    and the first peak is not in the last period of the searched samples.
+    '''
+    if len(pks_conv) < 2:
+        return(False)
+    if pks_conv[0] >= search_samples - period_samples:
+        return(False)
+    pk2pk_error = np.abs(np.diff(pks_conv) - period_samples)
+    return(bool(np.all(pk2pk_error <= tolerance)))
+
+def benchmark_detect_first_rising_edge(rec_durn=10, fs=192000, sync_freq=25):
+    '''
+    Compares the time taken to find the first rising edge in a simulated sync
+    channel with the direct np.convolve over the whole recording previously used
+    in detect_first_rising_edge, and the current FFT based search.
+
+    Inputs:
+        rec_durn : float. Duration of the simulated sync channel in seconds.
+
+    Returns:
+        durations : dictionary with the time taken in seconds by 'np_convolve_whole'
+                    and 'fft_search'
+        first_peaks : dictionary with the detected first rising edge of both
+    '''
+    template = create_default_template(sync_freq, fs)
+    num_periods = int(rec_durn*sync_freq)
+    recording = np.concatenate((np.zeros(int(0.1*fs)), np.tile(template, num_periods)))
+    recording += np.random.normal(0, 0.01, recording.size)
+    mindist_pk2pk = (1.0/sync_freq)*fs -1
+
+    durations = {}
+    first_peaks = {}
+
+    start = time.time()
+    conv_sig = np.convolve(template[::-1],recording,'same')
+    conv_sig *= 1.0/np.max(conv_sig)
+    first_peaks['np_convolve_whole'] = peakutils.indexes(conv_sig,thres=0.6,
+                                                         min_dist=mindist_pk2pk)[0]
+    durations['np_convolve_whole'] = time.time() - start
+
+    start = time.time()
+    first_peaks['fft_search'] = detect_first_rising_edge(recording, fs, template=template,
+                                                         fps=sync_freq)
+    durations['fft_search'] = time.time() - start
+
+    return(durations, first_peaks)
+
 def create_default_template(sync_freq,fs=192000):
     '''
     Creates a phase shifted 50% duty cycle square wave.
@@ -299,7 +503,7 @@ def create_default_template(sync_freq,fs=192000):
     return(template)
 
 
-def align_channels(multichannel_rec, channel2device,cut_points={'ADC1':0,'ADC2':0}):
+def align_channels(multichannel_rec, channel2device,cut_points={'ADC1':0,'ADC2':0},out=None):
     '''
     Cuts out the same portion of recording to compensate for AD conversion.
 
@@ -312,36 +516,81 @@ def align_channels(multichannel_rec, channel2device,cut_points={'ADC1':0,'ADC2':
         cut_points: dictionary. The sample index of the sync signals first rising edge. Defaults to zero delay across
                                 channels of both AD converters. This is index from which the 'cut' will be made to
                                 create a time-aligned recording across all ADC devices
+
+        out: n_alignedsamples x Nchannels np.array or None. Array to fill with the time-aligned
+                                recording. Defaults to None, in which case a float32 array is
+                                allocated - or, if all devices have the same cut point and the
+                                recording is already float32, a view into multichannel_rec is returned.
     Outputs:
         rec_timealigned: n_alignedsamples x Nchannels np.array. The time-aligned
                              multi-channel recording
 
     '''
+    # now look at which rising edge occurs the latest, which device has the lowest samples recorded :
+    lowest_samples = min([ multichannel_rec.shape[0] - cutpoint for cutpoint in cut_points.values()])
+    nchannels = multichannel_rec.shape[1]
+
+    same_cutpoint = len(set(cut_points.values())) == 1
+    if out is None and same_cutpoint and multichannel_rec.dtype == np.float32:
+        cutpoint = list(cut_points.values())[0]
+        return(multichannel_rec[cutpoint:cutpoint+lowest_samples,:])
+
+    if out is None:
+        rec_timealigned = np.zeros((lowest_samples,nchannels), dtype=np.float32)
+    elif out.shape == (lowest_samples,nchannels):
+        rec_timealigned = out
+    else:
+        raise ValueError('The out array has shape '+str(out.shape)+' instead of '+
+                         str((lowest_samples,nchannels)))
 
-    commonstart_ch = {}
     #cut out the inequal multichannel snippets from the common sample onwards
     for each_device,cutpoint in cut_points.items():
-        commonstart_ch[each_device] = multichannel_rec[cutpoint:,channel2device[each_device]]
-
+        device_channels = channel2device[each_device]
+        channel_slice = contiguous_channel_slice(device_channels)
 
-    # now look at which rising edge occurs the latest, which device has the lowest samples recorded :
-    numsamples = []
-    for each_device,common_ch in commonstart_ch.items():
-        numsamples.append(common_ch.shape[0])
+        if channel_slice is not None:
+            rec_timealigned[:,channel_slice] = multichannel_rec[cutpoint:cutpoint+lowest_samples,channel_slice]
+        else:
+            # copy channel by channel to avoid a temporary copy of the device's channels
+            for each_channel in device_channels:
+                rec_timealigned[:,each_channel] = multichannel_rec[cutpoint:cutpoint+lowest_samples,each_channel]
 
-    lowest_samples = min(numsamples)
+    return(rec_timealigned)
 
-    # and now make all the channels of the same size + column stack:
-    nchannels = multichannel_rec.shape[1]
-    rec_timealigned = np.float16(np.zeros((lowest_samples,nchannels)))
+def align_channels_views(multichannel_rec, channel2device, cut_points):
+    '''
+    Zero-copy version of align_channels. Instead of one array, returns a view into
+    multichannel_rec for each device.
 
-    for each_device,common_ch in commonstart_ch.items():
+    Inputs:
+        multichannel_rec, channel2device, cut_points : see align_channels. The channels of
+                        each device must be contiguous, eg. range(8) and range(8,16).
+    Outputs:
+        device_views : dictionary. keys are the device names and entries the
+                       n_alignedsamples x Ndevicechannels views of each device's time-aligned channels.
+    '''
+    lowest_samples = min([ multichannel_rec.shape[0] - cutpoint for cutpoint in cut_points.values()])
 
-        device_channels = channel2device[each_device]
-        rec_timealigned[:,device_channels] = common_ch[:lowest_samples,:]
+    device_views = {}
+    for each_device,cutpoint in cut_points.items():
+        channel_slice = contiguous_channel_slice(channel2device[each_device])
+        if channel_slice is None:
+            raise ValueError('The channels of device '+str(each_device)+' are not contiguous')
+        device_views[each_device] = multichannel_rec[cutpoint:cutpoint+lowest_samples,channel_slice]
 
+    return(device_views)
 
-    return(rec_timealigned)
+def contiguous_channel_slice(channels):
+    '''
+    Returns a slice object selecting the same channels if they are contiguous
+    and in ascending order, and None otherwise.
+    '''
+    channels = list(channels)
+    if len(channels) == 0:
+        return(None)
+    if channels == list(range(channels[0], channels[-1]+1)):
+        return(slice(channels[0], channels[-1]+1))
+    return(None)
 
 def save_as_singlewav_timestamped(multichannel_rec, fs, file_start='Mic',**kwargs):
     '''
@@ -365,6 +614,474 @@ def save_as_singlewav_timestamped(multichannel_rec, fs, file_start='Mic',**kwarg
 
     '''
 
+    saved_filenames = make_singlewav_filenames(multichannel_rec.shape[1],
+                                               file_start, **kwargs)
+
+    for each_column, saved_filename in enumerate(saved_filenames):
+        write_wavfile(multichannel_rec[:,each_column],fs,saved_filename)
+
+    pass
+
+
+def memmap_wavfile(fileaddress):
+    '''
+    memory-maps the data chunk of a wav file instead of reading it into RAM.
+
+    Returns:
+        fs : integer. sampling rate in Hertz
+        rec : nsamples x nchannels np.memmap with the raw samples of the wav file.
+              Use normalise_samples on (parts of) it to get -1 <= values <= 1
+    '''
+    fs, rec = scipy.io.wavfile.read(fileaddress, mmap=True)
+    if rec.ndim == 1:
+        rec = rec.reshape(-1, 1)
+    return(fs, rec)
+
+class flac_group_reader():
+    '''
+    Reads the FLAC files of a recording that the compressed_writer split into
+    groups of up to 8 channels (see disk_writer) like one nsamples x nchannels
+    array. Only rec[rows, channel] is supported, as used by
+    timealign_and_save_inchunks. The last rows read from each file are kept,
+    so that reading all channels of a group for the same rows decodes the
+    file only once.
+    '''
+    def __init__(self, filenames):
+        self.filenames = filenames
+        infos = [ soundfile.info(each) for each in filenames]
+        self.fs = infos[0].samplerate
+        self.first_channels = np.cumsum([0] + [ each.channels for each in infos])
+        self.shape = (min([ each.frames for each in infos]), int(self.first_channels[-1]))
+        self.dtype = np.dtype('float32')
+        self.decoded = {}
+
+    def __getitem__(self, key):
+        rows, channel = key
+        start, stop, step = rows.indices(self.shape[0])
+        group = int(np.searchsorted(self.first_channels, channel, side='right')) - 1
+        if group not in self.decoded or self.decoded[group][0] != (start, stop):
+            data, fs = soundfile.read(self.filenames[group], start=start, stop=stop,
+                                      dtype='float32', always_2d=True)
+            self.decoded[group] = ((start, stop), data)
+        return(self.decoded[group][1][::step, channel - self.first_channels[group]])
+
+flac_group_suffix = re.compile(r'_ch\d\d-\d\d\.flac$')
+
+def multiwav_file_parts(fileaddress):
+    '''
+    Returns the files a recording is saved in : the file itself, or for a
+    MULTIWAV_....flac recording with more than 8 channels its
+    MULTIWAV_..._chNN-NN.flac channel groups in the order of their channels.
+    '''
+    if os.path.exists(fileaddress):
+        return([fileaddress])
+    if fileaddress.endswith('.flac'):
+        group_files = sorted(glob.glob(glob.escape(fileaddress[:-len('.flac')])+
+                                       '_ch[0-9][0-9]-[0-9][0-9].flac'))
+        if len(group_files) > 0:
+            return(group_files)
+    raise IOError('Could not find the recording: '+fileaddress)
+
+def find_multiwav_files(folder):
+    '''
+    Returns the MULTIWAV_*.WAV and MULTIWAV_*.flac recordings in a folder. The
+    FLAC channel groups of a recording are listed once, as MULTIWAV_....flac
+    (see multiwav_file_parts).
+
+    If the recorder's FLAC encoders fell behind during a recording, its start
+    is saved in the FLAC files and the rest in MULTIWAV_..._raw.WAV. These are
+    listed, and aligned, as two separate recordings.
+    '''
+    wav_files = glob.glob(os.path.join(folder, 'MULTIWAV_*.WAV'))
+    flac_files = set([ flac_group_suffix.sub('.flac', each)
+                           for each in glob.glob(os.path.join(folder, 'MULTIWAV_*.flac'))])
+    return(sorted(wav_files + list(flac_files)))
+
+def open_multiwav_file(fileaddress):
+    '''
+    Opens a recording for reading in chunks, without reading it into RAM.
+
+    Returns:
+        fs : integer. sampling rate in Hertz
+        rec : nsamples x nchannels np.memmap of a wav file, see memmap_wavfile,
+              or flac_group_reader of a FLAC recording.
+    '''
+    if fileaddress.endswith('.flac'):
+        rec = flac_group_reader(multiwav_file_parts(fileaddress))
+        return(rec.fs, rec)
+    return(memmap_wavfile(fileaddress))
+
+def read_multiwav_file(fileaddress):
+    '''
+    Reads a whole wav file or FLAC recording into a np.array with -1 <= values <= 1,
+    see read_wavfile.
+    '''
+    if not fileaddress.endswith('.flac'):
+        return(read_wavfile(fileaddress))
+    channel_groups = [ soundfile.read(each, dtype='float32', always_2d=True)
+                                      for each in multiwav_file_parts(fileaddress)]
+    num_samples = min([ data.shape[0] for data, fs in channel_groups])
+    rec = np.column_stack([ data[:num_samples] for data, fs in channel_groups])
+    return(channel_groups[0][1], rec)
+
+def normalise_samples(rec):
+    '''
+    converts a chunk of samples into a float32 np.array with -1 <= values <= 1
+    in the same way as read_wavfile, but based only on the dtype so that the
+    whole file does not need to be checked.
+    '''
+    normalise_values = {'int16':lambda X : X/(-1 + 2.0**15) ,
+                        'int32':lambda X : X/(-1 + 2.0**31),
+                       }
+    if str(rec.dtype) in normalise_values:
+        return(np.float32(normalise_values[str(rec.dtype)](rec)))
+    elif str(rec.dtype) in ['float32','float64']:
+        return(np.float32(rec))
+    else:
+        raise ValueError('dtype of this wav file cannot be converted into \
+        -1 to +1 bounded np array - please try another function to \
+        load this wav file')
+
+def timealign_and_save_inchunks(fileaddress, channels2devices={'1':range(12),'2':range(12,24)},
+                                syncch2device={'1':7,'2':19}, file_start='Mic', **kwargs):
+    '''
+    Out-of-core version of timealign_channels followed by save_as_singlewav_timestamped.
+
+    The wav file is memory-mapped, or the FLAC files of the recording decoded
+    chunk by chunk, and the cut points are found on only the first few seconds
+    of the sync channels. The time-aligned channels are then written
+    chunk by chunk into single channel wav files, so the peak memory use depends
+    on the chunk size and not on the length of the recording.
+
+    Inputs:
+        fileaddress : string. path to the multichannel wav file or FLAC recording,
+                      see multiwav_file_parts
+
+        channels2devices, syncch2device : dictionaries. see timealign_channels
+
+        file_start : string. the common string at the beginning of all channels.
+                Defaults to 'Mic'
+
+    **kwargs:
+        file_timestamp : string. see save_as_singlewav_timestamped.
+
+        chunk_durn : float. Duration in seconds of the chunks that are aligned and
+                     written at a time. Defaults to 5 seconds.
+
+        prefix_durn : float. Duration in seconds of the start of the sync channels
+                      that is searched for the first rising edge. Defaults to 2 seconds.
+
+        with_sync : Boolean. defaults to False. If True, the time-aligned sync
+                    channels are also saved.
+
+        template, fps : see detect_first_rising_edge
+
+        use_sync_log : Boolean. defaults to True. If True and the recorder saved a
+                       fileaddress.sync.json log with cut points (see fieldrecorder.sync_log),
+                       the cut points are taken from the log and the sync channels
+                       are not searched.
+
+        multichannel : Boolean. defaults to False. If True, all time-aligned channels
+                       are saved into one multichannel file with a channel metadata
+                       sidecar, see save_as_multichannel_timestamped.
+
+        output_format : string. format of the multichannel file, see
+                        save_as_multichannel_timestamped.
+
+    Returns:
+
+        saved_files : list with the names of the saved wav files
+    '''
+    fs, multich_rec = open_multiwav_file(fileaddress)
+
+    if not len(syncch2device) == len(channels2devices):
+        raise ValueError('Incorrect number of sync channels or devices  have been assigned.')
+
+    if kwargs.get('use_sync_log', True):
+        cutpoints = cutpoints_from_sync_log(read_sync_log(fileaddress), syncch2device)
+    else:
+        cutpoints = None
+
+    if cutpoints is None:
+        prefix_samples = min(int(kwargs.get('prefix_durn', 2.0)*fs), multich_rec.shape[0])
+        edge_kwargs = { key:kwargs[key] for key in ['template','fps'] if key in kwargs}
+
+        cutpoints = {}
+        for each_device, sync_ch in syncch2device.items():
+            sync_prefix = normalise_samples(multich_rec[:prefix_samples, sync_ch])
+            cutpoints[each_device] = detect_first_rising_edge(sync_prefix, fs, **edge_kwargs)
+        cutpoints = match_sync_periods(cutpoints, int(fs/kwargs.get('fps', 25)))
+
+    lowest_samples = min([ multich_rec.shape[0] - cutpoint for cutpoint in cutpoints.values()])
+
+    sync_chlist = [ch_index for eachdevice,ch_index in syncch2device.items()]
+    if kwargs.get('with_sync', False):
+        output_channels = range(multich_rec.shape[1])
+    else:
+        output_channels = sorted(set(range(multich_rec.shape[1])) - set(sync_chlist))
+
+    channel2cutpoint = {}
+    for each_device, device_channels in channels2devices.items():
+        for each_channel in device_channels:
+            channel2cutpoint[each_channel] = cutpoints[each_device]
+
+    chunk_samples = int(kwargs.get('chunk_durn', 5.0)*fs)
+    multichannel = kwargs.get('multichannel', False)
+
+    if multichannel:
+        output_format = kwargs.get('output_format', 'RF64')
+        saved_filenames = [make_multichannel_filename(file_start, **kwargs)]
+        output_files = [ open_multichannel_file(saved_filenames[0], fs,
+                                                len(output_channels), output_format)]
+    else:
+        saved_filenames = make_singlewav_filenames(len(output_channels), file_start, **kwargs)
+        output_files = [ soundfile.SoundFile(each_name, mode='w', samplerate=fs,
+                                             channels=1, subtype='FLOAT')
+                                         for each_name in saved_filenames]
+    try:
+        for chunk_start in range(0, lowest_samples, chunk_samples):
+            chunk_stop = min(chunk_start + chunk_samples, lowest_samples)
+            if multichannel:
+                aligned_chunk = np.empty((chunk_stop-chunk_start, len(output_channels)),
+                                         dtype=np.float32)
+                for column, each_channel in enumerate(output_channels):
+                    cutpoint = channel2cutpoint[each_channel]
+                    aligned_chunk[:,column] = normalise_samples(
+                             multich_rec[cutpoint+chunk_start:cutpoint+chunk_stop, each_channel])
+                output_files[0].write(aligned_chunk)
+            else:
+                for each_file, each_channel in zip(output_files, output_channels):
+                    cutpoint = channel2cutpoint[each_channel]
+                    chunk = multich_rec[cutpoint+chunk_start:cutpoint+chunk_stop, each_channel]
+                    each_file.write(normalise_samples(chunk))
+    finally:
+        for each_file in output_files:
+            each_file.close()
+
+    if multichannel:
+        channel_metadata = make_channel_metadata(output_channels, channels2devices,
+                                                 cutpoints)
+        write_channel_metadata(saved_filenames[0], fs, channel_metadata,
+                               source_file=os.path.basename(fileaddress))
+
+    for each_name in saved_filenames:
+        print('Saved file:'+each_name)
+
+    return(saved_filenames)
+
+def read_sync_log(fileaddress):
+    '''
+    reads the fileaddress.sync.json log the recorder saved with a recording, see
+    fieldrecorder.sync_log. Returns None if there is no log.
+    '''
+    if not os.path.exists(fileaddress+'.sync.json'):
+        return(None)
+    with open(fileaddress+'.sync.json') as sidecar:
+        return(json.load(sidecar))
+
+def cutpoints_from_sync_log(sync_log, syncch2device):
+    '''
+    Inputs:
+        sync_log : dictionary or None. see read_sync_log
+        syncch2device : dictionary. see timealign_channels
+
+    Returns:
+        cutpoints : dictionary with the first rising edge of each device in the
+                    file, or None if there is no log, it was made with other sync
+                    channels or it has no cut points.
+
+    The sync channels are the columns of the file, not the input channels of the
+    soundcard. A warning is given if the log was made with other sync channels,
+    and if the devices drift apart by one sample or more within the file, as the
+    same cut points are used for the whole file.
+    '''
+    if sync_log is None or sync_log.get('cutpoints') is None:
+        return(None)
+    if not sync_log['syncch2device'] == { str(device):int(channel)
+                                      for device, channel in syncch2device.items()}:
+        warnings.warn('The sync log was made with the sync channels '+
+                      str(sync_log['syncch2device'])+', not '+str(syncch2device)+
+                      ', searching the sync channels instead')
+        return(None)
+
+    if sync_log.get('drift') is not None:
+        largest_change = max([ abs(each) for each in sync_log['drift']['offset_change'].values()])
+        if largest_change >= 1:
+            warnings.warn('The AD converters drifted apart by %.1f samples within the file'%(
+                           largest_change))
+    return({ device:sync_log['cutpoints'][str(device)] for device in syncch2device})
+
+def match_sync_periods(cutpoints, period_samples):
+    '''
+    Moves the cut points of the devices whose first rising edge was found one or
+    more sync periods before that of the other devices onto the same period.
+
+    The first rising edge of each device is searched separately. When the edges
+    of some devices lie just after the first half sync period of the file and
+    those of others just before it, they are found in neighbouring periods.
+
+    Inputs:
+        cutpoints : dictionary with the first rising edge of each device
+        period_samples : integer. samples per sync period
+
+    Returns:
+        matched_cutpoints : dictionary. The cut points are assumed to be less than
+                            half a sync period apart, like the offsets of the devices.
+    '''
+    latest = max(cutpoints.values())
+    return({ device: cutpoint + int(round((latest - cutpoint)/float(period_samples)))*period_samples
+                for device, cutpoint in cutpoints.items()})
+
+multichannel_formats = {'RF64':'.WAV', 'WAV':'.WAV', 'W64':'.w64', 'FLAC':'.flac'}
+
+def save_as_multichannel_timestamped(multichannel_rec, fs, file_start='Mic',
+                                     channel_metadata=None, **kwargs):
+    '''
+    Alternative to save_as_singlewav_timestamped which saves all channels into one
+    multichannel file with a JSON sidecar holding the per-channel metadata :
+
+    MicALL_YYYY-MM-DD_HH-mm-SS_NNNNNNN.WAV
+    MicALL_YYYY-MM-DD_HH-mm-SS_NNNNNNN.WAV.json
+
+    Single channels can then be read lazily with read_channel.
+
+    Inputs:
+
+    multichannel_rec : nsamples x Nchannels numpy array.
+    file_start : string. the common string at the beginning of the file name.
+                Defaults to 'Mic'
+    channel_metadata : list with one dictionary per channel or None.
+                Defaults to None, which only stores the channel names (Mic00, Mic01...)
+
+    **kwargs:
+    file_timestamp : string. see save_as_singlewav_timestamped.
+    output_format : string. One of 'RF64' (default, a WAV file that can grow beyond 4GB),
+                    'WAV', 'W64' or 'FLAC' (lossless compressed, max. 8 channels).
+
+    Returns:
+    saved_filename : string.
+    '''
+    output_format = kwargs.get('output_format', 'RF64')
+    saved_filename = make_multichannel_filename(file_start, **kwargs)
+    nchannels = multichannel_rec.shape[1]
+
+    if channel_metadata is None:
+        channel_metadata = make_channel_metadata(range(nchannels))
+
+    with open_multichannel_file(saved_filename, fs, nchannels, output_format) as output_file:
+        output_file.write(multichannel_rec)
+    write_channel_metadata(saved_filename, fs, channel_metadata)
+
+    print('Saved file:'+saved_filename)
+    return(saved_filename)
+
+def make_multichannel_filename(file_start, **kwargs):
+    '''
+    makes the file name of a multichannel file, eg. MicALL_YYYY-MM-DD_HH-mm-SS_NNNNNNN.WAV
+    The extension is set by the output_format kwarg, see save_as_multichannel_timestamped.
+    '''
+    output_format = kwargs.get('output_format', 'RF64')
+    if output_format not in multichannel_formats:
+        raise ValueError('Unknown output format: '+str(output_format)+
+                         ' use one of '+str(sorted(multichannel_formats.keys())))
+
+    saved_timestamp = make_singlewav_filenames(1, '', **kwargs)[0][3:]
+    saved_timestamp = saved_timestamp.replace('.WAV','').replace('.wav','')
+    return(file_start+'ALL_'+saved_timestamp+multichannel_formats[output_format])
+
+def open_multichannel_file(filename, fs, nchannels, output_format='RF64'):
+    '''
+    opens a soundfile.SoundFile for writing in the given format. FLAC files are
+    saved with 24 bit samples, all others with 32 bit floating point samples.
+    '''
+    if output_format == 'FLAC':
+        if nchannels > 8:
+            raise ValueError('FLAC files can hold at most 8 channels, use RF64 or W64')
+        subtype = 'PCM_24'
+    else:
+        subtype = 'FLOAT'
+    return(soundfile.SoundFile(filename, mode='w', samplerate=fs, channels=nchannels,
+                               format=output_format, subtype=subtype))
+
+def make_channel_metadata(output_channels, channels2devices=None, cutpoints=None):
+    '''
+    makes one dictionary per output channel with its name (MicNN), the index of the
+    channel in the original recording and, if known, the AD converter it was recorded
+    on and the cut point used to time-align it.
+    '''
+    channel_metadata = []
+    for column, each_channel in enumerate(output_channels):
+        metadata = {'name':'Mic%0.02d'%column, 'recorded_channel':int(each_channel)}
+        if channels2devices is not None:
+            for each_device, device_channels in channels2devices.items():
+                if each_channel in device_channels:
+                    metadata['device'] = each_device
+                    if cutpoints is not None:
+                        metadata['cutpoint'] = int(cutpoints[each_device])
+        channel_metadata.append(metadata)
+    return(channel_metadata)
+
+def write_channel_metadata(filename, fs, channel_metadata, **kwargs):
+    '''
+    writes the channel metadata of a multichannel file into filename.json.
+    Any kwargs are saved as additional entries.
+    '''
+    metadata = {'fs':fs, 'channels':channel_metadata}
+    metadata.update(kwargs)
+    with open(filename+'.json', 'w') as sidecar:
+        json.dump(metadata, sidecar, indent=1)
+
+def read_channel_metadata(filename):
+    with open(filename+'.json') as sidecar:
+        return(json.load(sidecar))
+
+def read_channel(filename, channel, start=0, stop=None, blocksize=2**16):
+    '''
+    reads one channel of a multichannel file without loading the other channels
+    into memory.
+
+    WAV and RF64 files are memory-mapped, so that only the data of the
+    requested channel is touched. Other formats are read block by block.
+
+    Inputs:
+        filename : string.
+        channel : integer or string. column index of the channel, or its name in the
+                  channel metadata (eg. 'Mic03').
+        start, stop : integers. first and last+1 sample to read. Defaults to the whole file.
+                      Out of range values are clipped as when slicing an array.
+        blocksize : integer. number of samples read at a time for non-WAV files.
+    Returns:
+        one_channel : np.array with -1 <= values <= 1
+    '''
+    if not isinstance(channel, numbers.Integral):
+        channel_names = [ each['name'] for each in read_channel_metadata(filename)['channels']]
+        channel = channel_names.index(channel)
+
+    if soundfile.info(filename).format in ['WAV', 'RF64']:
+        fs, rec = memmap_wavfile(filename)
+        return(normalise_samples(rec[start:stop, channel]))
+
+    with soundfile.SoundFile(filename) as multichannel_file:
+        # same bounds as slicing the memory-mapped WAV data
+        start, stop, _ = slice(start, stop).indices(multichannel_file.frames)
+        stop = max(start, stop)
+        one_channel = np.empty(stop-start, dtype=np.float32)
+        multichannel_file.seek(start)
+        for block_start in range(0, stop-start, blocksize):
+            block = multichannel_file.read(min(blocksize, stop-start-block_start),
+                                           dtype='float32', always_2d=True)
+            one_channel[block_start:block_start+block.shape[0]] = block[:,channel]
+    return(one_channel)
+
+def make_singlewav_filenames(num_channels, file_start='Mic', **kwargs):
+    '''
+    makes the MicNN_YYYY-MM-DD_HH-mm-SS_NNNNNNN.WAV file names used by
+    save_as_singlewav_timestamped.
+
+    **kwargs:
+    file_timestamp : string. the common timestamp to be appended to all separate wav files.
+                    Defaults to the current time stamp
+    '''
     if not 'file_timestamp' in kwargs.keys():
         time_stamp = datetime.datetime.now()
         fmtd_timestamp = time_stamp.strftime('%Y-%m-%d_%H-%M-%S')
@@ -378,16 +1095,12 @@ def save_as_singlewav_timestamped(multichannel_rec, fs, file_start='Mic',**kwarg
     else:
         end_format = '.WAV'
 
-
-    for each_column in range(multichannel_rec.shape[1]):
-        filename_start = file_start
+    filenames = []
+    for each_column in range(num_channels):
         mic_index = '%0.02d'%each_column
-        filename_end = saved_timestamp
-        saved_filename = filename_start+ mic_index +'_'+ filename_end + end_format
-
-        write_wavfile(multichannel_rec[:,each_column],fs,saved_filename)
+        filenames.append(file_start+ mic_index +'_'+ saved_timestamp + end_format)
 
-    pass
+    return(filenames)
 
 
 def check_for_overlaps(channels2something):
@@ -423,16 +1136,152 @@ def check_for_overlaps(channels2something):
     return(False)
 
 
+def timealign_multiwav_file(fileaddress, output_dir, channels2devices, syncch2device,
+                            out_of_core=True, output_format=None):
+    '''
+    time-aligns one MULTIWAV_YYYY-MM-DD_HH-mm-SS_NNNNNNNNNN.WAV file, or the
+    FLAC files of a MULTIWAV_YYYY-MM-DD_HH-mm-SS_NNNNNNNNNN.flac recording, and saves
+    each channel as MicNN_YYYY-MM-DD_HH-mm-SS_NNNNNNNNNN.WAV in output_dir.
+    If an output_format is given all channels are saved into one
+    MicALL_YYYY-MM-DD_HH-mm-SS_NNNNNNNNNN file instead.
+
+    Inputs:
+        fileaddress : string. path to the MULTIWAV file, see multiwav_file_parts
+        output_dir : string. folder to save the single channel files in
+        channels2devices, syncch2device : dictionaries. see timealign_channels
+        out_of_core : Boolean. If True uses timealign_and_save_inchunks, otherwise
+                      timealign_channels followed by save_as_singlewav_timestamped.
+        output_format : string or None. multichannel file format, see
+                        save_as_multichannel_timestamped. Defaults to None, which
+                        saves single channel files.
+
+    Returns:
+        fileaddress : the input fileaddress, to identify the file when run in parallel
+    '''
+    file_timestamp = os.path.splitext(os.path.basename(fileaddress))[0].replace('MULTIWAV_','')
+    file_start = os.path.join(output_dir, 'Mic')
+
+    if out_of_core:
+        timealign_and_save_inchunks(fileaddress, channels2devices, syncch2device,
+                                    file_start=file_start, file_timestamp=file_timestamp,
+                                    multichannel=output_format is not None,
+                                    output_format=output_format)
+    else:
+        fs,rec = read_multiwav_file(fileaddress)
+        rec_taligned = timealign_channels(rec,fs,channels2devices,syncch2device,
+                                          sync_log=read_sync_log(fileaddress))
+        if output_format is None:
+            save_as_singlewav_timestamped(rec_taligned,fs,file_start=file_start,
+                                          file_timestamp=file_timestamp)
+        else:
+            save_as_multichannel_timestamped(rec_taligned, fs, file_start=file_start,
+                                             file_timestamp=file_timestamp,
+                                             output_format=output_format)
+    return(fileaddress)
+
+def batch_timealign_folder(folder, output_dir=None, num_workers=None,
+                           channels2devices={'1':range(12),'2':range(12,24)},
+                           syncch2device={'1':7,'2':19}, out_of_core=True,
+                           output_format=None):
+    '''
+    time-aligns all the MULTIWAV_*.WAV files and MULTIWAV_*.flac recordings in a
+    folder in parallel processes, see find_multiwav_files.
+
+    The names of the processed files are added to processed_files.txt in the
+    output folder. Files listed there are skipped when the folder is processed
+    again, eg. after an interrupted run.
+
+    Inputs:
+        folder : string. folder with the MULTIWAV files.
+        output_dir : string or None. folder to save the single channel files in.
+                     Defaults to None, which saves them in folder.
+        num_workers : integer or None. number of parallel processes. Defaults to
+                      None, which uses as many processes as there are CPUs.
+        channels2devices, syncch2device : dictionaries. see timealign_channels
+        out_of_core, output_format : see timealign_multiwav_file
+
+    Returns:
+        throughput : dictionary with the 'num_files', 'gigabytes', 'files_per_second'
+                     and 'gigabytes_per_second' of the files processed in this run.
+    '''
+    if output_dir is None:
+        output_dir = folder
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    processed_list = os.path.join(output_dir, 'processed_files.txt')
+    if os.path.exists(processed_list):
+        with open(processed_list) as processed:
+            already_processed = set([ line.strip() for line in processed])
+    else:
+        already_processed = set()
+
+    all_files = find_multiwav_files(folder)
+    files_to_process = [ each for each in all_files
+                                if os.path.basename(each) not in already_processed]
+    print('Skipping '+str(len(all_files)-len(files_to_process))+
+          ' already processed files, processing '+str(len(files_to_process))+' files')
+
+    num_bytes = 0
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        jobs = [ executor.submit(timealign_multiwav_file, each, output_dir,
+                                 channels2devices, syncch2device, out_of_core,
+                                 output_format)
+                                                    for each in files_to_process]
+        for job in concurrent.futures.as_completed(jobs):
+            try:
+                fileaddress = job.result()
+            except Exception as error:
+                print('FAILED to time-align a file: '+str(error))
+                continue
+            num_bytes += sum([ os.path.getsize(each)
+                                   for each in multiwav_file_parts(fileaddress)])
+            with open(processed_list, 'a') as processed:
+                processed.write(os.path.basename(fileaddress)+'\n')
+
+    durn = max(time.time() - start, 10**-6)
+    num_done = sum([ job.exception() is None for job in jobs])
+    throughput = {'num_files':num_done, 'gigabytes':num_bytes/10.0**9,
+                  'files_per_second':num_done/durn,
+                  'gigabytes_per_second':num_bytes/10.0**9/durn}
+    print('Processed %d files (%.2f GB) in %.1f s : %.2f files/s, %.3f GB/s'%(
+                  num_done, throughput['gigabytes'], durn,
+                  throughput['files_per_second'], throughput['gigabytes_per_second']))
+    return(throughput)
+
+
 check_allare_int = lambda some_list: all(isinstance(item, int) for item in some_list)
 # thanks Dragan Chupacabric : https://stackoverflow.com/questions/6009589/how-to-test-if-every-item-in-a-list-of-type-int
 check_allare_np = lambda some_list: all(isinstance(item, np.ndarray) for item in some_list)
 
 if __name__ == '__main__':
-    os.chdir('C:\\Users\\tbeleyur\\Desktop\\test\\')
-    fs,rec = read_wavfile('MULTIWAV_2017-11-28_15-42-03_1511880123.WAV')
-    ch2dev = {'1':range(8),'2':range(8,16)}
-    sync2dev = {'1':7,'2':15}
-    rec_taligned = timealign_channels(rec,fs=192000,channels2devices=ch2dev,syncch2device=sync2dev)
-
-    save_as_singlewav_timestamped(rec_taligned,fs,file_start='Mic',file_timestamp='2017-11-28_15-42-03_1511880123.WAV')
-
+    parser = argparse.ArgumentParser(description='Time-align all MULTIWAV_*.WAV and '
+                                     'MULTIWAV_*.flac recordings in a folder and save each '
+                                     'channel as a single wav file')
+    parser.add_argument('folder', help='folder with the MULTIWAV_*.WAV and MULTIWAV_*.flac files')
+    parser.add_argument('--output-dir', default=None,
+                        help='folder for the single channel files. Defaults to the input folder')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of parallel processes. Defaults to the number of CPUs')
+    parser.add_argument('--num-channels', type=int, default=16,
+                        help='number of channels in each MULTIWAV file, split equally across '
+                        'devices. Defaults to the 16 channels the recorders save')
+    parser.add_argument('--sync-channels', type=int, nargs='+', default=[7,15],
+                        help='channel of the sync signal of each device in the MULTIWAV files')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='read each whole file into memory instead of aligning it in chunks')
+    parser.add_argument('--multichannel', default=None, choices=sorted(multichannel_formats),
+                        help='save all aligned channels into one file of this format '
+                        'instead of one wav file per channel')
+    args = parser.parse_args()
+
+    num_devices = len(args.sync_channels)
+    channels_per_device = args.num_channels//num_devices
+    ch2dev = { str(i+1):range(i*channels_per_device,(i+1)*channels_per_device)
+                                                  for i in range(num_devices)}
+    sync2dev = { str(i+1):sync_ch for i,sync_ch in enumerate(args.sync_channels)}
+
+    batch_timealign_folder(args.folder, args.output_dir, num_workers=args.workers,
+                           channels2devices=ch2dev, syncch2device=sync2dev,
+                           out_of_core=not args.in_memory, output_format=args.multichannel)
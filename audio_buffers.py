@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Preallocated buffers used to move audio between the soundcard and the rest of
+the fieldrecorder modules.
+
+All buffers here are allocated once when they are created, so that nothing in
+the acquisition path has to allocate memory per block.
+
+block_ringbuffer : a single-writer, multiple-reader ring of audio blocks. The
+                   soundcard callback is the only writer, and it only performs
+                   one memory copy per block. Each consumer reads through its
+                   own ringbuffer_reader and can therefore not hold up the
+                   writer or the other consumers.
+
+pretrigger_buffer : a circular buffer holding the last few seconds of audio
+                    so that a triggered recording can also include the audio
+                    from just before the trigger.
+
+bout_buffer : a buffer holding one whole recording bout. Each block is
+              written directly into its slice of the buffer.
+
+"""
+import threading
+import numpy as np
+
+
+class block_ringbuffer():
+
+    def __init__(self, num_slots, blocksize, num_channels, dtype='float32'):
+        '''
+        Inputs:
+            num_slots : integer >0. Number of audio blocks the ring can hold
+                        before the oldest block is overwritten.
+            blocksize : integer >0. Maximum number of samples per block.
+            num_channels : integer >0. Number of channels per block.
+            dtype : string. Sample format of the stored audio. Defaults to
+                    'float32', which is what sounddevice delivers by default.
+        '''
+        self.num_slots = int(num_slots)
+        self.blocksize = int(blocksize)
+        self.num_channels = int(num_channels)
+
+        self.blocks = np.zeros((self.num_slots, self.blocksize, self.num_channels),
+                               dtype=dtype)
+        self.frames = np.zeros(self.num_slots, dtype=np.int64)
+        self.overflowed = np.zeros(self.num_slots, dtype=bool)
+
+        # only ever incremented by the writer. Readers compare their own
+        # read counts against it, so no lock is needed.
+        self.write_count = 0
+
+    def put(self, block, overflowed=False):
+        '''
+        Copies one block of audio into the next slot of the ring.
+        This is meant to be called from the soundcard callback and does no
+        work beyond the copy itself.
+
+        Inputs:
+            block : nsamples x nchannels np.array, with nsamples <= blocksize
+            overflowed : Boolean. Whether the soundcard reported an input
+                         overflow for this block.
+        '''
+        slot = self.write_count % self.num_slots
+        nframes = block.shape[0]
+        self.blocks[slot, :nframes, :] = block
+        self.frames[slot] = nframes
+        self.overflowed[slot] = overflowed
+        self.write_count += 1
+
+    def new_reader(self):
+        '''
+        Returns a ringbuffer_reader which starts reading from the next block
+        that is put into the ring.
+        '''
+        return(ringbuffer_reader(self))
+
+
+class ringbuffer_reader():
+
+    def __init__(self, ringbuffer):
+        '''
+        Inputs:
+            ringbuffer : block_ringbuffer instance to read from.
+        '''
+        self.ringbuffer = ringbuffer
+        self.read_count = ringbuffer.write_count
+        self.dropped_blocks = 0
+
+    def blocks_available(self):
+        return(self.ringbuffer.write_count - self.read_count)
+
+    def read(self):
+        '''
+        Reads the oldest unread block from the ring.
+
+        If the writer has lapped this reader, the overwritten blocks are
+        skipped and counted in self.dropped_blocks.
+
+        Returns:
+            data : nsamples x nchannels np.array or None if there is no unread
+                   block. This is a view into the ring - copy it if it needs to
+                   be kept for longer than num_slots-1 blocks.
+            overflowed : Boolean. Input overflow flag reported for the block.
+                         Together with data this mirrors the output of
+                         sounddevice.Stream.read.
+        '''
+        ring = self.ringbuffer
+        available = ring.write_count - self.read_count
+
+        if available <= 0:
+            return(None, False)
+
+        if available > ring.num_slots - 1:
+            # the slot being written right now may also be corrupt, so keep
+            # one slot of distance to the writer
+            lost_blocks = available - (ring.num_slots - 1)
+            self.dropped_blocks += lost_blocks
+            self.read_count += lost_blocks
+
+        slot = self.read_count % ring.num_slots
+        data = ring.blocks[slot, :ring.frames[slot], :]
+        overflowed = bool(ring.overflowed[slot])
+        self.read_count += 1
+
+        return(data, overflowed)
+
+
+class pretrigger_buffer():
+
+    def __init__(self, num_samples, num_channels, channels=None, dtype='float32'):
+        '''
+        Inputs:
+            num_samples : integer >0. Number of the most recent samples kept.
+            num_channels : integer >0. Number of channels in the incoming blocks.
+            channels : array-like with integers or None. Indices of the channels
+                       to keep. Defaults to None, which keeps all channels.
+            dtype : string. Sample format of the stored audio.
+        '''
+        self.num_samples = int(num_samples)
+        if channels is None:
+            self.channels = None
+            kept_channels = num_channels
+        else:
+            self.channels = np.array(channels, dtype=np.intp)
+            kept_channels = self.channels.size
+
+        self.samples = np.zeros((self.num_samples, kept_channels), dtype=dtype)
+        self.write_index = 0
+        self.num_filled = 0
+
+        # cleared while the contents are still being written to file
+        self.released = threading.Event()
+        self.released.set()
+        self.skipped_blocks = 0
+
+    def put(self, block):
+        '''
+        Copies a block into the buffer, overwriting the oldest samples.
+        While the buffer is held (see hold) incoming blocks are skipped and
+        counted in self.skipped_blocks.
+
+        Inputs:
+            block : nsamples x num_channels np.array
+        '''
+        if not self.released.is_set():
+            self.skipped_blocks += 1
+            return
+
+        nframes = block.shape[0]
+        if nframes >= self.num_samples:
+            self._store(block[-self.num_samples:], 0)
+            self.write_index = 0
+            self.num_filled = self.num_samples
+            return
+
+        end_index = self.write_index + nframes
+        if end_index <= self.num_samples:
+            self._store(block, self.write_index)
+        else:
+            first_part = self.num_samples - self.write_index
+            self._store(block[:first_part], self.write_index)
+            self._store(block[first_part:], 0)
+
+        self.write_index = end_index % self.num_samples
+        self.num_filled = min(self.num_filled + nframes, self.num_samples)
+
+    def _store(self, block, start_index):
+        destination = self.samples[start_index:start_index+block.shape[0]]
+        if self.channels is None:
+            destination[:] = block
+        else:
+            # take into the destination directly, without a temporary copy
+            np.take(block, self.channels, axis=1, out=destination, mode='clip')
+
+    def chunks(self):
+        '''
+        Returns:
+            chunks : list with up to two views into the buffer, which together
+                     hold the buffered audio from the oldest to the newest sample.
+        '''
+        if self.num_filled < self.num_samples:
+            chunks = [self.samples[:self.write_index]]
+        else:
+            chunks = [self.samples[self.write_index:], self.samples[:self.write_index]]
+        return([ each for each in chunks if each.shape[0] > 0])
+
+    def hold(self):
+        '''
+        Stops the buffer from being overwritten, eg. while the views returned
+        by chunks are being written to file. Set the returned Event once the
+        views are no longer needed.
+
+        Returns:
+            released : threading.Event
+        '''
+        self.released.clear()
+        return(self.released)
+
+    def clear(self):
+        '''
+        Empties the buffer. The stored samples are only overwritten by the
+        next put after the buffer has been released.
+        '''
+        self.write_index = 0
+        self.num_filled = 0
+
+
+class bout_buffer():
+
+    def __init__(self, num_samples, num_channels, channels=None, dtype='float32'):
+        '''
+        Inputs:
+            num_samples : integer >0. Maximum number of samples in one bout.
+            num_channels : integer >0. Number of channels in the incoming blocks.
+            channels : array-like with integers or None. Indices of the channels
+                       to keep. Defaults to None, which keeps all channels.
+            dtype : string. Sample format of the stored audio.
+        '''
+        self.num_samples = int(num_samples)
+        if channels is None:
+            self.channels = np.arange(num_channels)
+        else:
+            self.channels = np.array(channels, dtype=np.intp)
+
+        self.samples = np.zeros((self.num_samples, self.channels.size), dtype=dtype)
+        self.num_filled = 0
+        self.samples_lost = 0
+
+        # cleared while the bout is still being written to file
+        self.released = threading.Event()
+        self.released.set()
+
+    def start(self):
+        '''
+        Empties the buffer for a new bout.
+
+        Returns:
+            started : Boolean. False if the previous bout is still held
+                      (see hold), in which case the buffer is left untouched.
+        '''
+        if not self.released.is_set():
+            return(False)
+        self.num_filled = 0
+        return(True)
+
+    def put(self, block):
+        '''
+        Copies the kept channels of a block into the next free slice. Samples
+        that do not fit into the buffer anymore are counted in self.samples_lost.
+
+        Inputs:
+            block : nsamples x num_channels np.array
+
+        Returns:
+            stored : view of the slice the block was copied into.
+        '''
+        nframes = min(block.shape[0], self.num_samples - self.num_filled)
+        self.samples_lost += block.shape[0] - nframes
+
+        stored = self.samples[self.num_filled:self.num_filled+nframes]
+        np.take(block[:nframes], self.channels, axis=1, out=stored, mode='clip')
+        self.num_filled += nframes
+        return(stored)
+
+    def recording(self):
+        '''
+        Returns:
+            recording : num_filled x Nchannels view of the current bout.
+        '''
+        return(self.samples[:self.num_filled])
+
+    def hold(self):
+        '''
+        Stops the next bout from being started while views into the buffer
+        are still being used, eg. by the disk writer. Set the returned Event
+        once the views are no longer needed.
+
+        Returns:
+            released : threading.Event
+        '''
+        self.released.clear()
+        return(self.released)
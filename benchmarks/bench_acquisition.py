@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the per-block work in the acquisition loop and of saving
+recording bouts.
+
+Run from the repository folder :
+
+    python -m pytest benchmarks/bench_acquisition.py
+
+"""
+import numpy as np
+import pytest
+from conftest import fs, num_channels
+from disk_writer import soundfile_writer
+from fieldrecorder.replay_stream import replay_backend
+from fieldrecorder_trigger import fieldrecorder_trigger
+
+blocksize = int(fs/25.0) # one sync cycle, the default
+
+
+@pytest.fixture
+def recorder(tmp_path, keep_cwd):
+    recorder = fieldrecorder_trigger(10, input_output_chs=(num_channels, 5),
+                                     target_dir=str(tmp_path),
+                                     monitor_channels=[0,1,2,3],
+                                     bandpass_freqs=(20000, 90000),
+                                     stream_backend=replay_backend(np.zeros((1,1)),
+                                                                   samplerate=fs))
+    return(recorder)
+
+@pytest.fixture
+def band_energy_recorder(tmp_path, keep_cwd):
+    recorder = fieldrecorder_trigger(10, input_output_chs=(num_channels, 5),
+                                     target_dir=str(tmp_path),
+                                     monitor_channels=[0,1,2,3],
+                                     bandpass_freqs=[(20000, 60000), (80000, 90000)],
+                                     trigger_mode='band_energy',
+                                     stream_backend=replay_backend(np.zeros((1,1)),
+                                                                   samplerate=fs))
+    return(recorder)
+
+@pytest.fixture
+def block():
+    return(np.float32(np.random.normal(0, 0.01, (blocksize, num_channels))))
+
+
+@pytest.mark.benchmark(group='acquisition block')
+def test_check_if_above_level(benchmark, recorder, block):
+    monitor_block = block[:,recorder.monitor_channels]
+    benchmark(recorder.check_if_above_level, monitor_block)
+
+@pytest.mark.benchmark(group='acquisition block')
+def test_bandpass_sound(benchmark, recorder, block):
+    monitor_block = block[:,recorder.monitor_channels]
+    benchmark(recorder.bandpass_sound, monitor_block)
+
+@pytest.mark.benchmark(group='acquisition block')
+def test_band_energy_check(benchmark, band_energy_recorder, block):
+    '''
+    The whole trigger check of the band_energy trigger_mode, to compare with
+    bandpass_sound followed by check_if_above_level.
+    '''
+    monitor_block = block[:,band_energy_recorder.monitor_channels]
+    def check():
+        band_energy_recorder.check_if_above_level(band_energy_recorder.bandpass_sound(monitor_block))
+    benchmark(check)
+
+@pytest.mark.benchmark(group='acquisition block')
+def test_cascade_quiet_block(benchmark, tmp_path, keep_cwd, block):
+    '''
+    The trigger check with a prescreen_level on a quiet block, which the first
+    stage of the trigger_cascade rejects.
+    '''
+    recorder = fieldrecorder_trigger(10, input_output_chs=(num_channels, 5),
+                                     target_dir=str(tmp_path),
+                                     monitor_channels=[0,1,2,3],
+                                     bandpass_freqs=(20000, 90000), prescreen_level=-20,
+                                     stream_backend=replay_backend(np.zeros((1,1)),
+                                                                   samplerate=fs))
+    monitor_block = block[:,recorder.monitor_channels]
+    benchmark(recorder.check_trigger, monitor_block)
+
+@pytest.mark.benchmark(group='bout saving')
+def test_save_bout(benchmark, tmp_path, multich_rec):
+    '''
+    Streams a whole recording bout block by block through the disk writer,
+    including waiting for the writer to finish.
+    '''
+    bout = np.float32(multich_rec)/(2**15-1)
+    blocks = [ bout[start:start+blocksize] for start in range(0, bout.shape[0], blocksize)]
+    filenames = ( str(tmp_path/('MULTIWAV_%d.WAV'%i)) for i in range(1000))
+
+    def save_bout():
+        writer = soundfile_writer(fs, num_channels, max_queue_blocks=len(blocks)+10)
+        writer.start()
+        writer.open_file(next(filenames))
+        for each_block in blocks:
+            writer.write(each_block)
+        writer.stop()
+
+    benchmark.pedantic(save_bout, rounds=3, iterations=1)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the time-alignment of the recordings in ADC_delay.
+
+Run from the repository folder :
+
+    python -m pytest benchmarks/bench_postprocessing.py
+
+"""
+import numpy as np
+import pytest
+from conftest import fs, sync_channels
+import ADC_delay
+
+channels2devices = {'1':range(12), '2':range(12,24)}
+
+
+@pytest.fixture(scope='module')
+def normalised_rec(multich_rec):
+    '''
+    multich_rec as -1 to +1 float32 values, as read_wavfile gives them
+    '''
+    return(ADC_delay.normalise_samples(multich_rec))
+
+@pytest.mark.benchmark(group='ADC_delay')
+def test_detect_first_rising_edge(benchmark, multich_rec):
+    sync_channel = multich_rec[:,sync_channels['1']]/(2**15-1.0)
+    benchmark.pedantic(ADC_delay.detect_first_rising_edge, args=(sync_channel, fs),
+                       rounds=3, iterations=1)
+
+@pytest.mark.benchmark(group='ADC_delay')
+def test_estimate_delay(benchmark, multich_rec):
+    chA = multich_rec[:,sync_channels['1']]/(2**15-1.0)
+    chB = multich_rec[:,sync_channels['2']]/(2**15-1.0)
+    delay = benchmark(ADC_delay.estimate_delay, chB, chA)
+    assert delay != 0
+
+@pytest.mark.benchmark(group='ADC_delay')
+def test_align_channels(benchmark, normalised_rec):
+    cut_points = {'1':0, '2':37}
+    benchmark.pedantic(ADC_delay.align_channels,
+                       args=(normalised_rec, channels2devices, cut_points),
+                       rounds=3, iterations=1)
+
+@pytest.mark.benchmark(group='ADC_delay')
+def test_save_as_singlewav_timestamped(benchmark, tmp_path, normalised_rec):
+    aligned = ADC_delay.align_channels(normalised_rec, channels2devices, {'1':0, '2':37})
+    file_starts = ( str(tmp_path/('Mic_%d_'%i)) for i in range(1000))
+
+    def save_channels():
+        ADC_delay.save_as_singlewav_timestamped(aligned, fs, file_start=next(file_starts),
+                                                file_timestamp='bench')
+
+    benchmark.pedantic(save_channels, rounds=3, iterations=1)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Shared recordings for the benchmarks. All recordings are 24 channels at
+192 kHz with the camera sync signal on channels 7 and 19, as recorded with
+the two Fireface UCs. Their duration is set by the FIELDRECORDER_BENCH_DURN
+environment variable in seconds, and defaults to 10 s.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+
+fs = 192000
+num_channels = 24
+sync_channels = {'1':7, '2':19}
+device_delay = 37 # samples that device 2 lags behind device 1
+
+
+@pytest.fixture(scope='session')
+def rec_durn():
+    return(float(os.environ.get('FIELDRECORDER_BENCH_DURN', 10)))
+
+@pytest.fixture(scope='session')
+def sync_signal(rec_durn):
+    t = np.arange(int(rec_durn*fs))/float(fs)
+    return(np.float32(0.25*np.sign(np.sin(2*np.pi*25*t + np.pi))))
+
+@pytest.fixture(scope='session')
+def multich_rec(sync_signal):
+    '''
+    int16 recording, like the MULTIWAV files saved in the field
+    '''
+    rec = np.random.normal(0, 300, (sync_signal.size, num_channels)).astype(np.int16)
+    rec[:,sync_channels['1']] = sync_signal*(2**15-1)
+    rec[device_delay:,sync_channels['2']] = sync_signal[:-device_delay]*(2**15-1)
+    return(rec)
+
+@pytest.fixture
+def keep_cwd():
+    '''
+    The recorders change into their target folder, which would move the
+    benchmark results saved at the end of the session.
+    '''
+    cwd = os.getcwd()
+    yield
+    os.chdir(cwd)
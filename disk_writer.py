@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Background disk writer for the fieldrecorder modules.
+
+Saving a whole recording bout in one go (concatenating the blocks and writing
+a few hundred MB to disk) blocks the acquisition loop for seconds, during which
+nobody services the soundcard and the cameras lose their sync signal.
+
+The soundfile_writer instead streams each block into an open soundfile.SoundFile
+from a separate thread. The acquisition loop only puts blocks into a bounded
+queue and can go straight back to monitoring the trigger.
+
+Usage :
+
+    writer = soundfile_writer(fs=192000, num_channels=16)
+    writer.start()
+
+    writer.open_file('MULTIWAV_....WAV')
+    writer.write(block) # as many times as needed
+    writer.close_file()
+
+    writer.stop()
+
+The compressed_writer has the same interface, but encodes the blocks into
+lossless FLAC files on a pool of background encoder threads. FLAC files hold
+at most 8 channels, so the channels are split into groups of up to 8 with one
+file and one encoder thread per group :
+
+    MULTIWAV_..._ch00-07.flac, MULTIWAV_..._ch08-15.flac
+
+If the encoders fall behind the acquisition, the rest of the file is written
+uncompressed into MULTIWAV_..._raw.WAV instead of dropping blocks.
+
+The recording_name of both writers is the name the recording was saved
+under, which sidecar files such as the sync log are named after :
+MULTIWAV_....WAV, MULTIWAV_....flac for all the FLAC files of the recording,
+or MULTIWAV_..._raw.WAV if the whole file was written uncompressed.
+
+"""
+import os
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+import soundfile
+
+
+sample_bytes = {'PCM_S8':1, 'PCM_U8':1, 'PCM_16':2, 'PCM_24':3, 'PCM_32':4,
+                'FLOAT':4, 'DOUBLE':8}
+
+
+class soundfile_writer():
+
+    def __init__(self, fs, num_channels, max_queue_blocks=1000, **kwargs):
+        '''
+        Inputs:
+            fs : integer. sampling rate in Hertz.
+            num_channels : integer. Number of channels in each block and file.
+            max_queue_blocks : integer. Maximum number of blocks waiting to be
+                               written. Once the queue is full further blocks
+                               are dropped and counted in self.dropped_blocks
+                               rather than stalling the acquisition loop. The
+                               open, close and release commands are always
+                               queued, and never wait either.
+        **kwargs:
+            subtype : string or None. soundfile subtype of the output files,
+                      eg. 'PCM_16', 'PCM_24', 'FLOAT'. Defaults to the soundfile
+                      default for the file format.
+            format : string or None. soundfile format of the output files.
+                     Defaults to the format implied by the file extension.
+            channels : slice or None. Channels of each block to write. The
+                       channels are selected in the writer thread. Defaults
+                       to None, which writes all channels.
+        '''
+        self.fs = fs
+        self.num_channels = num_channels
+        self.subtype = kwargs.get('subtype', None)
+        self.format = kwargs.get('format', None)
+        self.channels = kwargs.get('channels', None)
+
+        # unbounded, so that the commands never block. Only the blocks are
+        # limited to max_queue_blocks, in write
+        self.q = queue.Queue()
+        self.max_queue_blocks = max_queue_blocks
+        self.max_queue_depth = 0
+        self.dropped_blocks = 0
+        self.blocks_written = 0
+        # bytes of the samples as stored in uncompressed form
+        self.bytes_written = 0
+        self.files_written = []
+        self.current_file = None
+        self.recording_name = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='disk_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open_file(self, filename):
+        '''
+        All blocks given to write after this call go into filename.
+        '''
+        self.recording_name = filename
+        self._put(('open', filename))
+
+    def write(self, block):
+        '''
+        Queues one nsamples x num_channels block for writing. The block is not
+        copied - do not modify it after handing it over.
+        '''
+        if self.q.qsize() >= self.max_queue_blocks:
+            self.dropped_blocks += 1
+            return
+        self._put(('write', block))
+
+    def release(self, event):
+        '''
+        Sets the threading.Event once all blocks queued before it have been
+        written, eg. to tell a pretrigger_buffer its views can be overwritten.
+        '''
+        self._put(('release', event))
+
+    def close_file(self):
+        self._put(('close', None))
+
+    def stop(self):
+        '''
+        Writes all the queued blocks, closes any open file and stops the thread.
+        '''
+        self._put(('stop', None))
+        self.thread.join()
+
+    def queue_depth(self):
+        return(self.q.qsize())
+
+    def _put(self, item):
+        self.q.put(item)
+        depth = self.q.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _run(self):
+        while True:
+            command, content = self.q.get()
+
+            if command == 'write':
+                if self.current_file is not None:
+                    if self.channels is not None:
+                        content = np.ascontiguousarray(content[:,self.channels])
+                    self.current_file.write(content)
+                    self.blocks_written += 1
+                    self.bytes_written += content.size*self.sample_bytes
+
+            elif command == 'open':
+                self._close_current_file()
+                try:
+                    self.current_file = soundfile.SoundFile(content, mode='x',
+                                                            samplerate=self.fs,
+                                                            channels=self.num_channels,
+                                                            subtype=self.subtype,
+                                                            format=self.format)
+                    self.sample_bytes = sample_bytes.get(self.current_file.subtype, 4)
+                except:
+                    self.current_file = None
+                    print('Could not open file for saving: ' + content)
+
+            elif command == 'release':
+                content.set()
+
+            elif command == 'close':
+                self._close_current_file()
+
+            elif command == 'stop':
+                self._close_current_file()
+                break
+
+    def _close_current_file(self):
+        if self.current_file is not None:
+            self.current_file.close()
+            self.files_written.append(self.current_file.name)
+            print('File saved: ' + self.current_file.name)
+            self.current_file = None
+
+
+class compressed_writer():
+
+    def __init__(self, fs, num_channels, max_queue_blocks=1000, **kwargs):
+        '''
+        Inputs:
+            fs : integer. sampling rate in Hertz.
+            num_channels : integer. Number of channels in each block.
+            max_queue_blocks : integer. Maximum number of blocks waiting in each
+                               encoder queue, see soundfile_writer.
+        **kwargs:
+            subtype : string. Sample format of the saved files, 'PCM_16' or
+                      'PCM_24'. Defaults to 'PCM_16', the soundfile default for
+                      uncompressed WAV files.
+            channels_per_file : integer <=8. Maximum number of channels in each
+                                FLAC file. Defaults to 8.
+            fallback_queue_blocks : integer. Once any encoder has more than this
+                                    many blocks waiting, the rest of the file is
+                                    written uncompressed. Defaults to half of
+                                    max_queue_blocks.
+        '''
+        self.fs = fs
+        self.num_channels = num_channels
+        self.subtype = kwargs.get('subtype', 'PCM_16')
+        channels_per_file = min(kwargs.get('channels_per_file', 8), 8)
+        self.fallback_queue_blocks = kwargs.get('fallback_queue_blocks',
+                                                max_queue_blocks//2)
+
+        self.channel_groups = [ slice(first, min(first+channels_per_file, num_channels))
+                                   for first in range(0, num_channels, channels_per_file)]
+        self.encoders = [ soundfile_writer(fs, group.stop-group.start, max_queue_blocks,
+                                           subtype=self.subtype, format='FLAC',
+                                           channels=group)
+                                  for group in self.channel_groups]
+        self.raw_writer = soundfile_writer(fs, num_channels, max_queue_blocks,
+                                           subtype=self.subtype)
+
+        self.raw_mode = False
+        self.fallbacks = 0
+        self.max_encoder_lag = 0.0
+        self.current_filename = None
+        self.recording_name = None
+        self.flac_blocks = 0
+
+    def start(self):
+        for each_writer in self.all_writers():
+            each_writer.start()
+
+    def all_writers(self):
+        return(self.encoders + [self.raw_writer])
+
+    def open_file(self, filename):
+        '''
+        Opens one FLAC file per channel group. The extension of filename is
+        replaced. If the encoders have not caught up with the previous file yet
+        the whole file is written uncompressed.
+        '''
+        self.close_file()
+        self.current_filename = os.path.splitext(filename)[0]
+        self.recording_name = self.current_filename+'.flac'
+        self.flac_blocks = 0
+        if self.encoder_queue_depth() > self.fallback_queue_blocks//2:
+            self.fall_back_to_raw()
+            return
+
+        for group, each_encoder in zip(self.channel_groups, self.encoders):
+            each_encoder.open_file(self.group_filename(group))
+
+    def group_filename(self, group):
+        if len(self.channel_groups) == 1:
+            return(self.current_filename+'.flac')
+        return(self.current_filename+'_ch%02d-%02d.flac'%(group.start, group.stop-1))
+
+    def fall_back_to_raw(self):
+        '''
+        Closes the FLAC files and writes the rest of the current file
+        uncompressed into filename_raw.WAV. The FLAC files and the raw file
+        are then two recordings, which start at different frames.
+        '''
+        for each_encoder in self.encoders:
+            each_encoder.close_file()
+        self.raw_writer.open_file(self.current_filename+'_raw.WAV')
+        if self.flac_blocks == 0:
+            self.recording_name = self.raw_writer.recording_name
+        self.raw_mode = True
+        self.fallbacks += 1
+        print('WARNING: encoders are '+str(self.encoder_queue_depth())+
+              ' blocks behind, writing uncompressed file')
+
+    def write(self, block):
+        '''
+        Queues one nsamples x num_channels block for all encoders. The block is
+        not copied - do not modify it after handing it over.
+        '''
+        if self.raw_mode:
+            self.raw_writer.write(block)
+            return
+
+        queued_blocks = self.encoder_queue_depth()
+        lag = queued_blocks*block.shape[0]/float(self.fs)
+        if lag > self.max_encoder_lag:
+            self.max_encoder_lag = lag
+
+        if queued_blocks > self.fallback_queue_blocks:
+            self.fall_back_to_raw()
+            self.raw_writer.write(block)
+            return
+
+        for each_encoder in self.encoders:
+            each_encoder.write(block)
+        self.flac_blocks += 1
+
+    def release(self, event):
+        '''
+        Sets the threading.Event once all writers have written the blocks
+        queued before it.
+        '''
+        all_released = countdown_event(event, len(self.all_writers()))
+        for each_writer in self.all_writers():
+            each_writer.release(all_released)
+
+    def close_file(self):
+        for each_writer in self.all_writers():
+            each_writer.close_file()
+        self.raw_mode = False
+
+    def stop(self):
+        for each_writer in self.all_writers():
+            each_writer.stop()
+
+    def queue_depth(self):
+        return(max([each.queue_depth() for each in self.all_writers()]))
+
+    def encoder_queue_depth(self):
+        return(max([each.queue_depth() for each in self.encoders]))
+
+    @property
+    def max_queue_depth(self):
+        return(max([each.max_queue_depth for each in self.all_writers()]))
+
+    @property
+    def dropped_blocks(self):
+        return(max([each.dropped_blocks for each in self.all_writers()]))
+
+    @property
+    def bytes_written(self):
+        return(sum([each.bytes_written for each in self.all_writers()]))
+
+    @property
+    def files_written(self):
+        return(sum([each.files_written for each in self.all_writers()], []))
+
+    def compression_ratio(self):
+        '''
+        Returns:
+            ratio : float. size of the finished FLAC files as uncompressed
+                    samples, divided by their size on disk. None if no FLAC
+                    file has been finished yet.
+        '''
+        bytes_per_sample = {'PCM_16':2, 'PCM_24':3}[self.subtype]
+        raw_bytes, compressed_bytes = 0, 0
+        for each_encoder in self.encoders:
+            for each_file in each_encoder.files_written:
+                info = soundfile.info(each_file)
+                raw_bytes += info.frames*info.channels*bytes_per_sample
+                compressed_bytes += os.path.getsize(each_file)
+        if compressed_bytes == 0:
+            return(None)
+        return(raw_bytes/float(compressed_bytes))
+
+
+class countdown_event():
+    '''
+    Sets event once set has been called num_calls times, eg. by several writer
+    threads that all need to finish before a buffer is released.
+    '''
+    def __init__(self, event, num_calls):
+        self.event = event
+        self.calls_left = num_calls
+        self.lock = threading.Lock()
+
+    def set(self):
+        with self.lock:
+            self.calls_left -= 1
+            if self.calls_left == 0:
+                self.event.set()
@@ -2,34 +2,138 @@
 """
 Created on 2018-02-06
 
+Makes a csv file with the duration and expected number of video frames
+of all the WAV files in a folder.
+
+Only the WAV headers are read (with soundfile.info), in parallel threads. The
+header information is cached in wav_inventory.sqlite in the folder, keyed by
+the path, modification time and size of each file, so that re-running on a
+folder only reads the headers of new or changed files.
+
 @author: tbeleyur
 """
+import concurrent.futures
 import glob
-import easygui as eg
+import multiprocessing
+import os
+import sqlite3
 import numpy as np
 import pandas as pd
-import scipy.io.wavfile as WAV
+import soundfile
+
+index_filename = 'wav_inventory.sqlite'
+
+def read_wav_header(fileaddress):
+    '''
+    Inputs:
+        fileaddress : string. path to the wav file
+
+    Returns:
+        header : tuple with the (num_samples, num_channels, fs) of the file
+    '''
+    info = soundfile.info(fileaddress)
+    return((info.frames, info.channels, info.samplerate))
+
+def open_index(index_address):
+    index = sqlite3.connect(index_address)
+    index.execute('CREATE TABLE IF NOT EXISTS wav_headers (path TEXT PRIMARY KEY,'
+                  ' mtime REAL, size INTEGER, num_samples INTEGER,'
+                  ' num_channels INTEGER, fs INTEGER)')
+    return(index)
+
+def read_wav_headers(wav_files, num_workers=None, index_address=None):
+    '''
+    Reads the headers of many wav files in parallel threads.
+
+    Inputs:
+        wav_files : list with paths to wav files
+        num_workers : integer or None. number of threads. Defaults to None, which
+                      uses 4 threads per cpu, up to 32 threads.
+        index_address : string or None. path to the SQLite cache. Defaults to
+                        None, which reads all headers without a cache.
+
+    Returns:
+        headers : dictionary with the paths as keys and (num_samples, num_channels, fs)
+                  tuples as values
+    '''
+    file_stats = dict([ (each, os.stat(each)) for each in wav_files])
+    headers = {}
+
+    if index_address is not None:
+        index = open_index(index_address)
+        for path, mtime, size, num_samples, num_channels, fs in index.execute(
+                                                'SELECT * FROM wav_headers'):
+            if path in file_stats:
+                stats = file_stats[path]
+                if stats.st_mtime == mtime and stats.st_size == size:
+                    headers[path] = (num_samples, num_channels, fs)
+
+    to_read = [ each for each in wav_files if each not in headers]
+    if num_workers is None:
+        # header reads are mostly waiting on the disk, not the cpu
+        num_workers = min(32, multiprocessing.cpu_count()*4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for path, header in zip(to_read, executor.map(read_wav_header, to_read)):
+            headers[path] = header
+
+    if index_address is not None:
+        index.executemany('INSERT OR REPLACE INTO wav_headers VALUES (?,?,?,?,?,?)',
+                          [ (path, file_stats[path].st_mtime, file_stats[path].st_size)
+                                                   + headers[path] for path in to_read])
+        index.commit()
+        index.close()
+
+    return(headers)
+
+def wav_inventory(folder, fps=25, num_workers=None, use_index=True):
+    '''
+    Makes a table with the duration and expected number of video frames
+    of all WAV files in a folder.
+
+    Inputs:
+        folder : string. folder with the wav files
+        fps : float. frame rate of the cameras in Hertz. Defaults to 25.
+        num_workers : integer or None. see read_wav_headers
+        use_index : Boolean. If True the headers are cached in wav_inventory.sqlite
+                    in the folder. Defaults to True.
+
+    Returns:
+        file_data : pd.DataFrame with one row per wav file.
+    '''
+    files_in_folder = sorted(set(glob.glob(os.path.join(folder, '*.WAV')) +
+                                 glob.glob(os.path.join(folder, '*.wav'))))
+
+    if use_index:
+        index_address = os.path.join(folder, index_filename)
+    else:
+        index_address = None
+    headers = read_wav_headers(files_in_folder, num_workers, index_address)
+
+    cols = ['file_name', 'expected_numframes', 'rec_durn',
+                         'bat_presence', 'notes', 'video_file',
+                         'num_samples', 'num_channels', 'fs']
+    file_data = pd.DataFrame(index = range(len(files_in_folder)),
+                             columns = cols)
+    if len(files_in_folder) == 0:
+        return(file_data)
 
+    num_samples, num_channels, fs = zip(*[ headers[each] for each in files_in_folder])
+    rec_durn = np.array(num_samples)/np.array(fs, dtype=np.float64)
 
-folder = str(eg.diropenbox())
+    file_data['file_name'] = files_in_folder
+    file_data['expected_numframes'] = np.int64(fps*rec_durn)
+    file_data['rec_durn'] = rec_durn
+    file_data['num_samples'] = num_samples
+    file_data['num_channels'] = num_channels
+    file_data['fs'] = fs
 
-files_in_folder = glob.glob(folder+'\\'+'*.WAV')
+    return(file_data)
 
-cols = ['file_name', 'expected_numframes', 'rec_durn',
-                     'bat_presence', 'notes', 'video_file']
-file_data = pd.DataFrame(index = range(len(files_in_folder)),
-                         columns = cols)
 
-for row_num, each_wav in enumerate(files_in_folder):
-    fs, rec = WAV.read(each_wav)
+if __name__ == '__main__':
+    import easygui as eg
 
-    print(each_wav,'\n', rec.shape,'\n Duration: ',rec.shape[0]/float(fs),
-          '\n Num exp frames',25*rec.shape[0]/float(fs))
-    
-    file_data['file_name'][row_num] = each_wav
-    file_data['expected_numframes'][row_num] = int(25*rec.shape[0]/float(fs))
-    file_data['rec_durn'][row_num] = rec.shape[0]/float(fs)
-    
-file_data.to_csv(folder+'\\wav_information.csv')
-    
-    
\ No newline at end of file
+    folder = str(eg.diropenbox())
+    file_data = wav_inventory(folder)
+    print(file_data[['file_name', 'num_channels', 'rec_durn', 'expected_numframes']])
+    file_data.to_csv(os.path.join(folder, 'wav_information.csv'))
@@ -56,6 +56,8 @@ import numpy as np
 import sounddevice as sd
 from scipy import signal
 import soundfile
+from disk_writer import compressed_writer
+from fieldrecorder.stream_metrics import stream_metrics, make_metrics_filename
 import matplotlib.pyplot as plt
 plt.rcParams['agg.path.chunksize'] = 10000
 from pynput.keyboard import  Listener
@@ -82,7 +84,16 @@ class fieldrecorder():
                               into the WAV file. Defaults to the digital channels
                               in the double Fireface UC setup
 
+            compression : None or 'FLAC'. If 'FLAC' the blocks are handed to a
+                          disk_writer.compressed_writer while recording, which
+                          encodes them into lossless FLAC files on background
+                          threads. Defaults to None, which saves uncompressed WAV
+                          files once the recording is stopped.
 
+            metrics_file : string or None. File the input overflow/output underflow
+                           counts and loop latencies are saved to, see
+                           fieldrecorder.stream_metrics. Defaults to None, which saves
+                           them to METRICS_YYYY-MM-DD_hh-mm-ss.jsonl in target_dir.
 
         '''
         self.rec_durn = rec_durn
@@ -118,7 +129,8 @@ class fieldrecorder():
 
         self.save_channels  = list(set(self.all_recchannels) - set(self.exclude_channels))
 
-
+        self.compression = kwargs.get('compression', None)
+        self.metrics_file = kwargs.get('metrics_file', None)
 
     def thermoacousticpy(self):
         '''
@@ -158,6 +170,13 @@ class fieldrecorder():
 
 
         self.q = Queue.Queue()
+        self.rec = None
+        self.metrics = stream_metrics(self.metrics_file or make_metrics_filename())
+        self.metrics.watch('queue_depth', self.q.qsize)
+        if self.compression is not None:
+            self.make_writer()
+            self.metrics.watch('writer_queue_depth', self.writer.queue_depth)
+            self.metrics.watch('writer_bytes', lambda : self.writer.bytes_written, rate=True)
 
         self.S.start()
 
@@ -170,13 +189,19 @@ class fieldrecorder():
             while rec_time < end_time:
 
                 if self.recording:
-                    self.q.put(self.S.read(self.trig_and_sync.shape[0]))
-                    self.S.write(self.trig_and_sync)
+                    data_and_overflow = self.S.read(self.trig_and_sync.shape[0])
+                    self.metrics.count_read(data_and_overflow[1])
+                    if self.compression is None:
+                        self.q.put(data_and_overflow)
+                    else:
+                        self.writer.write(data_and_overflow[0][:,self.save_channels])
+                    self.metrics.count_write(self.S.write(self.trig_and_sync))
 
                 else :
-                    self.S.write(self.only_sync)
+                    self.metrics.count_write(self.S.write(self.only_sync))
 
                 rec_time = self.S.time
+                self.metrics.tick()
 
             kb_input.stop()
 
@@ -188,6 +213,9 @@ class fieldrecorder():
 
 
         self.S.stop()
+        if self.compression is not None:
+            self.stop_writer()
+        self.metrics.close()
 
         print('Queue size is',self.q.qsize())
 
@@ -201,6 +229,8 @@ class fieldrecorder():
         self.press_count += 1
 
         if self.press_count == 1:
+            if self.compression is not None:
+                self.writer.open_file(self.make_filename())
             self.recording = True
             print('recording started')
 
@@ -209,9 +239,11 @@ class fieldrecorder():
             self.press_count = 0
             print('recording stopped')
 
-            self.empty_qcontentsintolist()
-
-            self.save_qcontents_aswav()
+            if self.compression is None:
+                self.empty_qcontentsintolist()
+                self.save_qcontents_aswav()
+            else:
+                self.writer.close_file()
 
         pass
 
@@ -232,11 +264,7 @@ class fieldrecorder():
 
         self.rec2besaved = self.rec[:,self.save_channels]
 
-        timenow = dt.datetime.now()
-        self.timestamp = timenow.strftime('%Y-%m-%d_%H-%M-%S')
-        self.idnumber =  int(time.mktime(timenow.timetuple())) #the unix time which provides a 10 digit unique identifier
-
-        main_filename = 'MULTIWAV_' + self.timestamp+'_'+str(self.idnumber) +'.WAV'
+        main_filename = self.make_filename()
 
         try:
             print('trying to save file... ')
@@ -255,6 +283,35 @@ class fieldrecorder():
 
 
 
+    def make_filename(self):
+        '''
+        Creates a file name that begins with MULTIWAV_YYYY-MM-DD_hh-mm-ss_UNIXTIME
+        '''
+        timenow = dt.datetime.now()
+        self.timestamp = timenow.strftime('%Y-%m-%d_%H-%M-%S')
+        self.idnumber =  int(time.mktime(timenow.timetuple())) #the unix time which provides a 10 digit unique identifier
+
+        main_filename = 'MULTIWAV_' + self.timestamp+'_'+str(self.idnumber) +'.WAV'
+        return(main_filename)
+
+    def make_writer(self):
+        '''
+        Starts the compressed_writer that encodes the blocks into FLAC files on
+        background threads, with one encoder thread per group of up to 8 channels,
+        while the recording goes on.
+        '''
+        if self.compression != 'FLAC':
+            raise ValueError('Unknown compression: '+str(self.compression))
+        self.writer = compressed_writer(self.fs, len(self.save_channels))
+        self.writer.start()
+
+    def stop_writer(self):
+        self.writer.stop()
+        print('Compression ratio: '+str(self.writer.compression_ratio())+
+              ' maximum encoder lag: '+str(self.writer.max_encoder_lag)+' s,'+
+              ' files written uncompressed: '+str(self.writer.fallbacks)+
+              ' blocks dropped: '+str(self.writer.dropped_blocks))
+
     def get_device_indexnumber(self,device_name):
         '''
         Check for the device name in all of the recognised devices and
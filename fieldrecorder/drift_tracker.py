@@ -0,0 +1,383 @@
+"""
+Online tracking of the clock drift between the AD converters.
+
+The camera sync signal is recorded by every AD converter (eg. on channels 7
+and 19 of the two Fireface UCs). ADC_delay used to find one constant offset
+between the devices from the first rising edge of each file, after the
+recording. Over hour-long sessions the converter clocks drift apart, and
+every file had to be searched again.
+
+The clock_drift_tracker instead timestamps the rising edges of each sync
+channel block by block, pairs the edges of the other devices with those of
+a reference device, and keeps an exponentially weighted straight line fit of
+their offset against time. The offset and drift rate are logged with every
+recording, together with the cut points ADC_delay needs to align the file
+without any search (see fieldrecorder.sync_log) :
+
+    tracker = clock_drift_tracker(192000, {'1':7,'2':19})
+    while ...:
+        tracker.update(block)
+        ...
+        tracker.start_file(first_frame_of_file)
+        ...
+        drift_log = tracker.file_log(num_frames_in_file)
+
+"""
+import collections
+import numpy as np
+
+
+class sync_edge_detector():
+
+    def __init__(self, threshold=None):
+        '''
+        Finds the rising edges of one sync channel across consecutive blocks,
+        with sub-sample resolution.
+
+        Parameters
+        ----------
+        threshold : float or None
+            Level the signal has to cross to count as a rising edge. Defaults
+            to None, which uses half of the maximum of the first block with
+            a positive maximum.
+        '''
+        self.threshold = threshold
+        self.previous_sample = None
+        self.samples_processed = 0
+
+    def detect(self, sync_block):
+        '''
+        Parameters
+        ----------
+        sync_block : 1D np.array
+            The next block of the sync signal.
+
+        Returns
+        -------
+        edges : np.array
+            Positions of the rising edges in frames since the first block,
+            interpolated linearly between the samples either side of the
+            threshold.
+        '''
+        if self.threshold is None and np.max(sync_block) > 0:
+            self.threshold = 0.5*np.max(sync_block)
+
+        if self.threshold is None:
+            edges = np.array([])
+        else:
+            if self.previous_sample is None:
+                # the first sample is never an edge
+                previous_sample = sync_block[0]
+            else:
+                previous_sample = self.previous_sample
+            extended = np.concatenate(([previous_sample], sync_block))
+            above = extended >= self.threshold
+            indices = np.flatnonzero(above[1:] & ~above[:-1])
+            before, after = extended[indices], extended[indices+1]
+            edges = self.samples_processed + indices - 1 + (self.threshold - before)/(after - before)
+
+        self.previous_sample = sync_block[-1]
+        self.samples_processed += sync_block.size
+        return(edges)
+
+
+class weighted_line_fit():
+
+    def __init__(self, forgetting=1.0):
+        '''
+        Exponentially weighted least squares fit of y = intercept + slope*x,
+        updated one point at a time.
+
+        Parameters
+        ----------
+        forgetting : float
+            Factor the weight of all earlier points is multiplied with at
+            every new point. Defaults to 1.0, an ordinary least squares fit.
+        '''
+        self.forgetting = forgetting
+        self.num_points = 0
+        self.sum_w = self.sum_x = self.sum_y = 0.0
+        self.sum_xx = self.sum_xy = self.sum_yy = 0.0
+
+    def add(self, x, y):
+        f = self.forgetting
+        self.num_points += 1
+        self.sum_w = f*self.sum_w + 1.0
+        self.sum_x = f*self.sum_x + x
+        self.sum_y = f*self.sum_y + y
+        self.sum_xx = f*self.sum_xx + x*x
+        self.sum_xy = f*self.sum_xy + x*y
+        self.sum_yy = f*self.sum_yy + y*y
+
+    def line(self):
+        '''
+        Returns
+        -------
+        intercept, slope : float
+            The slope is 0 until there are two points with different x.
+        '''
+        if self.num_points == 0:
+            return(np.nan, np.nan)
+        mean_x, mean_y = self.sum_x/self.sum_w, self.sum_y/self.sum_w
+        var_x = self.sum_xx/self.sum_w - mean_x**2
+        if self.num_points < 2 or var_x <= 0:
+            return(mean_y, 0.0)
+        slope = (self.sum_xy/self.sum_w - mean_x*mean_y)/var_x
+        return(mean_y - slope*mean_x, slope)
+
+    def predict(self, x):
+        intercept, slope = self.line()
+        return(intercept + slope*x)
+
+    def residual_rms(self):
+        '''
+        Weighted root mean square distance of the points from the fitted line.
+        '''
+        if self.num_points < 2:
+            return(0.0)
+        intercept, slope = self.line()
+        mean_x, mean_y = self.sum_x/self.sum_w, self.sum_y/self.sum_w
+        var_y = self.sum_yy/self.sum_w - mean_y**2
+        cov_xy = self.sum_xy/self.sum_w - mean_x*mean_y
+        return(float(np.sqrt(max(var_y - slope*cov_xy, 0.0))))
+
+
+class clock_drift_tracker():
+
+    def __init__(self, fs, syncch2device={'1':7,'2':19}, fps=25, **kwargs):
+        '''
+        Parameters
+        ----------
+        fs : int
+            Sampling rate in Hz.
+        syncch2device : dict
+            Keys are the names of the AD converters and entries the index of
+            the input channel each one records the sync signal on.
+        fps : float
+            Frequency of the sync signal in Hz. Defaults to 25.
+
+        Keyword Arguments
+        -----------------
+        reference_device : str
+            Device the offsets of the other devices are measured against.
+            Defaults to the first device in sorted order.
+        threshold : float or None
+            see sync_edge_detector
+        fit_durn : float
+            Seconds over which the edge offsets are averaged. Older edges are
+            forgotten exponentially. Defaults to 60 s.
+        history_durn : float
+            Seconds of reference edges kept to find the first edge of a file
+            that started in the past, eg. with pretrigger audio. Defaults to 10 s.
+        max_offset_jump : float
+            Largest change in frames of a device's offset from one edge to the
+            next. Pairs of edges with larger changes, eg. from a spurious edge at
+            the start of the stream, are left out of the fit. Defaults to 2 frames.
+        save_channels : list with integers or None
+            Input channels saved into the files, in the order of the file's
+            columns. The file_log gives the sync channels as file columns, which
+            is what ADC_delay reads them as. Defaults to None, for files holding
+            all input channels.
+
+        The offsets are only paired correctly while they are smaller than half
+        a sync period, the same assumption the cut points of ADC_delay make.
+        '''
+        self.fs = fs
+        self.syncch2device = dict(syncch2device)
+        self.period = fs/float(fps)
+        self.reference_device = kwargs.get('reference_device',
+                                           sorted(self.syncch2device)[0])
+        self.other_devices = sorted(set(self.syncch2device) - set([self.reference_device]))
+
+        threshold = kwargs.get('threshold', None)
+        self.detectors = { each: sync_edge_detector(threshold) for each in self.syncch2device}
+        self.pending_edges = { each: collections.deque() for each in self.syncch2device}
+
+        forgetting = np.exp(-1.0/(kwargs.get('fit_durn', 60.0)*fps))
+        self.fits = { each: weighted_line_fit(forgetting) for each in self.other_devices}
+        history_edges = int(np.ceil(kwargs.get('history_durn', 10.0)*fps)) + 2
+        self.reference_edges = collections.deque(maxlen=history_edges)
+        self.max_offset_jump = kwargs.get('max_offset_jump', 2.0)
+        save_channels = kwargs.get('save_channels', None)
+        if save_channels is None:
+            self.syncch2column = dict(self.syncch2device)
+        else:
+            # None for a sync channel that is not saved
+            save_channels = list(save_channels)
+            self.syncch2column = { device: (save_channels.index(channel)
+                                            if channel in save_channels else None)
+                                       for device, channel in self.syncch2device.items()}
+        self.previous_offsets = { each: None for each in self.other_devices}
+
+        self.frames_processed = 0
+        self.num_pairs = 0
+        self.unmatched_edges = 0
+        self.rejected_pairs = 0
+        self.file_start_frame = None
+        self.file_first_edge = None
+
+    def update(self, block):
+        '''
+        Parameters
+        ----------
+        block : nframes x Nchannels np.array
+            The next block of the recording, with all input channels.
+        '''
+        for each_device, sync_channel in self.syncch2device.items():
+            edges = self.detectors[each_device].detect(block[:,sync_channel])
+            self.pending_edges[each_device].extend(edges)
+        self.match_edges()
+        self.frames_processed += block.shape[0]
+
+    def match_edges(self):
+        '''
+        Pairs the oldest pending edge of every device with the oldest reference
+        edge. Edges without a partner within half a period, eg. at the start of
+        the stream or after an overflow, are dropped. Pairs whose offset jumps
+        by more than max_offset_jump are not added to the fit.
+        '''
+        reference = self.pending_edges[self.reference_device]
+        others = [ self.pending_edges[each] for each in self.other_devices]
+        half_period = 0.5*self.period
+
+        while len(reference) > 0 and all([ len(each) > 0 for each in others]):
+            reference_edge = reference[0]
+            early = [ each for each in others if each[0] < reference_edge - half_period]
+            if len(early) > 0:
+                for each in early:
+                    each.popleft()
+                self.unmatched_edges += len(early)
+                continue
+            if any([ each[0] > reference_edge + half_period for each in others]):
+                reference.popleft()
+                self.unmatched_edges += 1
+                continue
+
+            reference.popleft()
+            offsets = [ each.popleft() - reference_edge for each in others]
+            consistent = True
+            for each_device, offset in zip(self.other_devices, offsets):
+                previous = self.previous_offsets[each_device]
+                consistent &= previous is not None and abs(offset-previous) <= self.max_offset_jump
+                self.previous_offsets[each_device] = offset
+            if not consistent:
+                self.rejected_pairs += 1
+                continue
+
+            edge_time = reference_edge/float(self.fs)
+            for each_device, offset in zip(self.other_devices, offsets):
+                self.fits[each_device].add(edge_time, offset)
+            self.num_pairs += 1
+            self.reference_edges.append(reference_edge)
+            if self.file_first_edge is None and self.starts_file(reference_edge):
+                self.file_first_edge = reference_edge
+
+    def offset(self, device, frame):
+        '''
+        Returns
+        -------
+        offset : float
+            Frames by which the sync signal of device lags behind the reference
+            device at the given frame, according to the current fit.
+        '''
+        if device == self.reference_device:
+            return(0.0)
+        return(self.fits[device].predict(frame/float(self.fs)))
+
+    def drift_ppm(self, device):
+        '''
+        Returns
+        -------
+        drift : float
+            Change of the offset of device in parts per million, ie. microseconds
+            per second.
+        '''
+        if device == self.reference_device:
+            return(0.0)
+        intercept, slope = self.fits[device].line()
+        return(slope/self.fs*10**6)
+
+    def starts_file(self, reference_edge):
+        '''
+        True if the edges of all devices around reference_edge lie at least
+        half a sync period inside the current file. ADC_delay.detect_first_rising_edge
+        skips the edges in the first half period too, so that both find the
+        same first edge.
+        '''
+        if self.file_start_frame is None:
+            return(False)
+        earliest_edge = min([ reference_edge + self.offset(each, reference_edge)
+                                              for each in self.syncch2device])
+        # compared as the cut point, against the half template length
+        return(int(round(earliest_edge)) - self.file_start_frame >= int(self.period)//2)
+
+    def start_file(self, start_frame):
+        '''
+        Marks the frame at which a new file starts. The first reference edge
+        in the file is looked up among the recent edges, or taken once it
+        arrives.
+        '''
+        self.file_start_frame = start_frame
+        self.file_first_edge = None
+        for each_edge in self.reference_edges:
+            if self.starts_file(each_edge):
+                self.file_first_edge = each_edge
+                break
+
+    def file_log(self, num_frames):
+        '''
+        Parameters
+        ----------
+        num_frames : int
+            Number of frames in the file started with start_file.
+
+        Returns
+        -------
+        drift_log : dict
+            With the 'fs', the file column of each device's sync channel as
+            'syncch2device' and its input channel as 'input_syncch2device', the
+            'reference_device', the stream frame
+            the file starts at ('file_start_frame'), the 'cutpoints' of each
+            device (first rising edge at least half a sync period into the file,
+            see ADC_delay.align_channels, or None if the file holds no matched edge), the 'offsets' in frames
+            at the first edge, the 'drift_ppm', the 'offset_change' in frames
+            over the file, the 'offset_rms' of the edge offsets around the
+            fitted line and the number of 'matched_edges', 'unmatched_edges'
+            and 'rejected_pairs' so far.
+        '''
+        first_edge = self.file_first_edge
+        if first_edge is not None and first_edge >= self.file_start_frame + num_frames:
+            first_edge = None
+
+        drift_log = {'fs':self.fs,
+                     'syncch2device':self.syncch2column,
+                     'input_syncch2device':self.syncch2device,
+                     'reference_device':self.reference_device,
+                     'file_start_frame':int(self.file_start_frame),
+                     'num_frames':int(num_frames),
+                     'cutpoints':None,
+                     'offsets':{},
+                     'drift_ppm':{},
+                     'offset_change':{},
+                     'offset_rms':{},
+                     'matched_edges':self.num_pairs,
+                     'unmatched_edges':self.unmatched_edges,
+                     'rejected_pairs':self.rejected_pairs}
+        if self.num_pairs == 0:
+            return(drift_log)
+
+        reference_frame = self.file_start_frame if first_edge is None else first_edge
+        for each_device in self.syncch2device:
+            drift_log['offsets'][each_device] = float(self.offset(each_device, reference_frame))
+            drift_log['drift_ppm'][each_device] = float(self.drift_ppm(each_device))
+            drift_log['offset_change'][each_device] = float(
+                                    self.drift_ppm(each_device)*10**-6*num_frames)
+            drift_log['offset_rms'][each_device] = (0.0 if each_device == self.reference_device
+                                                    else self.fits[each_device].residual_rms())
+
+        if first_edge is not None:
+            drift_log['cutpoints'] = { each_device: int(round(first_edge + offset -
+                                                              self.file_start_frame))
+                                       for each_device, offset in drift_log['offsets'].items()}
+        return(drift_log)
+
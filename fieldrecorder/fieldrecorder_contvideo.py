@@ -16,6 +16,8 @@ import time
 import numpy as np
 import sounddevice as sd
 from scipy import signal
+from fieldrecorder.output_scheduler import output_scheduler
+from fieldrecorder.stream_metrics import stream_metrics, make_metrics_filename
 
 # start Output Stream 
 
@@ -54,6 +56,18 @@ class fieldrecorder_trigger():
         rec_bout : float > 0
             Duration of recording in seconds. 
             Defaults to 10s.
+        blocksize : int > 0
+            Number of frames written per S.write call. Larger blocks mean fewer
+            writes per second at the cost of latency. Defaults to two sync cycles
+            (80 ms). See output_scheduler.benchmark_blocksizes.
+        stream_backend : callable
+            Called with the sd.OutputStream arguments to make the output stream,
+            eg. a replay_backend to run without a soundcard. Defaults to
+            sd.OutputStream.
+        metrics_file : str
+            File the output underflow counts and loop latencies are saved to,
+            see stream_metrics. Defaults to METRICS_YYYY-MM-DD_hh-mm-ss.jsonl
+            in the current folder.
         '''
         self.expt_durn = expt_durn
         self.recording = False
@@ -109,56 +123,69 @@ class fieldrecorder_trigger():
         self.trig_and_sync = np.column_stack((self.sync_signal, self.trigger_signal, self.empty_signal))       
         self.sync_and_FFC = np.column_stack((self.sync_signal, self.empty_signal, self.ffc_signal))
 
+        self.blocksize = kwargs.get('blocksize', self.sync_signal.size)
+        self.metrics_file = kwargs.get('metrics_file', None)
+        self.stream_backend = kwargs.get('stream_backend', None)
+        if self.stream_backend is None:
+            self.stream_backend = sd.OutputStream
+
     def cameras_rolling(self):
         '''
+        Plays the sync signal to the cameras for the whole experiment, with
+        alternating recording and rest bouts after the warm up.
 
+        The bouts are scheduled in frames with an output_scheduler, so their
+        durations and the FFC timing are exact to the sample.
         '''
-        
-        self.S = sd.OutputStream(samplerate=self.fs,blocksize=self.sync_signal.size,
-                           channels=self.output_chs,device=self.tgt_ind)
-
-        start_time = np.copy(self.S.time)
-        rec_time = np.copy(self.S.time)
-        expt_end_time =  start_time + self.expt_durn*3600
-        warmup_end_time = start_time + self.warmup_durn
-        self.S.start()
+        blocksize = self.blocksize
+        self.S = self.stream_backend(samplerate=self.fs,blocksize=blocksize,
+                                     channels=self.output_chs,device=self.tgt_ind)
+        self.scheduler = output_scheduler({'only_sync':self.only_sync,
+                                           'trig_and_sync':self.trig_and_sync,
+                                           'sync_and_FFC':self.sync_and_FFC}, self.fs,
+                                          max_blocksize=blocksize)
+        output_block = np.empty((blocksize, self.output_chs), dtype=np.float32)
+        self.metrics = stream_metrics(self.metrics_file or make_metrics_filename())
+
+        expt_end_frame = int(self.expt_durn*3600*self.fs)
 
         # Run the cameras for warm up time and end with an FFC
         print(f'...Warming up the cameras for {self.warmup_durn} seconds')
-        while self.S.time < warmup_end_time:
-            self.S.write(self.only_sync)
-        self.S.write(self.sync_and_FFC)
-        print('.....done with warmup....')
+        self.scheduler.play('only_sync', int(self.warmup_durn*self.fs))
+        self.scheduler.play_once('sync_and_FFC')
+        self.S.start()
 
         try:
             # Now begin recording in intervals with FFC in between 
-            while self.S.time < expt_end_time:
-                self.S.write(self.sync_and_FFC)
-                self.start_recording = self.decide_when_to_trigger()
-
-                if self.start_recording:
-                    print('recording....')
-                    self.recbout_start_time = np.copy(self.S.time)
-                    self.recbout_end_time = self.recbout_start_time + self.rec_bout
-                    i = 0
-                    while  self.recbout_end_time >= self.S.time:   
-                        self.S.write(self.trig_and_sync)
-                    self.num_recordings += 1     
-                else:
-                    print('resting....')
-                    rest_start_time = np.copy(self.S.time)
-                    rest_end_time = rest_start_time + self.rest_bout
-                    
-                    while self.S.time < rest_end_time:
-                        self.S.write(self.only_sync)
-                   
-                    self.num_rests += 1 
-            
+            while self.scheduler.frames_written < expt_end_frame:
+                if self.scheduler.idle():
+                    self.schedule_next_bout()
+                underflowed = self.S.write(self.scheduler.next_block(blocksize, out=output_block))
+                self.metrics.count_write(underflowed)
+                self.metrics.tick()
 
         except (KeyboardInterrupt, SystemExit):
             print('Stopping recording ..exiting ')
 
         self.S.stop()
+        self.metrics.close()
+
+    def schedule_next_bout(self):
+        '''
+        Schedules an FFC followed by either a recording or a rest bout.
+        '''
+        self.scheduler.play_once('sync_and_FFC')
+        self.start_recording = self.decide_when_to_trigger()
+
+        if self.start_recording:
+            print('recording....')
+            self.recbout_start_frame, self.recbout_end_frame = self.scheduler.play('trig_and_sync',
+                                                                       int(self.rec_bout*self.fs))
+            self.num_recordings += 1
+        else:
+            print('resting....')
+            self.scheduler.play('only_sync', int(self.rest_bout*self.fs))
+            self.num_rests += 1
 
     def decide_when_to_trigger(self):
         if self.num_recordings==self.num_rests:
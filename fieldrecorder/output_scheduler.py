@@ -0,0 +1,280 @@
+"""
+Sample-accurate scheduling of the output signals sent to the cameras.
+
+Comparing the stream time against bout end times once per block makes every
+bout up to one block too long, and each comparison is a PortAudio time query.
+The output_scheduler instead counts the frames it has handed out, and switches
+between output modes (eg. 'only_sync', 'trig_and_sync', 'sync_and_FFC') at
+exact frame offsets - also in the middle of a block.
+
+All output modes are one sync cycle long. The scheduler plays them with their
+phase set by the total number of frames written, so the sync signal continues
+without a jump across every switch.
+
+Usage :
+
+    scheduler = output_scheduler({'only_sync':only_sync,
+                                  'trig_and_sync':trig_and_sync}, fs=192000)
+    bout_start, bout_end = scheduler.play('trig_and_sync', int(10*fs))
+    while ...:
+        stream.write(scheduler.next_block(blocksize))
+
+play and play_once can be called from another thread than next_block, eg.
+a worker thread while next_block runs in the PortAudio callback. A lock keeps
+the segments consistent, so that every segment starts at an exact frame.
+
+The block size does not need to be a multiple of the cycle length. Larger
+blocks mean fewer Python-level writes per second at the cost of latency,
+see benchmark_blocksizes to choose one for a machine.
+
+"""
+import collections
+import threading
+import time
+import numpy as np
+
+
+class output_scheduler():
+
+    def __init__(self, output_blocks, fs, default_mode='only_sync', max_blocksize=None,
+                 history_length=1000):
+        '''
+        Parameters
+        ----------
+        output_blocks : dict
+            Keys are mode names and entries are cycle_length x Nchannels np.arrays
+            holding one cycle of each output mode. All entries must have the
+            same shape.
+        fs : int
+            Sampling rate in Hz.
+        default_mode : str
+            Mode played whenever nothing else is scheduled. Defaults to 'only_sync'.
+        max_blocksize : int or None
+            Largest block that will be requested. Each mode is precomputed as a
+            periodic buffer long enough to copy such a block in one go. Defaults
+            to None, which precomputes two cycles.
+        history_length : int
+            Number of scheduled segments kept for events_between. Defaults to 1000.
+        '''
+        block_shapes = set([ each.shape for each in output_blocks.values()])
+        if len(block_shapes) > 1:
+            raise ValueError('All output blocks must have the same shape, got: '+
+                             str(block_shapes))
+        if default_mode not in output_blocks:
+            raise ValueError('Unknown output mode: ' + str(default_mode))
+
+        self.fs = fs
+        self.cycle_length, self.num_channels = list(block_shapes)[0]
+        # enough cycles back to back that max_blocksize frames starting at any
+        # phase are one contiguous slice
+        if max_blocksize is None:
+            max_blocksize = self.cycle_length
+        num_cycles = int(np.ceil(max_blocksize/float(self.cycle_length))) + 1
+        self.output_cycles = { mode: np.tile(np.float32(block), (num_cycles,1))
+                                       for mode, block in output_blocks.items()}
+        self.buffer_length = num_cycles*self.cycle_length
+        self.default_mode = default_mode
+
+        self.frames_written = 0
+        # (mode, end_frame) of each scheduled segment, in playing order
+        self.segments = collections.deque()
+        # (start_frame, end_frame, mode) of the segments in other modes than
+        # the default mode, eg. trigger and FFC signals
+        self.history = collections.deque(maxlen=history_length)
+        # held while the segments are read or changed, play_once calls play
+        self.lock = threading.RLock()
+
+    def scheduled_until(self):
+        '''
+        Returns:
+            end_frame : int. Frame at which the last scheduled segment ends, or the
+                        current frame if nothing is scheduled.
+        '''
+        with self.lock:
+            if len(self.segments) == 0:
+                return(self.frames_written)
+            return(max(self.segments[-1][1], self.frames_written))
+
+    def idle(self):
+        return(self.scheduled_until() <= self.frames_written)
+
+    def play(self, mode, num_frames):
+        '''
+        Schedules mode for exactly num_frames frames after everything that is
+        already scheduled.
+
+        Returns
+        -------
+        start_frame, end_frame : int
+            Frame numbers of the first and one past the last frame of the segment.
+        '''
+        if mode not in self.output_cycles:
+            raise ValueError('Unknown output mode: ' + str(mode))
+        with self.lock:
+            start_frame = self.scheduled_until()
+            end_frame = start_frame + int(num_frames)
+            self.segments.append((mode, end_frame))
+            if mode != self.default_mode:
+                self.history.append((start_frame, end_frame, mode))
+        return(start_frame, end_frame)
+
+    def play_once(self, mode):
+        '''
+        Schedules one whole cycle of mode, starting at the next cycle boundary
+        after everything already scheduled, eg. for an FFC signal that sits at
+        the start of its cycle.
+
+        Returns
+        -------
+        start_frame, end_frame : int
+        '''
+        with self.lock:
+            to_boundary = -self.scheduled_until() % self.cycle_length
+            if to_boundary > 0:
+                self.play(self.default_mode, to_boundary)
+            return(self.play(mode, self.cycle_length))
+
+    def events_between(self, start_frame, end_frame):
+        '''
+        Returns
+        -------
+        events : list
+            [start_frame, end_frame, mode] of each segment in other modes than
+            the default mode which overlaps start_frame to end_frame. Cancelled
+            segments are included.
+        '''
+        with self.lock:
+            return([ [start, end, mode] for start, end, mode in self.history
+                                         if start < end_frame and end > start_frame])
+
+    def cancel(self):
+        '''
+        Drops everything that has not been played yet.
+        '''
+        with self.lock:
+            self.segments.clear()
+
+    def next_block(self, num_frames, out=None):
+        '''
+        Fills the next num_frames output frames, switching modes at the scheduled
+        frames.
+
+        Parameters
+        ----------
+        num_frames : int
+        out : num_frames x Nchannels np.array or None
+            Array to fill, eg. the outdata of a PortAudio callback. Defaults to None,
+            which allocates a new float32 array.
+
+        Returns
+        -------
+        out : num_frames x Nchannels np.array
+        '''
+        if out is None:
+            out = np.empty((num_frames, self.num_channels), dtype=np.float32)
+
+        with self.lock:
+            self._fill(num_frames, out)
+        return(out)
+
+    def _fill(self, num_frames, out):
+        filled = 0
+        while filled < num_frames:
+            while len(self.segments) > 0 and self.segments[0][1] <= self.frames_written:
+                self.segments.popleft()
+
+            if len(self.segments) > 0:
+                mode, end_frame = self.segments[0]
+                segment_frames = min(num_frames-filled, end_frame-self.frames_written)
+            else:
+                mode = self.default_mode
+                segment_frames = num_frames - filled
+
+            phase = self.frames_written % self.cycle_length
+            # the slice has to stay inside output_cycles
+            segment_frames = min(segment_frames, self.buffer_length-phase)
+            out[filled:filled+segment_frames] = self.output_cycles[mode][phase:phase+segment_frames]
+
+            filled += segment_frames
+            self.frames_written += segment_frames
+
+    def time(self):
+        '''
+        Returns
+        -------
+        time : float
+            Seconds of output written so far.
+        '''
+        return(self.frames_written/float(self.fs))
+
+
+def benchmark_blocksizes(output_blocks, fs, blocksizes, durn=10.0, device=None):
+    '''
+    Plays the default output mode for durn seconds at each block size and measures
+    the CPU time used by the writing loop and the number of output underflows.
+
+    Parameters
+    ----------
+    output_blocks, fs : see output_scheduler
+    blocksizes : list with ints
+        Block sizes in frames to test.
+    durn : float
+        Seconds played per block size. Defaults to 10 s.
+    device : int or None
+        sounddevice index of the soundcard. Defaults to None, the default device.
+
+    Returns
+    -------
+    results : list with dicts
+        One dict per block size with the 'blocksize', 'latency' of one block in
+        seconds, 'writes_per_second', 'cpu_load' as the fraction of one CPU used
+        and the number of 'underflows'.
+    '''
+    import sounddevice as sd
+
+    num_channels = list(output_blocks.values())[0].shape[1]
+    results = []
+    for blocksize in blocksizes:
+        scheduler = output_scheduler(output_blocks, fs, max_blocksize=blocksize)
+        block = np.empty((blocksize, num_channels), dtype=np.float32)
+        num_blocks = int(durn*fs/blocksize)
+        underflows = 0
+
+        with sd.OutputStream(samplerate=fs, blocksize=blocksize, channels=num_channels,
+                             device=device, dtype='float32') as S:
+            start_cpu, start_wall = time.process_time(), time.perf_counter()
+            for i in range(num_blocks):
+                underflows += S.write(scheduler.next_block(blocksize, out=block))
+            cpu_time = time.process_time() - start_cpu
+            wall_time = time.perf_counter() - start_wall
+
+        results.append({'blocksize':blocksize,
+                        'latency':blocksize/float(fs),
+                        'writes_per_second':fs/float(blocksize),
+                        'cpu_load':cpu_time/wall_time,
+                        'underflows':underflows})
+    return(results)
+
+
+if __name__ == '__main__':
+    import argparse
+    from scipy import signal
+
+    arg_parser = argparse.ArgumentParser(description='Sweep the output block size '
+                                         'against CPU load and output underflows')
+    arg_parser.add_argument('--device', type=int, default=None)
+    arg_parser.add_argument('--fs', type=int, default=192000)
+    arg_parser.add_argument('--durn', type=float, default=10.0,
+                            help='seconds played per block size')
+    arg_parser.add_argument('--blocksizes', type=int, nargs='+',
+                            default=[1920, 3840, 7680, 15360, 30720, 61440])
+    args = arg_parser.parse_args()
+
+    t = np.arange(int(args.fs/25.0))/float(args.fs)
+    sync = np.float32(0.25*signal.square(2*np.pi*25*t + np.pi))
+    only_sync = np.column_stack((sync, 0*sync, 0*sync))
+
+    for result in benchmark_blocksizes({'only_sync':only_sync}, args.fs,
+                                       args.blocksizes, args.durn, args.device):
+        print('blocksize: %(blocksize)d (%(latency).3f s), writes/s: %(writes_per_second).1f,'
+              ' CPU load: %(cpu_load).3f, underflows: %(underflows)d'%result)
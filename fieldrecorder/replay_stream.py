@@ -0,0 +1,296 @@
+"""
+A file/NumPy backed stand-in for sounddevice streams, so that the recorders
+can be run, benchmarked and regression-tested without a soundcard.
+
+The replay_stream has the parts of the sd.Stream/sd.OutputStream interface the
+recorders use : read, write, time, start, stop, close, active and the
+callback mode. Reads return the frames of a recording (a numpy array or a
+soundfile-readable file read block by block). With keep_output the writes
+are kept, so that the output sent to the cameras can be checked afterwards.
+They are not kept by default, as an hour of 5 output channels at 192 kHz
+takes up about 14 GB.
+
+The stream can be paced in real time or faster (speed), or run as fast as the
+caller reads (speed=None). When paced, a caller that falls more than one input
+buffer behind loses frames and gets the overflow flag, and writes that arrive
+too late are counted as underflows, as with a real soundcard. Overflows can
+also be forced on given blocks.
+
+All recorders take a stream_backend keyword, eg. :
+
+    backend = replay_backend('MULTIWAV_2018-08-19_....WAV', speed=10.0)
+    recorder = fieldrecorder_trigger(3600, input_output_chs=(24,5),
+                                     stream_backend=backend)
+
+"""
+import threading
+import time
+import numpy as np
+import soundfile
+
+
+def replay_backend(recording, speed=1.0, **kwargs):
+    '''
+    Parameters
+    ----------
+    recording : np.array or str
+        nsamples x Nchannels np.array or path to a file soundfile can read.
+    speed : float or None
+        Pace of the stream relative to real time. Defaults to 1.0. None plays
+        as fast as the stream is read or written.
+
+    Keyword Arguments
+    -----------------
+    see replay_stream
+
+    Returns
+    -------
+    stream_backend : callable
+        Takes the same arguments as sd.Stream and returns a replay_stream.
+    '''
+    def stream_backend(**stream_kwargs):
+        stream_kwargs.update(kwargs)
+        return(replay_stream(recording, speed=speed, **stream_kwargs))
+    return(stream_backend)
+
+
+class replay_status():
+    '''
+    Stands in for sd.CallbackFlags in callback mode.
+    '''
+    def __init__(self, input_overflow=False, output_underflow=False):
+        self.input_overflow = input_overflow
+        self.output_underflow = output_underflow
+
+    def __bool__(self):
+        return(bool(self.input_overflow or self.output_underflow))
+    __nonzero__ = __bool__
+
+
+class replay_stream():
+
+    def __init__(self, recording, samplerate=None, blocksize=None, channels=None,
+                 speed=1.0, callback=None, **kwargs):
+        '''
+        Parameters
+        ----------
+        recording : np.array or str
+            see replay_backend
+        samplerate : int or None
+            Sampling rate of the stream. Defaults to the sampling rate of the
+            recording file, and must be given for arrays.
+        blocksize : int or None
+            Frames per callback in callback mode. Defaults to 1024.
+        channels : int or tuple with (input, output) ints
+            A single integer makes an output-only stream, like sd.OutputStream.
+        speed : float or None
+            see replay_backend
+        callback : callable or None
+            Called as callback(indata, outdata, frames, time_info, status) for
+            every block, like sd.Stream.
+
+        Keyword Arguments
+        -----------------
+        buffer_blocks : int
+            Number of blocks the emulated soundcard buffers before input frames
+            are lost or output underflows. Defaults to 4.
+        overflow_blocks : list with ints
+            Indices of read blocks that are returned with the overflow flag set.
+        loop : bool
+            If True the recording is repeated once it ends, otherwise reads past
+            its end return zeros. Defaults to False.
+        keep_output : bool
+            If True everything written to the stream is kept for output_signal.
+            Defaults to False, which only counts the written frames.
+
+        Any other keyword arguments of sd.Stream (device, dtype, latency) are
+        accepted and ignored.
+        '''
+        if isinstance(recording, str):
+            self.recording_file = soundfile.SoundFile(recording)
+            self.recording = None
+            if samplerate is None:
+                samplerate = self.recording_file.samplerate
+            num_recorded_channels = self.recording_file.channels
+        else:
+            self.recording_file = None
+            self.recording = np.asarray(recording, dtype=np.float32)
+            if self.recording.ndim == 1:
+                self.recording = self.recording.reshape(-1,1)
+            num_recorded_channels = self.recording.shape[1]
+        if samplerate is None:
+            raise ValueError('The samplerate must be given to replay an array')
+
+        if isinstance(channels, (tuple, list)):
+            self.input_channels, self.output_channels = channels
+        else:
+            self.input_channels, self.output_channels = 0, channels
+        if self.input_channels > num_recorded_channels:
+            raise ValueError('The recording has '+str(num_recorded_channels)+
+                             ' channels, but '+str(self.input_channels)+' were requested')
+
+        self.samplerate = samplerate
+        self.blocksize = blocksize or 1024
+        self.speed = speed
+        self.callback = callback
+        self.buffer_frames = kwargs.get('buffer_blocks', 4)*self.blocksize
+        self.overflow_blocks = set(kwargs.get('overflow_blocks', []))
+        self.loop = kwargs.get('loop', False)
+        self.keep_output = kwargs.get('keep_output', False)
+
+        self.frames_read = 0
+        self.frames_written = 0
+        self.blocks_read = 0
+        self.input_overflows = 0
+        self.output_underflows = 0
+        self.finished = False
+        self.output = []
+
+        self.active = False
+        self.start_time = None
+        self.callback_thread = None
+
+    def elapsed_frames(self):
+        '''
+        Frames the emulated soundcard has played since start, or None when
+        the stream is not paced.
+        '''
+        if self.speed is None or self.start_time is None:
+            return(None)
+        return(int((time.time() - self.start_time)*self.speed*self.samplerate))
+
+    @property
+    def time(self):
+        elapsed = self.elapsed_frames()
+        if elapsed is None:
+            elapsed = max(self.frames_read, self.frames_written)
+        return(elapsed/float(self.samplerate))
+
+    def start(self):
+        self.start_time = time.time()
+        self.active = True
+        if self.callback is not None:
+            self.callback_thread = threading.Thread(target=self._run_callbacks,
+                                                    name='replay_callback')
+            self.callback_thread.daemon = True
+            self.callback_thread.start()
+
+    def stop(self):
+        self.active = False
+        if self.callback_thread is not None:
+            self.callback_thread.join()
+            self.callback_thread = None
+
+    def close(self):
+        self.stop()
+        if self.recording_file is not None:
+            self.recording_file.close()
+
+    def __enter__(self):
+        self.start()
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, frames):
+        '''
+        Returns
+        -------
+        data : frames x input_channels np.array
+        overflowed : bool
+        '''
+        overflowed = self.blocks_read in self.overflow_blocks
+        elapsed = self.elapsed_frames()
+        if elapsed is None:
+            pass
+        elif elapsed - self.frames_read > self.buffer_frames:
+            # the caller is too slow, the frames that did not fit into the
+            # soundcard buffer are lost
+            self._skip(elapsed - self.frames_read - self.buffer_frames)
+            overflowed = True
+        else:
+            self._wait_until(self.frames_read + frames)
+
+        data = self._read_recording(frames)
+        self.frames_read += frames
+        self.blocks_read += 1
+        self.input_overflows += overflowed
+        return(data, overflowed)
+
+    def write(self, data):
+        '''
+        Returns
+        -------
+        underflowed : bool
+            True if the emulated soundcard ran out of output frames before
+            this block arrived.
+        '''
+        underflowed = False
+        elapsed = self.elapsed_frames()
+        if elapsed is not None:
+            if elapsed > self.frames_written + self.buffer_frames:
+                underflowed = True
+                self.frames_written = elapsed - self.buffer_frames
+            else:
+                self._wait_until(self.frames_written + data.shape[0] - self.buffer_frames)
+
+        if self.keep_output:
+            self.output.append(np.array(data, dtype=np.float32))
+        self.frames_written += data.shape[0]
+        self.output_underflows += underflowed
+        return(underflowed)
+
+    def output_signal(self):
+        '''
+        Returns
+        -------
+        output : nframes x output_channels np.array with everything written so far.
+        '''
+        if not self.keep_output:
+            raise ValueError('The output is only kept by streams made with keep_output=True')
+        if len(self.output) == 0:
+            return(np.zeros((0, self.output_channels), dtype=np.float32))
+        return(np.concatenate(self.output))
+
+    def _wait_until(self, frame):
+        if self.speed is None:
+            return
+        wait = self.start_time + frame/(self.speed*float(self.samplerate)) - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _skip(self, frames):
+        self._read_recording(frames)
+        self.frames_read += frames
+
+    def _read_recording(self, frames):
+        data = np.zeros((frames, self.input_channels), dtype=np.float32)
+        filled = 0
+        while filled < frames and not self.finished:
+            if self.recording is None:
+                chunk = self.recording_file.read(frames-filled, dtype='float32',
+                                                 always_2d=True)
+            else:
+                position = self.frames_read + filled
+                if self.loop:
+                    position %= self.recording.shape[0]
+                chunk = self.recording[position:position+frames-filled]
+
+            if chunk.shape[0] == 0:
+                if self.loop and self.recording_file is not None:
+                    self.recording_file.seek(0)
+                    continue
+                self.finished = True
+                break
+            data[filled:filled+chunk.shape[0]] = chunk[:,:self.input_channels]
+            filled += chunk.shape[0]
+        return(data)
+
+    def _run_callbacks(self):
+        outdata = np.zeros((self.blocksize, self.output_channels), dtype=np.float32)
+        while self.active:
+            indata, overflowed = self.read(self.blocksize)
+            status = replay_status(input_overflow=overflowed)
+            self.callback(indata, outdata, self.blocksize, None, status)
+            self.write(outdata)
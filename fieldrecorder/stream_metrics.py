@@ -0,0 +1,182 @@
+"""
+Instrumentation of the recording loops.
+
+sounddevice reports an input overflow or output underflow for every block, but
+these flags used to be thrown away, so nobody knew whether a night's recordings
+had gaps. The stream_metrics class counts them, together with a histogram of
+the time taken by each loop iteration and any other numbers worth watching
+(eg. writer queue depths), and appends a summary of every export interval as
+one line to a JSON-lines or CSV file next to the recordings.
+
+Usage :
+
+    metrics = stream_metrics('stream_metrics.jsonl', export_interval=10.0)
+    metrics.watch('writer_queue_depth', writer.queue_depth)
+    metrics.watch('writer_bytes_written', lambda : writer.bytes_written, rate=True)
+    while ...:
+        data, overflowed = S.read(blocksize)
+        metrics.count_read(overflowed)
+        metrics.count_write(S.write(output_block))
+        metrics.tick()
+    metrics.close()
+
+"""
+import csv
+import json
+import time
+import numpy as np
+
+
+class stream_metrics():
+
+    def __init__(self, metrics_file, export_interval=10.0, **kwargs):
+        '''
+        Parameters
+        ----------
+        metrics_file : str
+            Path of the file the metrics are appended to. Files ending with
+            .csv are written as CSV, all others as JSON lines.
+        export_interval : float
+            Seconds between two exports. Defaults to 10 s.
+
+        Keyword Arguments
+        -----------------
+        latency_bins : array-like
+            Upper edges of the loop latency histogram bins in milliseconds.
+            Longer iterations are counted in a last, open-ended bin.
+            Defaults to 1, 2, 5, 10, 20, 40, 80, 160 and 320 ms.
+        '''
+        self.metrics_file = metrics_file
+        self.export_interval = export_interval
+        self.latency_bins = np.array(kwargs.get('latency_bins',
+                                                [1, 2, 5, 10, 20, 40, 80, 160, 320]))
+        self.latency_names = ['latency_lt_%gms'%each for each in self.latency_bins]
+        self.latency_names.append('latency_ge_%gms'%self.latency_bins[-1])
+
+        self.watched = []
+        self.csv_columns = None
+
+        self.total_input_overflows = 0
+        self.total_output_underflows = 0
+        self.total_blocks = 0
+        self.start_time = time.time()
+        self.last_tick = None
+        self.reset_interval()
+
+    def reset_interval(self):
+        self.interval_start = time.time()
+        self.input_overflows = 0
+        self.output_underflows = 0
+        self.blocks = 0
+        self.latency_counts = np.zeros(self.latency_bins.size+1, dtype=np.int64)
+        self.max_latency = 0.0
+
+    def watch(self, name, function, rate=False):
+        '''
+        Adds a number to every export, eg. a queue depth.
+
+        Parameters
+        ----------
+        name : str
+        function : callable
+            Called without arguments at every export.
+        rate : bool
+            If True the change since the last export per second is exported
+            instead, eg. for bytes written. Defaults to False.
+        '''
+        self.watched.append([name, function, rate, function() if rate else None])
+
+    def count_read(self, overflowed):
+        self.input_overflows += bool(overflowed)
+        self.blocks += 1
+
+    def count_write(self, underflowed):
+        self.output_underflows += bool(underflowed)
+
+    def tick(self):
+        '''
+        Marks the end of one loop iteration. Adds the time since the last tick
+        to the latency histogram, and exports the metrics once export_interval
+        has passed.
+        '''
+        now = time.time()
+        if self.last_tick is not None:
+            latency_ms = (now - self.last_tick)*1000.0
+            self.latency_counts[np.searchsorted(self.latency_bins, latency_ms,
+                                                side='right')] += 1
+            self.max_latency = max(self.max_latency, latency_ms)
+        self.last_tick = now
+
+        if now - self.interval_start >= self.export_interval:
+            self.export()
+
+    def export(self):
+        '''
+        Appends the metrics of the current interval to the metrics file and
+        starts a new interval.
+
+        Returns
+        -------
+        row : dict
+            The exported metrics.
+        '''
+        now = time.time()
+        interval_durn = max(now - self.interval_start, 10**-9)
+        self.total_input_overflows += self.input_overflows
+        self.total_output_underflows += self.output_underflows
+        self.total_blocks += self.blocks
+
+        row = {'time':time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+               'elapsed':round(now - self.start_time, 3),
+               'interval':round(interval_durn, 3),
+               'blocks':self.blocks,
+               'input_overflows':self.input_overflows,
+               'output_underflows':self.output_underflows,
+               'total_input_overflows':self.total_input_overflows,
+               'total_output_underflows':self.total_output_underflows,
+               'max_latency_ms':round(self.max_latency, 3)}
+        for name, count in zip(self.latency_names, self.latency_counts):
+            row[name] = int(count)
+
+        for each in self.watched:
+            name, function, rate, previous = each
+            value = function()
+            if rate:
+                row[name+'_per_second'] = (value - previous)/interval_durn
+                each[3] = value
+            else:
+                row[name] = value
+
+        self.write_row(row)
+        self.reset_interval()
+        return(row)
+
+    def write_row(self, row):
+        if self.metrics_file.lower().endswith('.csv'):
+            if self.csv_columns is None:
+                self.csv_columns = list(row.keys())
+                with open(self.metrics_file, 'a', newline='') as metrics_file:
+                    csv.writer(metrics_file).writerow(self.csv_columns)
+            with open(self.metrics_file, 'a', newline='') as metrics_file:
+                csv.DictWriter(metrics_file, self.csv_columns).writerow(row)
+        else:
+            with open(self.metrics_file, 'a') as metrics_file:
+                metrics_file.write(json.dumps(row) + '\n')
+
+    def close(self):
+        '''
+        Exports the last interval and prints the totals.
+        '''
+        row = self.export()
+        print('Input overflows: '+str(self.total_input_overflows)+
+              ' Output underflows: '+str(self.total_output_underflows)+
+              ' Blocks: '+str(self.total_blocks)+
+              ' Metrics saved to: '+self.metrics_file)
+        return(row)
+
+
+def make_metrics_filename(extension='.jsonl'):
+    '''
+    Creates a file name that begins with METRICS_YYYY-MM-DD_hh-mm-ss
+    '''
+    return('METRICS_'+time.strftime('%Y-%m-%d_%H-%M-%S')+extension)
@@ -0,0 +1,87 @@
+"""
+Alignment metadata saved next to every recording.
+
+The recorder generates the sync, trigger and FFC signals itself and counts
+every frame it reads, so it knows where each file sits in the stream, where
+each output cycle and block starts and when the cameras were triggered. With
+a clock_drift_tracker it also knows the first rising edge of every AD
+converter in the file. Finding all this again from the sync channels after
+the recording is the slowest part of ADC_delay.
+
+make_sync_log collects it into one small dictionary per file, which
+write_sync_log saves as MULTIWAV_....WAV.sync.json. ADC_delay uses the
+'cutpoints' in it and only searches the sync channels when there is no log.
+
+The frames are counted from the start of the stream, and the input and the
+output frames are counted alike. Frame numbers in the output events are
+relative to the start of the file.
+"""
+import json
+
+
+def make_sync_log(fs, file_start_frame, num_frames, blocksize, scheduler,
+                  drift_tracker=None):
+    '''
+    Parameters
+    ----------
+    fs : int
+        Sampling rate in Hz.
+    file_start_frame : int
+        Stream frame of the first frame in the file.
+    num_frames : int
+        Number of frames in the file.
+    blocksize : int
+        Frames per block read from the stream.
+    scheduler : fieldrecorder.output_scheduler.output_scheduler
+        The scheduler that played the output signals.
+    drift_tracker : fieldrecorder.drift_tracker.clock_drift_tracker or None
+        Tracker that was told about the file with start_file. Defaults to None,
+        which leaves the cut points empty.
+
+    Returns
+    -------
+    sync_log : dict
+        With the 'fs', 'file_start_frame', the 'stream_start_time' of the file
+        in seconds, 'num_frames', 'blocksize', the 'first_block_boundary' and
+        'first_cycle_start' in the file, the 'cycle_length' of the output
+        signals, the 'output_events' as [start_frame, end_frame, mode] lists,
+        the 'syncch2device' with the file columns of the sync channels, as
+        ADC_delay reads them, the input channels they were recorded on as
+        'input_syncch2device', the 'cutpoints' of the AD converters, and the
+        rest of the drift tracker's file_log as 'drift'.
+    '''
+    file_end_frame = file_start_frame + num_frames
+    output_events = [ [max(start, file_start_frame) - file_start_frame,
+                       min(end, file_end_frame) - file_start_frame, mode]
+                          for start, end, mode in scheduler.events_between(file_start_frame,
+                                                                           file_end_frame)]
+    sync_log = {'fs':fs,
+                'file_start_frame':int(file_start_frame),
+                'stream_start_time':file_start_frame/float(fs),
+                'num_frames':int(num_frames),
+                'blocksize':int(blocksize),
+                'first_block_boundary':int(-file_start_frame % blocksize),
+                'cycle_length':int(scheduler.cycle_length),
+                'first_cycle_start':int(-file_start_frame % scheduler.cycle_length),
+                'output_events':output_events,
+                'syncch2device':None,
+                'input_syncch2device':None,
+                'cutpoints':None,
+                'drift':None}
+
+    if drift_tracker is not None:
+        drift_log = drift_tracker.file_log(num_frames)
+        for key in ['syncch2device', 'input_syncch2device', 'cutpoints']:
+            sync_log[key] = drift_log.pop(key)
+        for key in ['fs', 'file_start_frame', 'num_frames']:
+            drift_log.pop(key)
+        sync_log['drift'] = drift_log
+    return(sync_log)
+
+
+def write_sync_log(filename, sync_log):
+    '''
+    Saves the sync_log of a recording into filename.sync.json.
+    '''
+    with open(filename+'.sync.json', 'w') as sidecar:
+        json.dump(sync_log, sidecar, indent=1)
@@ -28,6 +28,8 @@ import pandas as pd
 import sounddevice as sd
 from scipy import signal
 import soundfile as sf
+from disk_writer import soundfile_writer, compressed_writer
+from fieldrecorder.stream_metrics import stream_metrics, make_metrics_filename
 import matplotlib.pyplot as plt
 plt.rcParams['agg.path.chunksize'] = 10000
 from pynput.keyboard import  Listener
@@ -57,6 +59,15 @@ class fieldrecorder_phyllo():
             one_recording_duration
             one_recording_pm
 
+            compression : None or 'FLAC'. If 'FLAC' the recordings are saved as
+                          lossless FLAC files, see disk_writer.compressed_writer.
+                          Defaults to None, which saves uncompressed WAV files.
+
+            metrics_file : string or None. File the input overflow/output underflow
+                           counts and loop latencies are saved to, see
+                           fieldrecorder.stream_metrics. Defaults to None, which saves
+                           them to METRICS_YYYY-MM-DD_hh-mm-ss.jsonl in target_dir.
+
         '''
         self.rec_durn = rec_durn
         self.press_count = 0
@@ -68,6 +79,8 @@ class fieldrecorder_phyllo():
         
         self.one_recording_duration = kwargs.get('one_recording_duration',300) # seconds
         self.one_recording_pm = kwargs.get('one_recording_pm', np.arange(0,5,0.25)) # the additional range with which all recordings are expected to vary.
+        self.compression = kwargs.get('compression', None)
+        self.metrics_file = kwargs.get('metrics_file', None)
         try:
             self.counter_file = kwargs['counter_file']
         except:
@@ -130,6 +143,12 @@ class fieldrecorder_phyllo():
 
         self.q = Queue.Queue()
 
+        self.metrics = stream_metrics(self.metrics_file or make_metrics_filename())
+        if self.compression is not None:
+            self.make_writer()
+            self.metrics.watch('writer_queue_depth', self.writer.queue_depth)
+            self.metrics.watch('writer_bytes', lambda : self.writer.bytes_written, rate=True)
+
         self.S.start()
 
         kb_input = Listener(on_press=self.on_press)
@@ -146,19 +165,32 @@ class fieldrecorder_phyllo():
                     now = time.time() 
                     recording_endtime = now + self.one_recording_duration + float(np.random.choice(self.one_recording_pm,1))
                     print('Approx. end time of recording:', time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(recording_endtime)))
-                    with sf.SoundFile(audiofilename, mode='x', samplerate=self.fs,
-                                                    channels=len(self.save_channels)) as file:
+                    if self.compression is None:
+                        with sf.SoundFile(audiofilename, mode='x', samplerate=self.fs,
+                                                        channels=len(self.save_channels)) as file:
+                            while time.time() < recording_endtime:
+                            
+                                data, overflowed = self.S.read(self.trig_and_sync.shape[0])
+                                self.metrics.count_read(overflowed)
+                                file.write(data[:,self.save_channels])
+                                self.metrics.count_write(self.S.write(self.trig_and_sync))
+                                self.metrics.tick()
+                    else:
+                        self.writer.open_file(audiofilename)
                         while time.time() < recording_endtime:
-                        
-                            data, success = self.S.read(self.trig_and_sync.shape[0])
-                            file.write(data[:,self.save_channels])
-                            self.S.write(self.trig_and_sync)
-                        self.start_recording = False
+                            data, overflowed = self.S.read(self.trig_and_sync.shape[0])
+                            self.metrics.count_read(overflowed)
+                            self.writer.write(data[:,self.save_channels])
+                            self.metrics.count_write(self.S.write(self.trig_and_sync))
+                            self.metrics.tick()
+                        self.writer.close_file()
+                    self.start_recording = False
                     print('Recording done- press any key to trigger the next recording... \n'+'The saved filename is: ' +  audiofilename)
                     self.increment_filecounter()
 
                 else :
-                    self.S.write(self.only_sync)
+                    self.metrics.count_write(self.S.write(self.only_sync))
+                    self.metrics.tick()
 
                 session_time = self.S.time
 
@@ -175,8 +207,32 @@ class fieldrecorder_phyllo():
 
         print('Queue size is',self.q.qsize())
 
+        if self.compression is not None:
+            self.stop_writer()
+        self.metrics.close()
+
         return(self.fs,self.rec)
 
+    def make_writer(self):
+        '''
+        Starts the compressed_writer that encodes the recordings on background
+        threads. The encoder queues can hold one recording worth of blocks.
+        '''
+        if self.compression != 'FLAC':
+            raise ValueError('Unknown compression: '+str(self.compression))
+        max_durn = self.one_recording_duration + np.max(self.one_recording_pm)
+        recording_numblocks = int(np.ceil(max_durn*self.fs/float(self.sync_signal.size)))
+        self.writer = compressed_writer(self.fs, len(self.save_channels),
+                                        max_queue_blocks=recording_numblocks)
+        self.writer.start()
+
+    def stop_writer(self):
+        self.writer.stop()
+        print('Compression ratio: '+str(self.writer.compression_ratio())+
+              ' maximum encoder lag: '+str(self.writer.max_encoder_lag)+' s,'+
+              ' files written uncompressed: '+str(self.writer.fallbacks)+
+              ' blocks dropped: '+str(self.writer.dropped_blocks))
+
     def make_filename(self):
         '''
         Creates a file name that begins with MULTIWAV_YYYY-MM-DD_hh-mm-ss_UNIQUENUMBER
@@ -48,7 +48,6 @@ Created on Mon Nov 06 18:10:01 2017
 @author: Thejasvi Beleyur
 """
 import os
-import Queue
 import datetime as dt
 import time
 import numpy as np
@@ -57,7 +56,15 @@ from scipy import signal
 import soundfile
 import matplotlib.pyplot as plt
 plt.rcParams['agg.path.chunksize'] = 10000
-from pynput.keyboard import  Listener
+from stream_engine import callback_engine
+from fieldrecorder.output_scheduler import output_scheduler
+from fieldrecorder.stream_metrics import stream_metrics, make_metrics_filename
+from fieldrecorder.drift_tracker import clock_drift_tracker
+from fieldrecorder.sync_log import make_sync_log, write_sync_log
+from disk_writer import soundfile_writer, compressed_writer
+from audio_buffers import pretrigger_buffer, bout_buffer
+from trigger_detection import streaming_bandpass, level_detector, band_energy_detector
+from trigger_detection import noise_floor_trigger, trigger_cascade
 
 
 
@@ -91,7 +98,94 @@ class fieldrecorder_trigger():
                                used for monitoring
             
             bandpass_freqs : tuple. Highpass and lowpass frequencies for the trigger calculation
-                       Defaults to the whole frequency spectrum.
+                       Defaults to the whole frequency spectrum. With the 'band_energy'
+                       trigger_mode this can also be a list of tuples, one per band.
+
+            trigger_mode : 'bandpass' or 'band_energy'. 'bandpass' filters the monitor
+                           channels with a Butterworth bandpass and then checks their
+                           dB rms. 'band_energy' checks the dB rms in each band of
+                           bandpass_freqs from the spectrum of each block, which is
+                           cheaper and allows several bands, see
+                           trigger_detection.band_energy_detector. The trigger_level can
+                           then also be a list with one level per band. Defaults to
+                           'bandpass'.
+
+            noise_floor_margin : float, list with one float per monitor channel, or None.
+                                 If given, a channel triggers once it is this many dB
+                                 above a running estimate of its own noise floor, and
+                                 trigger_level is only the lowest level that triggers,
+                                 see trigger_detection.noise_floor_trigger. Defaults to
+                                 None, which triggers at the fixed trigger_level.
+
+            hysteresis : float. dB below noise_floor_margin a channel has to drop to
+                         stop triggering. Defaults to 6 dB.
+
+            min_trigger_blocks : integer. Number of consecutive blocks a channel has to
+                                 be above noise_floor_margin to trigger. Defaults to 2.
+
+            max_trigger_blocks : integer. Number of checks in a row after which a
+                                 channel above noise_floor_margin has its noise floor
+                                 set to its level. Every check before that starts a
+                                 recording bout. Defaults to 3, so that a lasting step
+                                 in the noise triggers at most two bouts.
+
+            noise_floor_step : float. dB the noise floor moves by per block.
+                               Defaults to 0.05 dB.
+
+            prescreen_level : float <=0 or None. If given, the monitor channels are
+                              only bandpassed and checked against the trigger level
+                              once the peak of every prescreen_stride-th sample is
+                              at or above this dB peak ref max, see
+                              trigger_detection.trigger_cascade. It should be a few dB
+                              below the lowest trigger level. Defaults to None, which
+                              checks every block in full.
+
+            prescreen_stride : integer >=1. See prescreen_level. Defaults to 8.
+
+            prescreen_hold : integer. Number of blocks the full check keeps running
+                             for after the last block above prescreen_level.
+                             Defaults to 25.
+
+            pretrigger_durn : float >=0. Seconds of audio from before the trigger
+                              that are saved at the start of each recording bout.
+                              Defaults to 1 second.
+
+            compression : None or 'FLAC'. If 'FLAC' the recording bouts are saved as
+                          lossless FLAC files by a pool of background encoders,
+                          see disk_writer.compressed_writer. Defaults to None, which
+                          saves uncompressed WAV files.
+
+            blocksize : integer or None. Number of frames read and written per block.
+                        Larger blocks mean fewer Python-level reads/writes per second
+                        but coarser trigger checks. Defaults to None, which uses one
+                        sync cycle (40 ms). See fieldrecorder.output_scheduler.benchmark_blocksizes
+                        to choose one for a machine.
+
+            metrics_file : string or None. File the overflow/underflow counts, loop
+                           latencies and writer statistics are saved to, see
+                           fieldrecorder.stream_metrics. Defaults to None, which saves
+                           them to METRICS_YYYY-MM-DD_hh-mm-ss.jsonl in target_dir.
+
+            metrics_interval : float. Seconds between two exports of the metrics.
+                               Defaults to 10 seconds.
+
+            fs : integer. Sampling rate in Hertz. Defaults to 192000.
+
+            stream_backend : callable or None. Called with the sd.Stream arguments
+                             to make the audio stream, eg. a replay_backend from
+                             fieldrecorder.replay_stream to run the recorder on a
+                             recorded file. Defaults to None, which uses sd.Stream.
+
+            syncch2device : dictionary or None. Keys are the names of the AD converters
+                            and entries the input channels they record the sync signal
+                            on, eg. {'1':7,'2':19}. If given, the offset and clock drift
+                            between the converters are tracked during the session,
+                            and the cut points of each recording are saved in its
+                            sync log, see fieldrecorder.drift_tracker. Defaults to None.
+
+        Each recording is saved with a MULTIWAV_....WAV.sync.json log of its position
+        in the stream, the trigger and FFC signals played during it and, with
+        syncch2device, the cut points ADC_delay aligns it with. See fieldrecorder.sync_log.
 
         '''
         self.rec_durn = rec_durn
@@ -102,7 +196,10 @@ class fieldrecorder_trigger():
         self.input_output_chs = input_output_chs
         self.target_dir = target_dir
         self.FFC_interval = 2
-        self.fs = 192000
+        self.fs = kwargs.get('fs', 192000)
+        self.stream_backend = kwargs.get('stream_backend', None)
+        if self.stream_backend is None:
+            self.stream_backend = sd.Stream
         self.duty_cycle = duty_cycle
 
         
@@ -147,16 +244,49 @@ class fieldrecorder_trigger():
             self.monitor_channels = [0,1,2,3]
         else:
             self.monitor_channels = kwargs['monitor_channels']
-        
-        if 'bandpass_freqs' in kwargs.keys():
+
+        self.trigger_mode = kwargs.get('trigger_mode', 'bandpass')
+        if self.trigger_mode == 'band_energy':
+            bands = kwargs.get('bandpass_freqs', (0, self.fs/2.0))
+            self.level_detector = band_energy_detector(bands, self.fs, self.trigger_level,
+                                                       len(self.monitor_channels))
+        elif self.trigger_mode == 'bandpass':
+            self.level_detector = level_detector(self.trigger_level,
+                                                 len(self.monitor_channels))
+        else:
+            raise ValueError('Unknown trigger_mode: '+str(self.trigger_mode))
+
+        if kwargs.get('noise_floor_margin', None) is not None:
+            self.level_detector = noise_floor_trigger(self.level_detector,
+                                          kwargs['noise_floor_margin'],
+                                          kwargs.get('hysteresis', 6.0),
+                                          kwargs.get('min_trigger_blocks', 2),
+                                          step=kwargs.get('noise_floor_step', 0.05),
+                                          max_on_blocks=kwargs.get('max_trigger_blocks', 3))
+
+        if 'bandpass_freqs' in kwargs.keys() and self.trigger_mode == 'bandpass':
             self.highpass_freq, self.lowpass_freq = kwargs['bandpass_freqs']
-            nyq_freq = self.fs/2.0
-            self.b, self.a = signal.butter(4, [self.highpass_freq/nyq_freq,
-                                               self.lowpass_freq/nyq_freq],
-                                btype='bandpass')
+            self.bp_filter = streaming_bandpass(kwargs['bandpass_freqs'], self.fs,
+                                                len(self.monitor_channels))
             self.bandpass = True
         else:
             self.bandpass = False
+
+        if kwargs.get('prescreen_level', None) is not None:
+            self.trigger_cascade = trigger_cascade(self.full_trigger_check,
+                                           kwargs['prescreen_level'],
+                                           kwargs.get('prescreen_stride', 8),
+                                           hold_blocks=kwargs.get('prescreen_hold', 25),
+                                           on_wake=self.reset_bandpass)
+        else:
+            self.trigger_cascade = None
+
+        self.pretrigger_durn = kwargs.get('pretrigger_durn', 1.0)
+        self.compression = kwargs.get('compression', None)
+        self.blocksize = kwargs.get('blocksize', None)
+        self.metrics_file = kwargs.get('metrics_file', None)
+        self.metrics_interval = kwargs.get('metrics_interval', 10.0)
+        self.syncch2device = kwargs.get('syncch2device', None)
             
         if duty_cycle is None:
             self.minimum_interval = 0
@@ -164,12 +294,11 @@ class fieldrecorder_trigger():
             self.minimum_interval = ((1-duty_cycle)/duty_cycle)*self.rec_bout
             
 
-    def thermoacousticpy(self):
+    def make_output_signals(self):
         '''
-        Performs the synchronised recording of thermal cameras and audio.
-
+        Generates the one cycle long output blocks played to the cameras :
+        only_sync, trig_and_sync and sync_and_FFC.
         '''
-
         one_cycledurn = 1.0/self.sync_freq
         num_cycles = 1
         sig_durn = num_cycles*one_cycledurn
@@ -207,81 +336,224 @@ class fieldrecorder_trigger():
                                           self.empty_signal, self.empty_signal,
                                           self.ffc_signal))
 
+        if self.blocksize is None:
+            self.blocksize = self.sync_signal.size
 
-        self.S = sd.Stream(samplerate=self.fs,blocksize=self.sync_signal.size,
-                           channels=self.input_output_chs,device=self.tgt_ind)
+    def thermoacousticpy(self):
+        '''
+        Performs the synchronised recording of thermal cameras and audio.
 
-        start_time = np.copy(self.S.time)
-        rec_time = np.copy(self.S.time)
-        end_time =  start_time + self.rec_durn
+        '''
+
+        self.make_output_signals()
 
+        self.S = self.stream_backend(samplerate=self.fs,blocksize=self.blocksize,
+                                     channels=self.input_output_chs,device=self.tgt_ind)
+        self.make_scheduler()
+        blocksize = self.blocksize
+        output_block = np.empty((blocksize, self.only_sync.shape[1]), dtype=np.float32)
+        session_frames = int(self.rec_durn*self.fs)
 
-        self.q = Queue.Queue()
+        self.rec = None
+        self.make_writer()
+        self.make_pretrigger_buffer()
+        self.make_bout_buffer()
+        self.make_drift_tracker()
+        self.make_metrics()
 
         self.S.start()
         num_recordings = 0
         ffc_recnum = -999
         prev_rectime = 0.0
+        self.bout_frames_left = 0
         
         try:
 
-            while rec_time < end_time:
-                
-                self.mic_inputs = self.S.read(self.trig_and_sync.shape[0])
-                self.ref_channels = self.mic_inputs[0][:,self.monitor_channels]
-                self.ref_channels_bp = self.bandpass_sound(self.ref_channels)
-                self.above_level = self.check_if_above_level(self.ref_channels_bp)
-                
-                # if duty cycle recording implemented:
-                if self.above_level:
-                    self.start_recording = self.minimum_interval_passed(self.S.time,
-                                                                    prev_rectime,
-                                                                    self.minimum_interval)
-                else:
-                    self.start_recording = False
+            while self.scheduler.frames_written < session_frames:
                 
-                if self.start_recording:
-                    print('starting_recording')
-                    self.recbout_start_time = np.copy(self.S.time)
-                    self.recbout_end_time = self.recbout_start_time + self.rec_bout
-                    i = 0
-                    print(self.S.time)
-                    while  self.recbout_end_time >= self.S.time:   
-                        if i != 0:
-                            self.q.put(self.S.read(self.trig_and_sync.shape[0]))
-                        else:
-                            self.q.put(self.mic_inputs)
-                        
-                        self.S.write(self.trig_and_sync)
-                        i += 1
-                        
-                    print(self.S.time)    
-                    self.empty_qcontentsintolist()
-                    self.save_qcontents_aswav()
-                    self.start_recording = False    
-
-                    num_recordings += 1 
-                    prev_rectime = np.copy(self.S.time)
-                else :
+                self.mic_inputs = self.S.read(blocksize)
+                self.metrics.count_read(self.mic_inputs[1])
+                self.track_drift(self.mic_inputs[0])
+
+                if self.bout_frames_left == 0:
+                    self.ref_channels = self.mic_inputs[0][:,self.monitor_channels]
+                    self.above_level = self.check_trigger(self.ref_channels)
                     
-                    ffc_initiate = np.remainder(num_recordings,
-                                                self.FFC_interval) == 0                    
-                    if ffc_initiate:
-                        # check if FFC has already taken place:
-                        if ffc_recnum != num_recordings:
-                            self.S.write(self.sync_and_FFC)    
-                            ffc_recnum = np.copy(num_recordings)                               
-                
-                    self.S.write(self.only_sync)
-            
+                    # if duty cycle recording implemented:
+                    if self.above_level:
+                        self.start_recording = self.minimum_interval_passed(self.scheduler.time(),
+                                                                        prev_rectime,
+                                                                        self.minimum_interval)
+                    else:
+                        self.start_recording = False
+                    
+                    if self.start_recording:
+                        print('starting_recording')
+                        self.start_bout()
+                        self.recbout_start_frame, self.recbout_end_frame = self.scheduler.play('trig_and_sync',
+                                                                                               self.bout_frames)
+                        self.bout_frames_left = self.bout_frames
+                    else :
+                        self.pretrigger.put(self.mic_inputs[0])
+                        
+                        ffc_initiate = np.remainder(num_recordings,
+                                                    self.FFC_interval) == 0                    
+                        if ffc_initiate:
+                            # check if FFC has already taken place:
+                            if ffc_recnum != num_recordings:
+                                self.scheduler.play_once('sync_and_FFC')
+                                ffc_recnum = np.copy(num_recordings)                               
+
+                if self.bout_frames_left > 0:
+                    # the last block of a bout is cut so the bout is exactly rec_bout long
+                    bout_block = self.mic_inputs[0][:self.bout_frames_left]
+                    self.store_bout_block(bout_block)
+                    self.bout_frames_left -= bout_block.shape[0]
+
+                    if self.bout_frames_left == 0:
+                        self.end_bout()
+                        self.start_recording = False
+                        num_recordings += 1
+                        prev_rectime = self.scheduler.time()
+
+                underflowed = self.S.write(self.scheduler.next_block(blocksize, out=output_block))
+                self.metrics.count_write(underflowed)
+                self.metrics.tick()
 
         except (KeyboardInterrupt, SystemExit):
             print('Stopping recording ..exiting ')
 
         self.S.stop()
-        print('Queue size is',self.q.qsize())
+        self.stop_writer()
+        self.metrics.close()
+        self.report_trigger_stats()
         return(self.fs,self.rec)
 
+    def thermoacousticpy_callback(self):
+        '''
+        Performs the synchronised recording of thermal cameras and audio with
+        a non-blocking stream.
+
+        The sync/trigger/FFC output blocks are played, and the input blocks
+        collected, by the PortAudio callback of a callback_engine. Trigger
+        detection and saving happen in a worker thread (see process_block),
+        and so can no longer stall the sync signal going to the cameras.
+
+        '''
+        self.make_output_signals()
+
+        output_blocks = {'only_sync' : self.only_sync,
+                         'trig_and_sync' : self.trig_and_sync,
+                         'sync_and_FFC' : self.sync_and_FFC}
+
+        self.engine = callback_engine(output_blocks, fs=self.fs,
+                                      input_output_chs=self.input_output_chs,
+                                      device=self.tgt_ind, blocksize=self.blocksize,
+                                      stream_backend=self.stream_backend)
+        self.scheduler = self.engine.scheduler
+
+        self.rec = None
+        self.make_writer()
+        self.make_pretrigger_buffer()
+        self.make_bout_buffer()
+        self.make_drift_tracker()
+        self.make_metrics()
+        self.num_recordings = 0
+        self.ffc_recnum = -999
+        self.prev_rectime = 0.0
+        self.blocks_processed = 0
+        self.bout_frames_left = 0
+        self.bout_frames = int(self.rec_bout*self.fs)
+        session_numblocks = int(np.ceil(self.rec_durn*self.fs/float(self.engine.blocksize)))
+
+        self.trigger_reader = self.engine.add_worker(self.process_block,
+                                                     name='trigger_worker')
+        self.metrics.watch('engine_output_underflows', lambda : self.engine.output_underflows)
+        self.metrics.watch('trigger_worker_dropped_blocks',
+                           lambda : self.trigger_reader.dropped_blocks)
+        self.engine.start()
+
+        try:
+            while self.engine.active and self.engine.blocks_recorded < session_numblocks:
+                time.sleep(0.1)
+
+        except (KeyboardInterrupt, SystemExit):
+            print('Stopping recording ..exiting ')
+
+        self.engine.stop()
+        self.stop_writer()
+        self.metrics.close()
+        self.report_trigger_stats()
+        print('Input overflows: '+str(self.engine.input_overflows)+
+              ' Output underflows: '+str(self.engine.output_underflows)+
+              ' Blocks dropped by trigger worker: '+str(self.trigger_reader.dropped_blocks))
+        return(self.fs,self.rec)
+
+    def process_block(self, data, overflowed):
+        '''
+        Handles one input block in thermoacousticpy_callback. Checks for the
+        trigger, collects the blocks of a recording bout and switches the
+        output of the engine between only_sync, trig_and_sync and sync_and_FFC.
+
+        Inputs:
+            data : blocksize x Nchannels np.array. View into the engine's ring buffer.
+            overflowed : Boolean. Input overflow flag of the block.
+        '''
+        block_time = self.blocks_processed*self.engine.blocksize/float(self.fs)
+        self.blocks_processed += 1
+        self.metrics.count_read(overflowed)
+        self.metrics.tick()
+        self.track_drift(data)
+
+        if self.bout_frames_left == 0:
+            self.ref_channels = data[:,self.monitor_channels]
+            self.above_level = self.check_trigger(self.ref_channels)
+
+            if self.above_level:
+                self.start_recording = self.minimum_interval_passed(block_time,
+                                                                self.prev_rectime,
+                                                                self.minimum_interval)
+            else:
+                self.start_recording = False
+
+            if not self.start_recording:
+                self.pretrigger.put(data)
+                ffc_initiate = np.remainder(self.num_recordings,
+                                            self.FFC_interval) == 0
+                # check if FFC has already taken place:
+                if ffc_initiate and self.ffc_recnum != self.num_recordings:
+                    self.engine.play_once('sync_and_FFC')
+                    self.ffc_recnum = self.num_recordings
+                return
+
+            print('starting_recording')
+            self.start_bout()
+            self.engine.play('trig_and_sync', self.bout_frames)
+            self.bout_frames_left = self.bout_frames
+
+        # the last block of a bout is cut so the bout is exactly rec_bout long
+        bout_block = data[:self.bout_frames_left]
+        self.store_bout_block(bout_block)
+        self.bout_frames_left -= bout_block.shape[0]
+
+        if self.bout_frames_left == 0:
+            self.end_bout()
+            self.start_recording = False
+            self.num_recordings += 1
+            self.prev_rectime = block_time
+
+    def make_scheduler(self):
+        '''
+        Makes the output_scheduler that switches between the only_sync,
+        trig_and_sync and sync_and_FFC outputs at exact sample offsets.
+        '''
+        output_blocks = {'only_sync' : self.only_sync,
+                         'trig_and_sync' : self.trig_and_sync,
+                         'sync_and_FFC' : self.sync_and_FFC}
+        self.scheduler = output_scheduler(output_blocks, self.fs,
+                                          max_blocksize=self.blocksize)
+        self.bout_frames = int(self.rec_bout*self.fs)
+
     def minimum_interval_passed(self,timenow,last_recordingtime,
                                 minimum_interval):
         ''' Calculates the time difference between the time at which the threshold
@@ -299,15 +571,55 @@ class fieldrecorder_trigger():
     
 
     def bandpass_sound(self, rec_buffer):
-        """
+        """Bandpasses the monitor channels of one block. The filter state is
+        carried over from the previous block, so there is no filter transient
+        at the start of each block.
         """
         if self.bandpass:
-            rec_buffer_bp = np.apply_along_axis(lambda X : signal.lfilter(self.b, self.a, X),
-                                                0, rec_buffer)
+            rec_buffer_bp = self.bp_filter.filter(rec_buffer)
             return(rec_buffer_bp)
         else:
             return(rec_buffer)
 
+    def reset_bandpass(self):
+        """The monitor channels are not filtered during a recording bout.
+        Start the filter from rest after a bout rather than from the stale
+        state of the bout's first block.
+        """
+        if self.bandpass:
+            self.bp_filter.reset()
+
+    def check_trigger(self, ref_channels):
+        '''
+        Checks one block of the monitor channels for the trigger, through the
+        trigger_cascade if there is a prescreen_level.
+
+        Returns:
+            above_level : Boolean. see check_if_above_level
+        '''
+        if self.trigger_cascade is None:
+            return(self.full_trigger_check(ref_channels))
+        return(self.trigger_cascade.check(ref_channels))
+
+    def full_trigger_check(self, ref_channels):
+        self.ref_channels_bp = self.bandpass_sound(ref_channels)
+        return(self.check_if_above_level(self.ref_channels_bp))
+
+    def report_trigger_stats(self):
+        '''
+        Prints the hit rates and CPU time of the two stages of the trigger_cascade.
+        '''
+        if self.trigger_cascade is None:
+            return
+        stats = self.trigger_cascade.stats()
+        print('Trigger prescreen passed '+str(round(100*stats['stage1_hit_rate'], 1))+
+              '% of '+str(stats['blocks'])+' blocks, full check ran on '+
+              str(round(100*stats['stage2_run_rate'], 1))+'% and triggered on '+
+              str(round(100*stats['stage2_hit_rate'], 1))+'% of those. CPU time per block: '+
+              str(round(stats['stage1_us']))+' us prescreen, '+
+              str(round(stats['stage2_us']))+' us full check, '+
+              str(round(100*stats['cpu_fraction']))+'% of checking every block in full')
+
     def check_if_above_level(self, mic_inputs):
         """Checks if the dB rms level of the input recording buffer is above
         threshold. If any of the microphones are above the given level then 
@@ -323,64 +635,198 @@ class fieldrecorder_trigger():
         Returns:
             
             above_level : Boolean. True if the buffer dB rms is >= the trigger_level
+
+        The mean squared value of each channel is kept in self.channel_meansquared
+        (see trigger_detection.to_dBrms to convert it into dB rms). With the
+        'band_energy' trigger_mode it holds one row per band.
         """
 
-        dBrms_channel = np.apply_along_axis(self.calc_dBrms, 0, mic_inputs)        
-        above_level = np.any( dBrms_channel >= self.trigger_level)
+        above_level, self.channel_meansquared = self.level_detector.check(mic_inputs)
         return(above_level)
         
-    def calc_dBrms(self, one_channel_buffer):
-        """
-        """
-        squared = np.square(one_channel_buffer)
-        mean_squared = np.mean(squared)
-        root_mean_squared = np.sqrt(mean_squared)
-        try:
-            dB_rms = 20.0*np.log10(root_mean_squared)
-        except:
-            dB_rms = -999.
-        return(dB_rms)
-
 
-    def empty_qcontentsintolist(self):
-        try:
-            self.q_contents = [ self.q.get()[0] for i in range(self.q.qsize()) ]
+    def make_writer(self):
+        '''
+        Starts the background soundfile_writer, or compressed_writer, that streams
+        the recording bouts to disk. The writer queue can hold two recording bouts
+        worth of blocks.
+        '''
+        blocksize = self.blocksize
+        bout_numblocks = int(np.ceil(self.rec_bout*self.fs/float(blocksize)))
+        if self.compression == 'FLAC':
+            self.writer = compressed_writer(self.fs, len(self.save_channels),
+                                            max_queue_blocks=2*bout_numblocks)
+        elif self.compression is None:
+            self.writer = soundfile_writer(self.fs, len(self.save_channels),
+                                           max_queue_blocks=2*bout_numblocks)
+        else:
+            raise ValueError('Unknown compression: '+str(self.compression))
+        self.writer.start()
 
-        except:
-            raise IOError('Unable to empty queue object contents')
+    def stop_writer(self):
+        '''
+        Waits for all queued blocks to be written and reports the writer's
+        queue statistics.
+        '''
+        print('Writer queue depth: '+str(self.writer.queue_depth())+' blocks,'+
+              ' maximum depth: '+str(self.writer.max_queue_depth)+' blocks')
+        self.writer.stop()
+        if self.writer.dropped_blocks > 0:
+            print('WARNING: '+str(self.writer.dropped_blocks)+
+                  ' blocks were dropped because the writer queue was full')
+        if self.compression is not None:
+            print('Compression ratio: '+str(self.writer.compression_ratio())+
+                  ' maximum encoder lag: '+str(self.writer.max_encoder_lag)+' s,'+
+                  ' files written uncompressed: '+str(self.writer.fallbacks))
+
+    def make_metrics(self):
+        '''
+        Starts the stream_metrics which count input overflows, output underflows
+        and loop latencies, and watch the writer's queue depth and throughput.
+        '''
+        if self.metrics_file is None:
+            metrics_file = make_metrics_filename()
+        else:
+            metrics_file = self.metrics_file
+        self.metrics = stream_metrics(metrics_file, self.metrics_interval)
+        self.metrics.watch('writer_queue_depth', self.writer.queue_depth)
+        self.metrics.watch('writer_dropped_blocks', lambda : self.writer.dropped_blocks)
+        self.metrics.watch('writer_bytes', lambda : self.writer.bytes_written, rate=True)
+        self.metrics.watch('bout_samples_lost', lambda : self.bout.samples_lost)
+        if self.trigger_cascade is not None:
+            # the rates of the CPU times are the fraction of one core used
+            self.metrics.watch('trigger_stage1_cpu',
+                               lambda : self.trigger_cascade.stage1_cpu, rate=True)
+            self.metrics.watch('trigger_stage2_cpu',
+                               lambda : self.trigger_cascade.stage2_cpu, rate=True)
+            self.metrics.watch('trigger_stage2_blocks',
+                               lambda : self.trigger_cascade.stage2_blocks, rate=True)
+        if self.drift_tracker is not None:
+            for device in self.drift_tracker.other_devices:
+                self.metrics.watch('clock_drift_ppm_'+device,
+                                   lambda device=device : self.drift_tracker.drift_ppm(device))
+                self.metrics.watch('clock_offset_'+device,
+                                   lambda device=device : self.drift_tracker.offset(device,
+                                                                    self.frames_read))
+
+    def make_drift_tracker(self):
+        '''
+        Starts the clock_drift_tracker on the sync channels of the AD converters,
+        if syncch2device is given.
+        '''
+        self.frames_read = 0
+        self.block_start_frame = 0
+        if self.syncch2device is None:
+            self.drift_tracker = None
+            return
+        # enough sync edges to find the start of a file with pretrigger audio
+        history_durn = max(self.pretrigger_durn, 0) + 2*self.blocksize/float(self.fs) + 1
+        self.drift_tracker = clock_drift_tracker(self.fs, self.syncch2device,
+                                                 fps=self.sync_freq,
+                                                 history_durn=history_durn,
+                                                 save_channels=self.save_channels)
+
+    def track_drift(self, block):
+        '''
+        Counts the frames read so far and passes the block on to the drift tracker.
 
-        pass
+        Inputs:
+            block : blocksize x Nchannels np.array. All input channels of one block.
+        '''
+        self.block_start_frame = self.frames_read
+        self.frames_read += block.shape[0]
+        if self.drift_tracker is not None:
+            self.drift_tracker.update(block)
 
-    def save_qcontents_aswav(self):
+    def make_pretrigger_buffer(self):
+        '''
+        Allocates the pretrigger_buffer which holds the save channels of the
+        last pretrigger_durn seconds before a trigger.
+        '''
+        num_samples = max(int(self.pretrigger_durn*self.fs), 1)
+        self.pretrigger = pretrigger_buffer(num_samples, self.input_output_chs[0],
+                                            channels=self.save_channels)
 
-        print('Saving file now...')
+    def write_pretrigger(self):
+        '''
+        Hands the audio in the pretrigger buffer to the writer, ahead of the
+        blocks of the recording bout. The buffer is not copied - it is held
+        until the writer has written it, and then starts filling up again.
+        '''
+        if self.pretrigger_durn <= 0:
+            return
+        for chunk in self.pretrigger.chunks():
+            self.writer.write(chunk)
+        self.writer.release(self.pretrigger.hold())
+        self.pretrigger.clear()
+
+    def make_bout_buffer(self):
+        '''
+        Allocates the bout_buffer which holds the save channels of one
+        recording bout (with two blocks to spare).
+        '''
+        blocksize = self.blocksize
+        bout_numblocks = int(np.ceil(self.rec_bout*self.fs/float(blocksize)))
+        self.bout = bout_buffer((bout_numblocks+2)*blocksize, self.input_output_chs[0],
+                                channels=self.save_channels)
 
-        self.rec = np.concatenate(self.q_contents)
+    def start_bout(self):
+        '''
+        Opens a new file for the recording bout and writes the pretrigger audio into it.
+        '''
+        self.bout_filename = self.make_filename()
+        self.writer.open_file(self.bout_filename)
+        pretrigger_frames = self.pretrigger.num_filled if self.pretrigger_durn > 0 else 0
+        self.bout_file_frames = pretrigger_frames + self.bout_frames
+        self.bout_start_frame = self.block_start_frame - pretrigger_frames
+        if self.drift_tracker is not None:
+            self.drift_tracker.start_file(self.bout_start_frame)
+        self.write_pretrigger()
+        self.bout_in_buffer = self.bout.start()
+        if not self.bout_in_buffer:
+            print('Previous bout still being written, copying blocks of this bout')
+
+    def store_bout_block(self, block):
+        '''
+        Copies the save channels of a block into the bout buffer and hands
+        the copied slice on to the writer.
 
-        self.rec2besaved = self.rec[:,self.save_channels]
+        Inputs:
+            block : blocksize x Nchannels np.array. All input channels of one block.
+        '''
+        if self.bout_in_buffer:
+            self.writer.write(self.bout.put(block))
+        else:
+            # selecting the save channels makes a copy of the block
+            self.writer.write(block[:,self.save_channels])
 
+    def end_bout(self):
+        '''
+        Closes the file of the recording bout and saves its sync log, named after
+        the recording the writer saved (see disk_writer). The last bout is kept
+        in self.rec until the next bout starts.
+        '''
+        recording_name = self.writer.recording_name
+        self.writer.close_file()
+        write_sync_log(recording_name,
+                       make_sync_log(self.fs, self.bout_start_frame, self.bout_file_frames,
+                                     self.blocksize, self.scheduler, self.drift_tracker))
+        if self.bout_in_buffer:
+            self.writer.release(self.bout.hold())
+            self.rec = self.bout.recording()
+        print('Writer queue depth: '+str(self.writer.queue_depth())+' blocks')
+        self.reset_bandpass()
+
+    def make_filename(self):
+        '''
+        Creates a file name that begins with MULTIWAV_YYYY-MM-DD_hh-mm-ss_UNIXTIME
+        '''
         timenow = dt.datetime.now()
         self.timestamp = timenow.strftime('%Y-%m-%d_%H-%M-%S')
         self.idnumber =  int(time.mktime(timenow.timetuple())) #the unix time which provides a 10 digit unique identifier
 
         main_filename = 'MULTIWAV_' + self.timestamp+'_'+str(self.idnumber) +'.WAV'
-
-        try:
-            print('trying to save file... ')
-
-            soundfile.write(main_filename,self.rec2besaved,self.fs)
-
-            print('File saved')
-
-            pass
-
-        except:
-            raise IOError('Could not save file !!')
-
-
-        pass
-
-
+        return(main_filename)
 
     def get_device_indexnumber(self,device_name):
         '''
@@ -410,7 +856,7 @@ class fieldrecorder_trigger():
            ' devices on this computer')
 
         else:
-            self.tgt_ind = int(np.argmax(3np.array(self.tgt_dev_bool)))
+            self.tgt_ind = int(np.argmax(np.array(self.tgt_dev_bool)))
 
 
 
@@ -2,25 +2,179 @@
 """
 Created on Fri Dec 15 14:53:59 2017
 
+Counts the camera frames in each MULTIWAV file of a folder from the rising
+edges of the recorded sync signal.
+
+The files are read block by block, so that only one block of the recording is
+in memory at a time, and the folder is processed in parallel processes. The
+intervals between rising edges are also checked against the camera frame rate
+to report dropped or extra frames.
+
+Usage : python peak_counting.py <folder> --sync-channel 7 --fps 25
+
 @author: tbeleyur
 """
+import argparse
+import concurrent.futures
 import glob
+import os
 import numpy as np
-import peakutils as pk
-import scipy.io.wavfile as WAV
-import matplotlib.pyplot as plt
-plt.rcParams['agg.path.chunksize'] = 100000
+import soundfile
+
+
+class rising_edge_counter():
+
+    def __init__(self, fs, fps=25, threshold=None, min_sync_level=0.05):
+        '''
+        Counts rising edges across consecutive blocks of a sync signal.
+
+        Inputs:
+            fs : integer. sampling rate in Hertz.
+            fps : float. frame rate of the sync signal in Hertz. Defaults to 25.
+            threshold : float or None. level the signal has to cross to count
+                        as a rising edge. Defaults to None, which uses half of
+                        the maximum of the first block with the sync signal.
+            min_sync_level : float. Maximum a block needs for the sync signal to
+                             count as present, when there is no threshold. Blocks
+                             before it, eg. silence or noise at the start of a
+                             file, are not searched for edges. Defaults to 0.05,
+                             a fifth of the 0.25 amplitude the recorders play the
+                             sync signal with.
+        '''
+        self.fs = fs
+        self.period = fs/float(fps)
+        self.threshold = threshold
+        self.min_sync_level = min_sync_level
+
+        self.previous_above = True # the first sample is never an edge
+        self.last_edge = None
+        self.samples_processed = 0
+
+        self.num_edges = 0
+        self.dropped_frames = 0
+        self.extra_frames = 0
+
+    def count(self, sync_block):
+        '''
+        Inputs:
+            sync_block : 1D np.array. the next block of the sync signal.
+        '''
+        if self.threshold is None:
+            block_max = np.max(sync_block)
+            if block_max < self.min_sync_level:
+                self.samples_processed += sync_block.size
+                return
+            self.threshold = 0.5*block_max
+
+        above = np.empty(sync_block.size+1, dtype=bool)
+        above[0] = self.previous_above
+        np.greater_equal(sync_block, self.threshold, out=above[1:])
+        edges = np.flatnonzero(above[1:] & ~above[:-1]) + self.samples_processed
+
+        self.check_edges(edges)
+        self.previous_above = above[-1]
+        self.samples_processed += sync_block.size
+
+    def check_edges(self, edges):
+        '''
+        An interval of about N periods since the last rising edge means N-1 frames
+        were dropped. An edge less than half a period after the last edge is
+        counted as an extra frame and otherwise ignored. There are only a few
+        edges per block, so this loop is cheap compared to the edge detection.
+        '''
+        for each_edge in edges:
+            if self.last_edge is None:
+                self.last_edge = each_edge
+                self.num_edges += 1
+                continue
+
+            periods = int(round((each_edge - self.last_edge)/self.period))
+            if periods < 1:
+                self.extra_frames += 1
+                continue
+            self.dropped_frames += periods - 1
+            self.last_edge = each_edge
+            self.num_edges += 1
+
+def count_frames(fileaddress, sync_channel=7, fps=25, **kwargs):
+    '''
+    Counts the camera frames in one file from the rising edges of its sync channel.
+
+    Inputs:
+        fileaddress : string. path to the wav file
+        sync_channel : integer. index of the sync channel. Defaults to 7.
+        fps : float. frame rate of the cameras in Hertz. Defaults to 25.
+
+    **kwargs:
+        blocksize : integer. number of samples read at a time. Defaults to 2**18.
+        threshold, min_sync_level : float or None. see rising_edge_counter.
+
+    Returns:
+        frame_info : dictionary with the 'file_name', 'num_frames' counted
+                     (without the extra frames),
+                     'expected_numframes' from the file duration and the
+                     'dropped_frames' and 'extra_frames' found from the intervals
+                     between rising edges.
+    '''
+    fs = soundfile.info(fileaddress).samplerate
+    counter = rising_edge_counter(fs, fps, kwargs.get('threshold', None),
+                                  kwargs.get('min_sync_level', 0.05))
+
+    for block in soundfile.blocks(fileaddress, blocksize=kwargs.get('blocksize', 2**18),
+                                  dtype='float32', always_2d=True):
+        counter.count(block[:,sync_channel])
+
+    frame_info = {'file_name':fileaddress,
+                  'num_frames':counter.num_edges,
+                  'expected_numframes':int(counter.samples_processed/counter.period),
+                  'dropped_frames':counter.dropped_frames,
+                  'extra_frames':counter.extra_frames}
+    return(frame_info)
+
+def count_frames_in_folder(folder, num_workers=None, **kwargs):
+    '''
+    Counts the camera frames of all the MULTIWAV_*.WAV files in a folder in parallel
+    processes. Files that cannot be counted, eg. with too few channels for the
+    sync channel, are reported and left out.
+
+    Inputs:
+        folder : string.
+        num_workers : integer or None. number of parallel processes. Defaults to
+                      None, which uses as many processes as there are CPUs.
+        **kwargs : see count_frames
 
-folder = 'C://Users//tbeleyur//Desktop//test//'
+    Returns:
+        all_frame_info : list with one frame_info dictionary per counted file,
+                         sorted by file name.
+    '''
+    files_in_folder = sorted(set(glob.glob(os.path.join(folder, 'MULTIWAV_*.WAV')) +
+                                 glob.glob(os.path.join(folder, 'MULTIWAV_*.wav'))))
 
-files_in_folder = glob.glob(folder+'*.WAV')
+    all_frame_info = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        jobs = [ executor.submit(count_frames, each, **kwargs) for each in files_in_folder]
+        for each_file, each_job in zip(files_in_folder, jobs):
+            try:
+                all_frame_info.append(each_job.result())
+            except Exception as error:
+                print('FAILED to count the frames of '+each_file+': '+repr(error))
 
-for each_wav in files_in_folder:
-    fs, rec = WAV.read(each_wav)
+    return(all_frame_info)
 
-    normaliseint16 = lambda X : X/(2**15-1.0)
 
-    sync_ch = normaliseint16(rec[:,7])
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count the camera frames in all '
+                                     'MULTIWAV_*.WAV files of a folder from their sync channel')
+    parser.add_argument('folder')
+    parser.add_argument('--sync-channel', type=int, default=7)
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of parallel processes. Defaults to the number of CPUs')
+    args = parser.parse_args()
 
-    pks = pk.indexes(sync_ch,thres=0.8,min_dist =7000)
-    print(each_wav, pks.size)
\ No newline at end of file
+    for frame_info in count_frames_in_folder(args.folder, num_workers=args.workers,
+                                             sync_channel=args.sync_channel, fps=args.fps):
+        print(frame_info['file_name'], frame_info['num_frames'],
+              'expected: '+str(frame_info['expected_numframes']),
+              'dropped: '+str(frame_info['dropped_frames']),
+              'extra: '+str(frame_info['extra_frames']))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+A callback based, non-blocking audio engine for the fieldrecorder modules.
+
+The blocking sd.Stream.read/write approach stalls the whole input/output
+stream whenever the Python loop takes longer than one block (filtering, saving
+files, printing...). Here the PortAudio callback instead only:
+
+    1. copies the scheduled output frames into the output buffer
+       (see fieldrecorder.output_scheduler)
+    2. copies the input block into a preallocated block_ringbuffer
+
+All the actual work (trigger detection, saving etc.) is done by worker threads
+which each read the ring buffer at their own pace.
+
+Usage :
+
+    output_blocks = {'only_sync':only_sync, 'trig_and_sync':trig_and_sync}
+    engine = callback_engine(output_blocks, fs=192000, input_output_chs=(24,5))
+    engine.add_worker(some_function) # some_function(data, overflowed)
+    engine.start()
+    ...
+    engine.play('trig_and_sync', num_frames) # exactly num_frames long
+    ...
+    engine.stop()
+
+"""
+import threading
+import time
+import numpy as np
+import sounddevice as sd
+from audio_buffers import block_ringbuffer
+from fieldrecorder.output_scheduler import output_scheduler
+
+
+class callback_engine():
+
+    def __init__(self, output_blocks, fs=192000, input_output_chs=(2,2),
+                 device=None, **kwargs):
+        '''
+        Inputs:
+            output_blocks : dictionary. keys are mode names (eg. 'only_sync')
+                            and entries are one cycle x Noutputchannels np.arrays.
+                            All entries must have the same shape.
+            fs : integer. sampling rate in Hertz.
+            input_output_chs : tuple with integers. Number of input and output channels.
+            device : integer or None. sounddevice index of the soundcard.
+
+        **kwargs:
+            blocksize : integer. Frames per callback. Defaults to the length of
+                        the output blocks.
+            start_mode : string. Output block played when the stream starts.
+                         Defaults to 'only_sync'.
+            ringbuffer_durn : float. Seconds of input audio the ring buffer holds
+                              before unread blocks are overwritten. Defaults to 5 s.
+            poll_interval : float. Seconds a worker sleeps when there is no
+                            new block. Defaults to a quarter of a block.
+            stream_backend : callable. Called with the sd.Stream arguments to make
+                             the stream, eg. fieldrecorder.replay_stream.replay_backend.
+                             Defaults to sd.Stream.
+        '''
+        self.fs = fs
+        self.input_output_chs = input_output_chs
+        self.device = device
+
+        block_shapes = set([ each.shape for each in output_blocks.values()])
+        if len(block_shapes) > 1:
+            raise ValueError('All output blocks must have the same shape, got: '+
+                             str(block_shapes))
+
+        self.output_blocks = output_blocks
+        self.blocksize = kwargs.get('blocksize', None)
+        if self.blocksize is None:
+            self.blocksize = list(block_shapes)[0][0]
+        self.scheduler = output_scheduler(output_blocks, self.fs,
+                                          kwargs.get('start_mode', 'only_sync'),
+                                          max_blocksize=self.blocksize)
+
+        ringbuffer_durn = kwargs.get('ringbuffer_durn', 5.0)
+        num_slots = max(int(np.ceil(ringbuffer_durn*self.fs/self.blocksize)), 2)
+        self.ringbuffer = block_ringbuffer(num_slots, self.blocksize,
+                                           self.input_output_chs[0])
+
+        self.poll_interval = kwargs.get('poll_interval',
+                                        0.25*self.blocksize/float(self.fs))
+
+        self.stream_backend = kwargs.get('stream_backend', None)
+        if self.stream_backend is None:
+            self.stream_backend = sd.Stream
+
+        self.input_overflows = 0
+        self.output_underflows = 0
+
+        self.workers = []
+        self.stop_workers = threading.Event()
+
+    def set_mode(self, mode):
+        '''
+        Switches the output that is played whenever nothing else is scheduled.
+        '''
+        if mode not in self.output_blocks:
+            raise ValueError('Unknown output mode: ' + str(mode))
+        self.scheduler.default_mode = mode
+
+    def play(self, mode, num_frames):
+        '''
+        Plays the given mode for exactly num_frames frames, after everything
+        already scheduled. See output_scheduler.play.
+        '''
+        return(self.scheduler.play(mode, num_frames))
+
+    def play_once(self, mode):
+        '''
+        Plays one cycle of the given mode from the next cycle boundary, after
+        which the engine returns to the current mode.
+        '''
+        return(self.scheduler.play_once(mode))
+
+    def audio_callback(self, indata, outdata, frames, time_info, status):
+        '''
+        PortAudio callback. Only copies data, all processing happens in the
+        worker threads.
+        '''
+        if status:
+            self.input_overflows += status.input_overflow
+            self.output_underflows += status.output_underflow
+
+        self.scheduler.next_block(frames, out=outdata)
+
+        self.ringbuffer.put(indata, status.input_overflow)
+
+    def add_worker(self, function, name=None):
+        '''
+        Adds a worker thread which calls function(data, overflowed) for every
+        input block, in the order the blocks were recorded.
+
+        Workers must be added before the engine is started.
+
+        Returns:
+            reader : the ringbuffer_reader the worker reads through. Its
+                     dropped_blocks attribute counts blocks the worker missed
+                     because it fell too far behind.
+        '''
+        reader = self.ringbuffer.new_reader()
+        worker = threading.Thread(target=self._run_worker,
+                                  args=(function, reader), name=name)
+        worker.daemon = True
+        self.workers.append((worker, reader))
+        return(reader)
+
+    def _run_worker(self, function, reader):
+        while True:
+            data, overflowed = reader.read()
+            if data is None:
+                if self.stop_workers.is_set():
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                function(data, overflowed)
+
+    def start(self):
+        self.S = self.stream_backend(samplerate=self.fs, blocksize=self.blocksize,
+                                     channels=self.input_output_chs, device=self.device,
+                                     dtype='float32', callback=self.audio_callback)
+        self.stop_workers.clear()
+        for worker, reader in self.workers:
+            worker.start()
+        self.S.start()
+
+    def stop(self):
+        '''
+        Stops the stream and waits for the workers to process all remaining
+        blocks.
+        '''
+        self.S.stop()
+        self.S.close()
+        self.stop_workers.set()
+        for worker, reader in self.workers:
+            worker.join()
+
+    @property
+    def active(self):
+        return(self.S.active)
+
+    @property
+    def blocks_recorded(self):
+        return(self.ringbuffer.write_count)
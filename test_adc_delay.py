@@ -5,6 +5,8 @@ Created on Tue Nov 21 11:34:59 2017
 @author: tbeleyur
 """
 from os import path
+import shutil
+import tempfile
 import unittest
 from scipy import signal
 import numpy as np
@@ -71,6 +73,29 @@ class TestADC_delay(unittest.TestCase):
         pass
 
 
+    def test_delayestimation_subsample_and_batched(self):
+        '''
+        fractional delays are recovered with parabolic interpolation, and
+        many channel pairs can be estimated in one call
+        '''
+        x = signal.lfilter(signal.firwin(101, 0.5), 1, np.random.normal(0,1,20000))
+        freqs = np.fft.rfftfreq(x.size)
+
+        known_delays = [-5.7, 0.0, 2.3, 40.0]
+        delayed = [ np.fft.irfft(np.fft.rfft(x)*np.exp(-2j*np.pi*freqs*each), x.size)
+                                                       for each in known_delays]
+        chBs = np.column_stack(delayed)
+
+        subsample_delays = estimate_delays(chBs, x.reshape(-1,1),
+                                           interpolation='parabolic')
+        np.testing.assert_allclose(subsample_delays, known_delays, atol=0.1)
+
+        whole_delays = estimate_delays(chBs, np.column_stack([x]*4))
+        np.testing.assert_array_equal(whole_delays, np.round(known_delays))
+
+        phat_delay = estimate_delay(np.roll(x,7), x, weighting='phat')
+        self.assertEqual(phat_delay, 7)
+
     def test_detect_firstrisingedge(self):
 
         print('test_detect_firstrisingedge \n')
@@ -109,6 +134,27 @@ class TestADC_delay(unittest.TestCase):
 
         pass
 
+    def test_detect_firstrisingedge_searchwindow(self):
+        '''
+        searching only the start of the recording must give the same rising edge
+        as searching the whole recording - also when the sync signal starts
+        after the first search window
+        '''
+        print('test_detect_firstrisingedge_searchwindow \n')
+        fs = 192000
+        template = create_default_template(25, fs)
+
+        for samples_silence in [1000, 20*template.size + 123]:
+            test_signal = np.concatenate((np.zeros(samples_silence),
+                                          np.tile(template, 40)))
+            test_signal += np.random.normal(0, 0.01, test_signal.size)
+
+            whole_recording = detect_first_rising_edge(test_signal, fs, search_periods=None)
+            search_window = detect_first_rising_edge(test_signal, fs)
+
+            self.assertEqual(whole_recording, search_window)
+            self.assertEqual(search_window, template.size/2 + samples_silence)
+
     def test_alignchannels(self):
 
         print('test_alignchannels \n')
@@ -131,6 +177,33 @@ class TestADC_delay(unittest.TestCase):
 
         pass
 
+    def test_alignchannels_float32_views(self):
+
+        print('test_alignchannels_float32_views \n')
+        ch2device = {'1':range(8),'2':range(8,16)}
+        cutpoints = {'1':self.pbk_delay,'2':self.pbk_delay+self.adc_delay}
+
+        # float32 output without losing precision
+        timealigned_rec = align_channels(self.multich_rec,ch2device,cutpoints)
+        self.assertEqual(timealigned_rec.dtype, np.float32)
+        np.testing.assert_array_equal(timealigned_rec[:,0],
+                                      np.float32(self.multich_rec[self.pbk_delay:self.pbk_delay+timealigned_rec.shape[0],0]))
+
+        # filling a preallocated array
+        out = np.zeros(timealigned_rec.shape, dtype=np.float32)
+        filled = align_channels(self.multich_rec,ch2device,cutpoints,out=out)
+        self.assertTrue(filled is out)
+        np.testing.assert_array_equal(out, timealigned_rec)
+
+        # views when there is no delay between devices
+        rec32 = np.float32(self.multich_rec)
+        no_delay = align_channels(rec32,ch2device,{'1':100,'2':100})
+        self.assertTrue(np.shares_memory(no_delay, rec32))
+
+        views = align_channels_views(rec32,ch2device,cutpoints)
+        self.assertTrue(np.shares_memory(views['2'], rec32))
+        np.testing.assert_array_equal(views['1'][:,7], views['2'][:,7])
+
     def test_timealign_channels(self):
         '''
         check how all of the functions behave together and see if it throws any
@@ -216,6 +289,91 @@ class TestADC_delay(unittest.TestCase):
 
         self.assertTrue(np.all(same_arrays))
 
+    def test_timealign_and_save_inchunks(self):
+        '''
+        the chunk-wise alignment of a wav file on disk must give the same
+        channels as timealign_channels on the whole recording in memory
+        '''
+        print('\n test_timealign_and_save_inchunks')
+        fs = 192000
+        multich_rec = np.int16(np.clip(self.multich_rec, -1, 1)*(2**15-1))
+
+        temp_folder = tempfile.mkdtemp()
+        wav_address = path.join(temp_folder, 'MULTIWAV_test.WAV')
+        scipy.io.wavfile.write(wav_address, fs, multich_rec)
+
+        ch2devs = {'1':range(8),'2':range(8,16)}
+        sync2devs = {'1':7,'2':15}
+
+        saved_files = timealign_and_save_inchunks(wav_address, ch2devs, sync2devs,
+                                                  file_start=path.join(temp_folder,'Mic'),
+                                                  file_timestamp='test', chunk_durn=0.3)
+
+        fs, rec = read_wavfile(wav_address)
+        ta_channels = timealign_channels(rec, fs, ch2devs, sync2devs)
+
+        self.assertEqual(len(saved_files), ta_channels.shape[1])
+        for column, each_file in enumerate(saved_files):
+            fs, single_channel = read_wavfile(each_file)
+            np.testing.assert_allclose(single_channel, ta_channels[:,column], atol=10**-6)
+
+        shutil.rmtree(temp_folder)
+
+    def test_timealign_and_save_multichannel(self):
+        '''
+        all aligned channels saved into one RF64 file must be readable channel
+        by channel and match timealign_channels
+        '''
+        print('\n test_timealign_and_save_multichannel')
+        fs = 192000
+        multich_rec = np.int16(np.clip(self.multich_rec, -1, 1)*(2**15-1))
+
+        temp_folder = tempfile.mkdtemp()
+        wav_address = path.join(temp_folder, 'MULTIWAV_test.WAV')
+        scipy.io.wavfile.write(wav_address, fs, multich_rec)
+
+        ch2devs = {'1':range(8),'2':range(8,16)}
+        sync2devs = {'1':7,'2':15}
+
+        saved_files = timealign_and_save_inchunks(wav_address, ch2devs, sync2devs,
+                                                  file_start=path.join(temp_folder,'Mic'),
+                                                  file_timestamp='test', chunk_durn=0.3,
+                                                  multichannel=True)
+        self.assertEqual(saved_files, [path.join(temp_folder, 'MicALL_test.WAV')])
+
+        fs, rec = read_wavfile(wav_address)
+        ta_channels = timealign_channels(rec, fs, ch2devs, sync2devs)
+
+        metadata = read_channel_metadata(saved_files[0])
+        self.assertEqual(len(metadata['channels']), ta_channels.shape[1])
+        self.assertEqual(metadata['channels'][7]['device'], '2')
+
+        for column in range(ta_channels.shape[1]):
+            one_channel = read_channel(saved_files[0], column)
+            np.testing.assert_allclose(one_channel, ta_channels[:,column], atol=10**-6)
+
+        np.testing.assert_allclose(read_channel(saved_files[0], 'Mic03', 100, 200),
+                                   ta_channels[100:200,3], atol=10**-6)
+        shutil.rmtree(temp_folder)
+
+    def test_read_channel_flac(self):
+        '''
+        numpy integer channels and a stop beyond the end of a FLAC file must
+        behave as for a WAV file
+        '''
+        print('\n test_read_channel_flac')
+        rec = np.int16(np.clip(self.multich_rec[:5000,:4], -1, 1)*(2**15-1))
+
+        temp_folder = tempfile.mkdtemp()
+        flac_address = path.join(temp_folder, 'MULTIWAV_test.flac')
+        soundfile.write(flac_address, rec, 192000, subtype='PCM_16')
+
+        one_channel = read_channel(flac_address, np.int64(2), 4000, 6000)
+        self.assertEqual(one_channel.size, 1000)
+        np.testing.assert_allclose(one_channel, normalise_samples(rec[4000:,2]),
+                                   atol=10**-4)
+        shutil.rmtree(temp_folder)
+
     def test_checkforoverlaps_list(self):
 
         print('\n test_checkforoverlaps_list')
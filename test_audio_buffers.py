@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the preallocated buffers in audio_buffers
+"""
+import unittest
+import numpy as np
+from audio_buffers import *
+
+
+class TestBlockRingbuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.blocksize = 64
+        self.nchannels = 4
+        self.ring = block_ringbuffer(8, self.blocksize, self.nchannels)
+
+    def make_block(self, value):
+        return(np.ones((self.blocksize, self.nchannels), dtype='float32')*value)
+
+    def test_blocks_read_in_order(self):
+        reader = self.ring.new_reader()
+        for i in range(5):
+            self.ring.put(self.make_block(i), overflowed= i==3)
+
+        for i in range(5):
+            data, overflowed = reader.read()
+            self.assertTrue(np.all(data == i))
+            self.assertEqual(overflowed, i==3)
+
+        data, overflowed = reader.read()
+        self.assertTrue(data is None)
+
+    def test_readers_are_independent(self):
+        reader1 = self.ring.new_reader()
+        reader2 = self.ring.new_reader()
+        for i in range(3):
+            self.ring.put(self.make_block(i))
+
+        reader1.read()
+        reader1.read()
+        self.assertEqual(reader1.blocks_available(), 1)
+        self.assertEqual(reader2.blocks_available(), 3)
+
+    def test_lapped_reader_counts_dropped_blocks(self):
+        reader = self.ring.new_reader()
+        for i in range(20):
+            self.ring.put(self.make_block(i))
+
+        data, overflowed = reader.read()
+        # 20 blocks written into 8 slots, the reader keeps one slot of
+        # distance to the writer, so 13 blocks are lost
+        self.assertEqual(reader.dropped_blocks, 13)
+        self.assertTrue(np.all(data == 13))
+
+    def test_short_block(self):
+        reader = self.ring.new_reader()
+        self.ring.put(self.make_block(1)[:10,:])
+        data, overflowed = reader.read()
+        self.assertEqual(data.shape, (10, self.nchannels))
+
+
+class TestPretriggerBuffer(unittest.TestCase):
+
+    def test_chunks_in_order_after_wrapping(self):
+        pretrigger = pretrigger_buffer(250, 3)
+        rec = np.float32(np.arange(1000*3).reshape(-1,3))
+        for block in np.split(rec, 10):
+            pretrigger.put(block)
+
+        buffered = np.concatenate(pretrigger.chunks())
+        np.testing.assert_array_equal(buffered, rec[-250:])
+
+    def test_not_filled(self):
+        pretrigger = pretrigger_buffer(250, 3)
+        rec = np.float32(np.arange(150*3).reshape(-1,3))
+        pretrigger.put(rec[:100])
+        pretrigger.put(rec[100:])
+        np.testing.assert_array_equal(np.concatenate(pretrigger.chunks()), rec)
+
+    def test_channel_selection(self):
+        pretrigger = pretrigger_buffer(50, 4, channels=[0,2])
+        rec = np.float32(np.random.normal(0,1,(80,4)))
+        pretrigger.put(rec)
+        np.testing.assert_array_equal(np.concatenate(pretrigger.chunks()), rec[-50:,[0,2]])
+
+    def test_held_buffer_is_not_overwritten(self):
+        pretrigger = pretrigger_buffer(50, 1)
+        pretrigger.put(np.ones((50,1)))
+        released = pretrigger.hold()
+        pretrigger.clear()
+        pretrigger.put(np.zeros((10,1)))
+
+        self.assertEqual(pretrigger.skipped_blocks, 1)
+        self.assertTrue(np.all(pretrigger.samples == 1))
+
+        released.set()
+        pretrigger.put(np.zeros((10,1)))
+        np.testing.assert_array_equal(np.concatenate(pretrigger.chunks()), np.zeros((10,1)))
+
+
+class TestBoutBuffer(unittest.TestCase):
+
+    def test_blocks_stored_in_order(self):
+        bout = bout_buffer(1000, 4, channels=[1,3])
+        rec = np.float32(np.random.normal(0,1,(700,4)))
+        self.assertTrue(bout.start())
+        for block in np.split(rec, 7):
+            stored = bout.put(block)
+            np.testing.assert_array_equal(stored, block[:,[1,3]])
+
+        np.testing.assert_array_equal(bout.recording(), rec[:,[1,3]])
+        self.assertEqual(bout.samples_lost, 0)
+
+    def test_full_buffer(self):
+        bout = bout_buffer(150, 1)
+        bout.start()
+        bout.put(np.ones((100,1)))
+        stored = bout.put(np.ones((100,1)))
+        self.assertEqual(stored.shape[0], 50)
+        self.assertEqual(bout.samples_lost, 50)
+
+    def test_held_bout_not_restarted(self):
+        bout = bout_buffer(150, 1)
+        bout.start()
+        bout.put(np.ones((100,1)))
+        released = bout.hold()
+        self.assertFalse(bout.start())
+        self.assertEqual(bout.recording().shape[0], 100)
+        released.set()
+        self.assertTrue(bout.start())
+        self.assertEqual(bout.recording().shape[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the background writers in disk_writer
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+import soundfile
+from disk_writer import *
+
+
+class TestSoundfileWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_folder, 'MULTIWAV_test.WAV')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def test_full_queue_does_not_block(self):
+        writer = soundfile_writer(48000, 2, max_queue_blocks=3)
+        block = np.zeros((100, 2), dtype=np.float32)
+        # a stalled disk, the writer thread is not started yet
+        def bout():
+            writer.open_file(self.filename)
+            for i in range(5):
+                writer.write(block)
+            writer.release(threading.Event())
+            writer.close_file()
+        acquisition = threading.Thread(target=bout)
+        acquisition.start()
+        acquisition.join(2)
+        self.assertFalse(acquisition.is_alive())
+        self.assertEqual(writer.dropped_blocks, 3)
+
+        writer.start()
+        writer.stop()
+        self.assertEqual(soundfile.info(self.filename).frames, 200)
+
+
+class TestCompressedWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_folder, 'MULTIWAV_test.WAV')
+        self.fs = 48000
+        self.rec = np.float32(np.random.normal(0, 0.05, (4800, 12)))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def test_channels_split_into_flac_files(self):
+        writer = compressed_writer(self.fs, 12, subtype='PCM_24')
+        writer.start()
+        writer.open_file(self.filename)
+        for block in np.split(self.rec, 10):
+            writer.write(block)
+        writer.stop()
+
+        flac_files = sorted(writer.files_written)
+        self.assertEqual([os.path.basename(each) for each in flac_files],
+                         ['MULTIWAV_test_ch00-07.flac', 'MULTIWAV_test_ch08-11.flac'])
+        saved = np.column_stack([soundfile.read(each)[0] for each in flac_files])
+        np.testing.assert_allclose(saved, self.rec, atol=2.0**-22)
+        self.assertTrue(writer.compression_ratio() > 1)
+        self.assertEqual(writer.fallbacks, 0)
+        self.assertEqual(os.path.basename(writer.recording_name), 'MULTIWAV_test.flac')
+
+    def test_fallback_to_raw(self):
+        writer = compressed_writer(self.fs, 12)
+        writer.start()
+        writer.open_file(self.filename)
+        blocks = np.split(self.rec, 10)
+        for block in blocks[:4]:
+            writer.write(block)
+        # what write does once the encoders are too far behind
+        writer.fall_back_to_raw()
+        for block in blocks[4:]:
+            writer.write(block)
+        writer.stop()
+
+        self.assertEqual(writer.fallbacks, 1)
+        self.assertEqual(writer.dropped_blocks, 0)
+        # the sync log belongs to the FLAC files, which start with the file
+        self.assertEqual(os.path.basename(writer.recording_name), 'MULTIWAV_test.flac')
+        raw_file = os.path.join(self.temp_folder, 'MULTIWAV_test_raw.WAV')
+        flac_files = sorted([ each for each in writer.files_written if each.endswith('.flac')])
+        compressed = np.column_stack([soundfile.read(each)[0] for each in flac_files])
+        raw = soundfile.read(raw_file)[0]
+        np.testing.assert_allclose(np.concatenate((compressed, raw)), self.rec,
+                                   atol=2.0**-15)
+
+    def test_release_after_all_writers(self):
+        writer = compressed_writer(self.fs, 12)
+        writer.start()
+        released = threading.Event()
+        writer.open_file(self.filename)
+        writer.write(self.rec)
+        writer.release(released)
+        self.assertTrue(released.wait(5))
+        writer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the header-only wav inventory in display_file_info
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import soundfile
+import display_file_info
+from display_file_info import *
+
+
+class TestWavInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for i, durn in enumerate([1.0, 2.5]):
+            soundfile.write(os.path.join(self.folder, 'MULTIWAV_%d.WAV'%i),
+                            np.zeros((int(durn*8000), 3)), 8000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_durations_from_headers(self):
+        file_data = wav_inventory(self.folder)
+        self.assertEqual(list(file_data['rec_durn']), [1.0, 2.5])
+        self.assertEqual(list(file_data['expected_numframes']), [25, 62])
+        self.assertEqual(list(file_data['num_channels']), [3, 3])
+
+    def test_cached_headers_not_reread(self):
+        wav_inventory(self.folder)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, index_filename)))
+
+        original_reader = display_file_info.read_wav_header
+        files_read = []
+        def counting_reader(fileaddress):
+            files_read.append(fileaddress)
+            return(original_reader(fileaddress))
+        display_file_info.read_wav_header = counting_reader
+        try:
+            wav_inventory(self.folder)
+            self.assertEqual(files_read, [])
+
+            # a changed file is read again
+            changed_file = os.path.join(self.folder, 'MULTIWAV_1.WAV')
+            soundfile.write(changed_file, np.zeros((4000, 3)), 8000)
+            file_data = wav_inventory(self.folder)
+        finally:
+            display_file_info.read_wav_header = original_reader
+
+        self.assertEqual(files_read, [changed_file])
+        self.assertEqual(list(file_data['rec_durn']), [1.0, 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
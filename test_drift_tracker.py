@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the online clock drift tracking
+"""
+import unittest
+import numpy as np
+from fieldrecorder.drift_tracker import *
+
+
+def make_sync(t, fps=25):
+    # a square wave with smooth edges, as recorded through the AD converters
+    return(np.float32(0.25*np.tanh(20*np.sin(2*np.pi*fps*t))))
+
+class TestClockDriftTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 48000
+        self.offset = 12.3 # frames device 2 lags behind device 1 at t=0
+        self.drift = 20*10**-6
+        t = np.arange(60*self.fs)/float(self.fs)
+        lag = self.offset/self.fs + self.drift*t
+        self.rec = np.column_stack((make_sync(t), make_sync(t - lag)))
+        self.tracker = clock_drift_tracker(self.fs, {'1':0,'2':1})
+
+    def true_offset(self, frame):
+        return(self.offset + self.drift*frame)
+
+    def run_tracker(self, blocksize=1000, file_start=None):
+        for start in range(0, self.rec.shape[0], blocksize):
+            self.tracker.update(self.rec[start:start+blocksize])
+            if file_start is not None and start >= file_start + blocksize:
+                self.tracker.start_file(file_start)
+                file_start = None
+
+    def test_offset_and_drift(self):
+        self.run_tracker()
+        self.assertAlmostEqual(self.tracker.drift_ppm('2'), 20, delta=0.2)
+        frame = 50*self.fs
+        self.assertAlmostEqual(self.tracker.offset('2', frame),
+                               self.true_offset(frame), delta=0.05)
+        self.assertEqual(self.tracker.unmatched_edges, 0)
+
+    def test_file_log(self):
+        file_start = 40*self.fs + 1234
+        self.run_tracker(file_start=file_start)
+        drift_log = self.tracker.file_log(10*self.fs)
+
+        # the first rising edge of device 1 at least half a period after the
+        # file start crosses the threshold, half of the maximum, a little after
+        # the zero crossing
+        threshold_delay = np.arcsin(np.arctanh(0.5)/20)/(2*np.pi*25)*self.fs
+        first_edge = int(np.ceil((file_start + 960)/1920.0))*1920 + threshold_delay
+        self.assertEqual(drift_log['cutpoints']['1'], int(round(first_edge)) - file_start)
+        self.assertEqual(drift_log['cutpoints']['2'],
+                         int(round(first_edge + self.true_offset(first_edge))) - file_start)
+        self.assertAlmostEqual(drift_log['offset_change']['2'], self.drift*10*self.fs,
+                               delta=0.05)
+
+    def test_file_columns(self):
+        tracker = clock_drift_tracker(self.fs, {'1':7,'2':19},
+                                      save_channels=[0,1,2,3,4,5,6,7,12,13,14,15,16,17,18,19])
+        tracker.update(np.zeros((100, 24)))
+        tracker.start_file(0)
+        drift_log = tracker.file_log(100)
+        self.assertEqual(drift_log['syncch2device'], {'1':7,'2':15})
+        self.assertEqual(drift_log['input_syncch2device'], {'1':7,'2':19})
+
+    def test_edges_missing_on_one_device(self):
+        self.rec[10*self.fs:11*self.fs, 1] = 0
+        self.run_tracker()
+        self.assertGreater(self.tracker.unmatched_edges, 0)
+        self.assertAlmostEqual(self.tracker.offset('2', 50*self.fs),
+                               self.true_offset(50*self.fs), delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
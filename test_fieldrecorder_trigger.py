@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of fieldrecorder_trigger, replaying a synthetic recording
+instead of using a soundcard.
+"""
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import soundfile
+import ADC_delay
+from fieldrecorder.replay_stream import replay_backend
+from fieldrecorder_trigger import fieldrecorder_trigger
+
+
+class TestTriggeredRecording(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 48000
+        self.folder = tempfile.mkdtemp()
+        self.rec = np.float32(np.random.normal(0, 0.001, (6*self.fs, 8)))
+        # one loud 5 kHz tone at 2 seconds on the monitored channel
+        t = np.arange(int(0.2*self.fs))/float(self.fs)
+        self.rec[2*self.fs:2*self.fs+t.size, 0] += 0.5*np.sin(2*np.pi*5000*t)
+        self.streams = []
+
+    def tearDown(self):
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        shutil.rmtree(self.folder)
+
+    def make_recorder(self, speed, **kwargs):
+        backend = replay_backend(self.rec, speed=speed, samplerate=self.fs,
+                                 keep_output=True)
+        def keep_stream(**kwargs):
+            self.streams.append(backend(**kwargs))
+            return(self.streams[-1])
+
+        recorder_kwargs = {'exclude_channels':[], 'monitor_channels':[0],
+                           'trigger_level':-30, 'rec_bout':1.0, 'pretrigger_durn':0.5}
+        recorder_kwargs.update(kwargs)
+        # None leaves out a keyword argument, eg. to use the default exclude_channels
+        recorder_kwargs = { key:value for key, value in recorder_kwargs.items()
+                                          if value is not None}
+        return(fieldrecorder_trigger(5.0, input_output_chs=(self.rec.shape[1],5),
+                                     target_dir=self.folder,
+                                     fs=self.fs, stream_backend=keep_stream, **recorder_kwargs))
+
+    def check_one_bout(self):
+        saved_files = glob.glob(os.path.join(self.folder, 'MULTIWAV_*.WAV'))
+        self.assertEqual(len(saved_files), 1)
+        # pretrigger and bout
+        self.assertEqual(soundfile.info(saved_files[0]).frames, int(1.5*self.fs))
+
+        output = self.streams[0].output_signal()
+        # the camera trigger is on for exactly one bout
+        self.assertEqual(np.count_nonzero(output[:,2]), self.fs)
+        self.assertEqual(len(glob.glob(os.path.join(self.folder, 'METRICS_*'))), 1)
+
+    def test_blocking_loop(self):
+        self.make_recorder(speed=None).thermoacousticpy()
+        self.check_one_bout()
+        self.assertEqual(self.streams[0].frames_written, 5*self.fs)
+
+    def test_band_energy_trigger(self):
+        # the 5 kHz tone is only in the second band
+        self.make_recorder(speed=None, trigger_mode='band_energy',
+                           bandpass_freqs=[(10000, 20000), (4000, 6000)]).thermoacousticpy()
+        self.check_one_bout()
+
+    def test_noise_floor_trigger(self):
+        # steady noise at -26 dB rms, which the fixed trigger_level would trigger on
+        self.rec[:,0] += np.float32(np.random.normal(0, 0.05, self.rec.shape[0]))
+        self.make_recorder(speed=None, trigger_level=-60, noise_floor_margin=12,
+                           min_trigger_blocks=2).thermoacousticpy()
+        self.check_one_bout()
+
+    def test_trigger_cascade(self):
+        recorder = self.make_recorder(speed=None, bandpass_freqs=(2000, 8000),
+                                      prescreen_level=-36)
+        recorder.thermoacousticpy()
+        self.check_one_bout()
+        stats = recorder.trigger_cascade.stats()
+        # the silence before the tone is never bandpassed
+        self.assertLess(stats['stage2_run_rate'], 0.5)
+        self.assertEqual(recorder.trigger_cascade.stage2_hits, 1)
+
+    def test_sync_log(self):
+        # the sync signal reaches the second AD converter 5 samples later
+        t = np.arange(self.rec.shape[0])/float(self.fs)
+        sync = np.float32(0.25*np.sign(np.sin(2*np.pi*25*t + np.pi)))
+        self.rec[:,6] = sync
+        self.rec[5:,7] = sync[:-5]
+        self.make_recorder(speed=None, syncch2device={'1':6,'2':7}).thermoacousticpy()
+
+        saved_file = glob.glob(os.path.join(self.folder, 'MULTIWAV_*.WAV'))[0]
+        with open(saved_file+'.sync.json') as sidecar:
+            sync_log = json.load(sidecar)
+        self.assertEqual(sync_log['cutpoints']['2'] - sync_log['cutpoints']['1'], 5)
+        # the file starts with the pretrigger audio, half a second before the tone
+        self.assertEqual(sync_log['file_start_frame'], int(1.5*self.fs))
+        saved_sync = soundfile.read(saved_file)[0][:,6]
+        self.assertLess(saved_sync[sync_log['cutpoints']['1']-1], 0)
+        self.assertGreater(saved_sync[sync_log['cutpoints']['1']], 0)
+
+        # the camera trigger is played for the bout after the pretrigger audio
+        trigger_events = [ event for event in sync_log['output_events']
+                                         if event[2] == 'trig_and_sync']
+        self.assertEqual(len(trigger_events), 1)
+        start, end, mode = trigger_events[0]
+        self.assertEqual(end - start, self.fs)
+        self.assertGreaterEqual(start, int(0.5*self.fs))
+
+    def test_sync_log_default_exclude_channels(self):
+        # the two Fireface UCs, recording the sync signal on inputs 7 and 19
+        self.rec = np.column_stack((self.rec, self.rec, self.rec))
+        t = np.arange(self.rec.shape[0])/float(self.fs)
+        sync = np.float32(0.25*np.sign(np.sin(2*np.pi*25*t + np.pi)))
+        self.rec[:,7] = sync
+        self.rec[5:,19] = sync[:-5]
+        self.make_recorder(speed=None, exclude_channels=None,
+                           syncch2device={'1':7,'2':19}).thermoacousticpy()
+
+        saved_file = glob.glob(os.path.join(self.folder, 'MULTIWAV_*.WAV'))[0]
+        self.assertEqual(soundfile.info(saved_file).channels, 16)
+        sync_log = ADC_delay.read_sync_log(saved_file)
+        self.assertEqual(sync_log['input_syncch2device'], {'1':7,'2':19})
+        # the sync channels as ADC_delay reads them from the saved file
+        cutpoints = ADC_delay.cutpoints_from_sync_log(sync_log, {'1':7,'2':15})
+        self.assertEqual(cutpoints['2'] - cutpoints['1'], 5)
+
+    def test_flac_recording_is_aligned(self):
+        self.rec = np.column_stack((self.rec, self.rec, self.rec))
+        t = np.arange(self.rec.shape[0])/float(self.fs)
+        sync = np.float32(0.25*np.sign(np.sin(2*np.pi*25*t + np.pi)))
+        self.rec[:,7] = sync
+        self.rec[5:,19] = sync[:-5]
+        # paced, so that the encoders keep up and do not fall back to a raw file
+        self.make_recorder(speed=10.0, exclude_channels=None, compression='FLAC',
+                           syncch2device={'1':7,'2':19}).thermoacousticpy()
+
+        flac_files = sorted(glob.glob(os.path.join(self.folder, 'MULTIWAV_*.flac')))
+        self.assertEqual([ each[-13:] for each in flac_files],
+                         ['_ch00-07.flac', '_ch08-15.flac'])
+        recording = ADC_delay.find_multiwav_files(self.folder)
+        self.assertEqual(len(recording), 1)
+        self.assertTrue(os.path.exists(recording[0]+'.sync.json'))
+
+        output_dir = os.path.join(self.folder, 'aligned')
+        throughput = ADC_delay.batch_timealign_folder(self.folder, output_dir,
+                                          num_workers=1,
+                                          channels2devices={'1':range(8),'2':range(8,16)},
+                                          syncch2device={'1':7,'2':15})
+        self.assertEqual(throughput['num_files'], 1)
+        aligned_files = sorted(glob.glob(os.path.join(output_dir, 'Mic*.WAV')))
+        self.assertEqual(len(aligned_files), 14)
+        channel_0 = soundfile.read(aligned_files[0])[0]
+        cutpoints = ADC_delay.read_sync_log(recording[0])['cutpoints']
+        self.assertEqual(channel_0.size, int(1.5*self.fs) - cutpoints['2'])
+
+    def test_callback_loop(self):
+        recorder = self.make_recorder(speed=10.0)
+        recorder.thermoacousticpy_callback()
+        self.assertEqual(recorder.trigger_reader.dropped_blocks, 0)
+        self.check_one_bout()
+
+
+if __name__ == '__main__':
+    unittest.main()
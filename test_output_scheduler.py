@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the sample-accurate output_scheduler
+"""
+import threading
+import unittest
+import numpy as np
+from fieldrecorder.output_scheduler import *
+
+
+class TestOutputScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.cycle = 100
+        ramp = np.arange(self.cycle, dtype=np.float32).reshape(-1,1)
+        self.output_blocks = {'only_sync':np.column_stack((ramp, 0*ramp)),
+                              'trig_and_sync':np.column_stack((ramp, 0*ramp+1)),
+                              'sync_and_FFC':np.column_stack((ramp, 0*ramp+2))}
+        self.scheduler = output_scheduler(self.output_blocks, fs=1000)
+
+    def play_blocks(self, num_blocks, blocksize):
+        return(np.concatenate([ self.scheduler.next_block(blocksize)
+                                                for i in range(num_blocks)]))
+
+    def test_bout_switches_mid_block(self):
+        self.scheduler.next_block(30)
+        start, end = self.scheduler.play('trig_and_sync', 245)
+        self.assertEqual((start, end), (30, 275))
+
+        output = self.play_blocks(10, 64)
+        mode = output[:,1]
+        self.assertEqual(np.sum(mode==1), 245)
+        np.testing.assert_array_equal(np.flatnonzero(mode==1)[[0,-1]]+30, [30, 274])
+        # the sync signal continues across all switches
+        np.testing.assert_array_equal(output[:,0], np.arange(30, 30+640) % self.cycle)
+        self.assertTrue(self.scheduler.idle())
+
+    def test_play_once_on_cycle_boundary(self):
+        self.scheduler.next_block(30)
+        start, end = self.scheduler.play_once('sync_and_FFC')
+        self.assertEqual((start, end), (100, 200))
+        output = self.play_blocks(4, 64)
+        np.testing.assert_array_equal(np.flatnonzero(output[:,1]==2)[[0,-1]]+30, [100, 199])
+
+    def test_fills_given_output(self):
+        out = np.zeros((250, 2), dtype=np.float32)
+        self.scheduler.play('trig_and_sync', 120)
+        self.scheduler.next_block(250, out=out)
+        self.assertEqual(np.sum(out[:,1]==1), 120)
+        self.assertEqual(self.scheduler.time(), 0.25)
+
+    def test_long_blocks_match_short_blocks(self):
+        long_blocks = output_scheduler(self.output_blocks, fs=1000, max_blocksize=1000)
+        for each in [self.scheduler, long_blocks]:
+            each.next_block(30)
+            each.play('trig_and_sync', 1245)
+            each.play_once('sync_and_FFC')
+        short_output = self.play_blocks(40, 100)
+        long_output = np.concatenate([ long_blocks.next_block(1000) for i in range(4)])
+        np.testing.assert_array_equal(short_output, long_output)
+
+    def test_play_from_another_thread(self):
+        # next_block runs in the PortAudio callback, play in the trigger worker
+        output = []
+        stop = threading.Event()
+        def callback_thread():
+            while not stop.is_set():
+                output.append(self.scheduler.next_block(37))
+        player = threading.Thread(target=callback_thread)
+        player.start()
+        segments = []
+        for i in range(2000):
+            if self.scheduler.idle():
+                segments.append(self.scheduler.play('trig_and_sync', 50+i%7))
+        while not self.scheduler.idle():
+            pass
+        stop.set()
+        player.join()
+
+        mode = np.concatenate(output)[:,1]
+        expected = np.zeros(mode.size)
+        for start, end in segments:
+            expected[start:end] = 1
+        np.testing.assert_array_equal(mode, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the block-wise frame counting in peak_counting
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import scipy.signal as signal
+import soundfile
+from peak_counting import *
+
+
+class TestFrameCounting(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 48000
+        t = np.arange(int(self.fs*4.02))/float(self.fs)
+        self.sync = 0.25*signal.square(2*np.pi*25*t)
+        self.rec = np.zeros((t.size, 8))
+        self.rec[:,0] = np.random.normal(0, 0.1, t.size)
+        self.rec[:,7] = self.sync
+
+        self.folder = tempfile.mkdtemp()
+        self.fileaddress = os.path.join(self.folder, 'MULTIWAV_test.WAV')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_edges_across_block_boundaries(self):
+        soundfile.write(self.fileaddress, self.rec, self.fs)
+        for blocksize in [1000, 1920, 2**18]:
+            frame_info = count_frames(self.fileaddress, blocksize=blocksize)
+            self.assertEqual(frame_info['num_frames'], 100)
+            self.assertEqual(frame_info['expected_numframes'], 100)
+            self.assertEqual(frame_info['dropped_frames'], 0)
+
+    def test_noise_before_the_sync_signal(self):
+        # the sync signal only starts after a block of low noise, without the
+        # first two rising edges
+        self.rec[:2000,7] = np.random.normal(0, 0.001, 2000)
+        self.rec[2000:4000,7] = -0.25
+        soundfile.write(self.fileaddress, self.rec, self.fs)
+        frame_info = count_frames(self.fileaddress, blocksize=2000)
+        self.assertEqual(frame_info['num_frames'], 98)
+        self.assertEqual(frame_info['dropped_frames'], 0)
+        self.assertEqual(frame_info['extra_frames'], 0)
+
+    def test_dropped_and_extra_frames(self):
+        # two missing pulses, and a short glitch in between two pulses
+        self.rec[int(self.fs*1.0)+100:int(self.fs*1.08)-100, 7] = -0.25
+        self.rec[int(self.fs*2.03):int(self.fs*2.031), 7] = 0.25
+        soundfile.write(self.fileaddress, self.rec, self.fs)
+
+        all_frame_info = count_frames_in_folder(self.folder, num_workers=1,
+                                                blocksize=5000)
+        self.assertEqual(len(all_frame_info), 1)
+        self.assertEqual(all_frame_info[0]['num_frames'], 99)
+        self.assertEqual(all_frame_info[0]['dropped_frames'], 1)
+        self.assertEqual(all_frame_info[0]['extra_frames'], 1)
+
+    def test_other_files_in_folder(self):
+        soundfile.write(self.fileaddress, self.rec, self.fs)
+        # a single channel file saved by ADC_delay, and a broken recording
+        soundfile.write(os.path.join(self.folder, 'Mic00_test.WAV'), self.rec[:,0], self.fs)
+        soundfile.write(os.path.join(self.folder, 'MULTIWAV_short.WAV'), self.rec[:,:4],
+                        self.fs)
+        all_frame_info = count_frames_in_folder(self.folder, num_workers=1)
+        self.assertEqual([ os.path.basename(each['file_name']) for each in all_frame_info],
+                         ['MULTIWAV_test.WAV'])
+        self.assertEqual(all_frame_info[0]['num_frames'], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
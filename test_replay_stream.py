@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the soundcard stand-in in replay_stream
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import soundfile
+from fieldrecorder.replay_stream import *
+
+
+class TestReplayStream(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 8000
+        self.rec = np.float32(np.arange(8000*2).reshape(-1,2))/10**5
+
+    def test_reads_recording_in_order(self):
+        S = replay_stream(self.rec, samplerate=self.fs, channels=(2,1), speed=None)
+        S.start()
+        blocks = [ S.read(3000)[0] for i in range(3)]
+        np.testing.assert_array_equal(np.concatenate(blocks)[:8000], self.rec)
+        # past the end of the recording only zeros are read
+        self.assertTrue(np.all(blocks[-1][-1000:] == 0))
+        self.assertTrue(S.finished)
+
+    def test_reads_file_in_loop(self):
+        folder = tempfile.mkdtemp()
+        try:
+            fileaddress = os.path.join(folder, 'MULTIWAV_test.WAV')
+            soundfile.write(fileaddress, self.rec, self.fs, subtype='FLOAT')
+            backend = replay_backend(fileaddress, speed=None, loop=True)
+            with backend(channels=(1,1), blocksize=5000) as S:
+                data = np.concatenate([ S.read(5000)[0] for i in range(4)])
+            np.testing.assert_array_equal(data[:,0], np.tile(self.rec[:,0], 3)[:20000])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_forced_and_paced_overflows(self):
+        S = replay_stream(self.rec, samplerate=self.fs, channels=(2,1), speed=1.0,
+                          blocksize=100, buffer_blocks=2, overflow_blocks=[1])
+        S.start()
+        self.assertFalse(S.read(100)[1])
+        self.assertTrue(S.read(100)[1])
+        # 50 ms is 400 frames, twice the buffer
+        time.sleep(0.05)
+        data, overflowed = S.read(100)
+        self.assertTrue(overflowed)
+        self.assertTrue(S.frames_read > 300)
+        self.assertEqual(S.input_overflows, 2)
+
+    def test_output_is_kept(self):
+        S = replay_stream(self.rec, samplerate=self.fs, channels=3, speed=None,
+                          keep_output=True)
+        S.start()
+        for i in range(3):
+            self.assertFalse(S.write(np.ones((100,3))*i))
+        output = S.output_signal()
+        self.assertEqual(output.shape, (300,3))
+        self.assertEqual(output[250,0], 2)
+
+    def test_output_not_kept_by_default(self):
+        S = replay_stream(self.rec, samplerate=self.fs, channels=3, speed=None)
+        S.start()
+        S.write(np.ones((100,3)))
+        self.assertEqual(S.frames_written, 100)
+        self.assertEqual(len(S.output), 0)
+        self.assertRaises(ValueError, S.output_signal)
+
+
+if __name__ == '__main__':
+    unittest.main()
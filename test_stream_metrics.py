@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the loop instrumentation in stream_metrics
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from fieldrecorder.stream_metrics import *
+
+
+class TestStreamMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def run_loop(self, metrics):
+        bytes_written = [0]
+        metrics.watch('queue_depth', lambda : 3)
+        metrics.watch('bytes', lambda : bytes_written[0], rate=True)
+        for i in range(10):
+            metrics.count_read(i in [2,5])
+            metrics.count_write(i == 7)
+            bytes_written[0] += 1000
+            if i == 4:
+                time.sleep(0.03)
+            metrics.tick()
+        return(metrics.close())
+
+    def test_jsonlines_export(self):
+        metrics_file = os.path.join(self.folder, 'metrics.jsonl')
+        row = self.run_loop(stream_metrics(metrics_file, export_interval=100))
+
+        with open(metrics_file) as saved:
+            rows = [ json.loads(line) for line in saved]
+        self.assertEqual(rows, [row])
+        self.assertEqual(row['blocks'], 10)
+        self.assertEqual(row['input_overflows'], 2)
+        self.assertEqual(row['output_underflows'], 1)
+        self.assertEqual(row['queue_depth'], 3)
+        self.assertTrue(row['bytes_per_second'] > 0)
+        # 9 intervals between 10 ticks, one of them over 20 ms
+        latencies = [ row[name] for name in row if name.startswith('latency_')]
+        self.assertEqual(sum(latencies), 9)
+        self.assertEqual(row['latency_lt_40ms'], 1)
+
+    def test_csv_export_every_interval(self):
+        metrics_file = os.path.join(self.folder, 'metrics.csv')
+        metrics = stream_metrics(metrics_file, export_interval=0)
+        self.run_loop(metrics)
+
+        with open(metrics_file) as saved:
+            rows = list(csv.DictReader(saved))
+        # one export per tick and one when closing
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(sum([ int(each['input_overflows']) for each in rows]), 2)
+        self.assertEqual(rows[-1]['total_input_overflows'], '2')
+
+
+if __name__ == '__main__':
+    unittest.main()
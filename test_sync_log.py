@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the sync logs saved with the recordings and their use in ADC_delay
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import numpy as np
+from scipy import signal
+import soundfile
+import ADC_delay
+from fieldrecorder.drift_tracker import clock_drift_tracker
+from fieldrecorder.output_scheduler import output_scheduler
+from fieldrecorder.sync_log import *
+
+
+class TestMakeSyncLog(unittest.TestCase):
+
+    def setUp(self):
+        cycle = np.zeros((100, 2), dtype=np.float32)
+        self.scheduler = output_scheduler({'only_sync':cycle, 'trig_and_sync':cycle+1,
+                                           'sync_and_FFC':cycle+2}, fs=1000)
+
+    def test_output_events(self):
+        self.scheduler.next_block(250)
+        self.scheduler.play_once('sync_and_FFC')
+        self.scheduler.play('trig_and_sync', 1000)
+        sync_log = make_sync_log(1000, 330, 1200, 50, self.scheduler)
+
+        self.assertEqual(sync_log['output_events'], [[0, 70, 'sync_and_FFC'],
+                                                     [70, 1070, 'trig_and_sync']])
+        self.assertEqual(sync_log['first_block_boundary'], 20)
+        self.assertEqual(sync_log['first_cycle_start'], 70)
+        self.assertEqual(sync_log['stream_start_time'], 0.33)
+        self.assertIsNone(sync_log['cutpoints'])
+
+    def test_cutpoints_from_drift_tracker(self):
+        fs = 1000
+        # rising edges between the samples before and at multiples of 40
+        sync = np.float32(np.arange(20*fs) % 40 < 20)
+        rec = np.column_stack((sync, np.roll(sync, 3)))
+        tracker = clock_drift_tracker(fs, {'1':0, '2':1}, threshold=0.25)
+        for start in range(0, rec.shape[0], 50):
+            tracker.update(rec[start:start+50])
+        tracker.start_file(10*fs + 5)
+
+        sync_log = make_sync_log(fs, 10*fs + 5, 2*fs, 50, self.scheduler, tracker)
+        self.assertEqual(sync_log['syncch2device'], {'1':0, '2':1})
+        self.assertEqual(sync_log['cutpoints'], {'1':34, '2':37})
+        self.assertAlmostEqual(sync_log['drift']['drift_ppm']['2'], 0)
+        self.assertNotIn('cutpoints', sync_log['drift'])
+
+
+class TestAlignmentFromSyncLog(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fs = 48000
+        self.rec = np.float32(np.random.normal(0, 0.1, (2*self.fs, 4)))
+        self.rec_file = os.path.join(self.folder, 'MULTIWAV_test.WAV')
+        soundfile.write(self.rec_file, self.rec, self.fs, subtype='FLOAT')
+        self.sync_log = {'fs':self.fs, 'syncch2device':{'1':1, '2':3},
+                         'cutpoints':{'1':100, '2':137},
+                         'drift':{'offset_change':{'1':0.0, '2':0.2}}}
+        # the noise on the sync channels has no rising edges to find, so the
+        # channels can only be aligned with the logged cut points
+        self.aligned_samples = 2*self.fs - 137
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_timealign_and_save_inchunks(self):
+        write_sync_log(self.rec_file, self.sync_log)
+        file_start = os.path.join(self.folder, 'Mic')
+        saved_files = ADC_delay.timealign_and_save_inchunks(self.rec_file,
+                                        {'1':[0,1], '2':[2,3]}, {'1':1, '2':3},
+                                        file_start=file_start, file_timestamp='test')
+
+        channel_0, fs = soundfile.read(saved_files[0])
+        channel_2, fs = soundfile.read(saved_files[1])
+        self.assertEqual(channel_0.size, self.aligned_samples)
+        np.testing.assert_allclose(channel_0, self.rec[100:100+self.aligned_samples, 0],
+                                   atol=1e-6)
+        np.testing.assert_allclose(channel_2, self.rec[137:, 2], atol=1e-6)
+
+    def test_timealign_channels(self):
+        aligned = ADC_delay.timealign_channels(self.rec, self.fs, {'1':[0,1], '2':[2,3]},
+                                               {'1':1, '2':3}, sync_log=self.sync_log)
+        self.assertEqual(aligned.shape, (self.aligned_samples, 2))
+        np.testing.assert_array_equal(aligned[:,0], self.rec[100:100+self.aligned_samples, 0])
+        np.testing.assert_array_equal(aligned[:,1], self.rec[137:, 2])
+
+    def test_other_sync_channels(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertIsNone(ADC_delay.cutpoints_from_sync_log(self.sync_log,
+                                                                {'1':7, '2':19}))
+        self.assertEqual(len(caught), 1)
+
+    def test_drift_warning(self):
+        self.sync_log['drift']['offset_change']['2'] = 3.5
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            cutpoints = ADC_delay.cutpoints_from_sync_log(self.sync_log, {'1':1, '2':3})
+        self.assertEqual(cutpoints, {'1':100, '2':137})
+        self.assertEqual(len(caught), 1)
+
+
+class TestSyncLogMatchesSearch(unittest.TestCase):
+    '''
+    The cut points in the sync logs and those ADC_delay finds in the sync
+    channels must align a file in the same way.
+    '''
+
+    def setUp(self):
+        self.fs = 48000
+        one_cycle = np.float32(0.25*signal.square(2*np.pi*25*np.linspace(0, 0.04, 1920) + np.pi, 0.5))
+        sync = np.tile(one_cycle, 12*25)
+        # device 1 records audio and sync on columns 0 and 1, device 2 37
+        # frames later on columns 2 and 3. The rising edges are at 960 + k*1920.
+        self.rec = np.float32(np.random.normal(0, 0.005, (sync.size, 4)))
+        self.rec[:,[0,2]] *= 20
+        self.rec[:,1] += sync
+        self.rec[:,3] += np.roll(sync, 37)
+        cycle = np.zeros((1920, 2), dtype=np.float32)
+        self.scheduler = output_scheduler({'only_sync':cycle}, fs=self.fs)
+
+    def aligned_both_ways(self, file_start):
+        tracker = clock_drift_tracker(self.fs, {'1':1, '2':3})
+        for start in range(0, self.rec.shape[0], 1000):
+            tracker.update(self.rec[start:start+1000])
+            if tracker.file_start_frame is None and start >= file_start + 1000:
+                tracker.start_file(file_start)
+        file_rec = self.rec[file_start:file_start+self.fs]
+        sync_log = make_sync_log(self.fs, file_start, file_rec.shape[0], 1000,
+                                 self.scheduler, tracker)
+
+        from_log = ADC_delay.timealign_channels(file_rec, self.fs, {'1':[0,1], '2':[2,3]},
+                                                {'1':1, '2':3}, sync_log=sync_log)
+        from_search = ADC_delay.timealign_channels(file_rec, self.fs, {'1':[0,1], '2':[2,3]},
+                                                   {'1':1, '2':3})
+        return(sync_log['cutpoints'], from_log, from_search)
+
+    def test_edge_at_file_start(self):
+        # the edges are 1 and 38 frames into the file, too close to its start
+        cutpoints, from_log, from_search = self.aligned_both_ways(20*1920 + 959)
+        self.assertEqual(cutpoints, {'1':1921, '2':1958})
+        np.testing.assert_array_equal(from_log, from_search)
+
+    def test_devices_around_half_period(self):
+        # the edge of device 1 is just before half a period into the file and
+        # that of device 2 just after it
+        cutpoints, from_log, from_search = self.aligned_both_ways(20*1920 + 960 - 940)
+        self.assertEqual(cutpoints, {'1':2860, '2':2897})
+        np.testing.assert_array_equal(from_log, from_search)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the trigger helpers in trigger_detection
+"""
+import unittest
+import numpy as np
+from scipy import signal
+from trigger_detection import *
+
+
+class TestStreamingBandpass(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 192000
+        self.bandpass_freqs = (20000.0, 60000.0)
+        self.rec = np.random.normal(0, 0.1, (4*7680, 3))
+
+    def test_blockwise_same_as_whole(self):
+        '''
+        filtering block by block must give the same output as filtering the
+        whole recording in one go
+        '''
+        bp_filter = streaming_bandpass(self.bandpass_freqs, self.fs, 3)
+        blockwise = np.concatenate([bp_filter.filter(block) for block in
+                                    np.split(self.rec, 4)])
+
+        sos = signal.butter(4, [20000.0/96000, 60000.0/96000], btype='bandpass',
+                            output='sos')
+        whole = signal.sosfilt(sos, self.rec, axis=0)
+
+        np.testing.assert_array_almost_equal(blockwise, whole)
+
+    def test_reset(self):
+        bp_filter = streaming_bandpass(self.bandpass_freqs, self.fs, 3)
+        first = bp_filter.filter(self.rec[:7680])
+        bp_filter.reset()
+        again = bp_filter.filter(self.rec[:7680])
+        np.testing.assert_array_equal(first, again)
+
+
+class TestLevelDetector(unittest.TestCase):
+
+    def calc_dBrms(self, one_channel):
+        return(20.0*np.log10(np.sqrt(np.mean(np.square(one_channel)))))
+
+    def test_same_levels_as_dBrms(self):
+        rec = np.float32(np.random.normal(0, [0.001, 0.01, 0.3], (7680, 3)))
+        detector = level_detector(-20, 3)
+        above_level, mean_squared = detector.check(rec)
+
+        expected_dBrms = np.apply_along_axis(self.calc_dBrms, 0, np.float64(rec))
+        np.testing.assert_array_almost_equal(to_dBrms(mean_squared), expected_dBrms,
+                                             decimal=4)
+        self.assertTrue(above_level)
+
+    def test_below_level_and_silence(self):
+        rec = np.zeros((7680, 2))
+        rec[:,1] = 0.001
+        detector = level_detector(-50, 2)
+        above_level, mean_squared = detector.check(rec)
+
+        self.assertFalse(above_level)
+        self.assertEqual(to_dBrms(mean_squared)[0], -999.)
+
+
+class TestBandEnergyDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 192000
+        t = np.arange(7680)/float(self.fs)
+        # a 40 kHz tone on channel 0 and noise on channel 1
+        self.rec = np.float32(np.column_stack((0.1*np.sin(2*np.pi*40000*t),
+                                               np.random.normal(0, 0.01, t.size))))
+
+    def test_whole_spectrum_is_mean_squared(self):
+        for method in ['fft', 'goertzel']:
+            detector = band_energy_detector((0, self.fs/2.0), self.fs, -50, 2, method)
+            above_level, mean_squared = detector.check(self.rec)
+            np.testing.assert_allclose(mean_squared[0], np.mean(np.float64(self.rec)**2, axis=0),
+                                       rtol=1e-4)
+
+    def test_bands(self):
+        bands = [(35000, 45000), (60000, 90000)]
+        for method in ['fft', 'goertzel']:
+            detector = band_energy_detector(bands, self.fs, [-30, -60], 2, method)
+            above_level, mean_squared = detector.check(self.rec)
+            self.assertTrue(above_level)
+            # all of the tone is in the first band
+            self.assertAlmostEqual(mean_squared[0,0], 0.005, places=6)
+            self.assertLess(mean_squared[1,0], 10**-9)
+            # the noise is spread evenly across the spectrum
+            self.assertAlmostEqual(mean_squared[1,1]/mean_squared[0,1], 3.0, delta=0.5)
+
+    def test_trigger_levels_per_band(self):
+        # the tone is at -23 dB rms
+        detector = band_energy_detector([(35000, 45000), (60000, 90000)], self.fs,
+                                        [-20, -60], 1)
+        self.assertFalse(detector.check(self.rec[:,:1])[0])
+        detector = band_energy_detector([(35000, 45000), (60000, 90000)], self.fs,
+                                        [-30, -60], 1)
+        self.assertTrue(detector.check(self.rec[:,:1])[0])
+
+    def test_auto_method(self):
+        detector = band_energy_detector([(41900, 42100)], self.fs, -50, 2)
+        self.assertEqual(detector.setup(7680)['method'], 'goertzel')
+        detector = band_energy_detector([(20000, 60000)], self.fs, -50, 2)
+        self.assertEqual(detector.setup(7680)['method'], 'fft')
+
+
+class TestNoiseFloorTrigger(unittest.TestCase):
+
+    def block_at(self, *dB_levels):
+        return(np.ones((100, len(dB_levels)))*10**(np.array(dB_levels)/20.0))
+
+    def make_trigger(self, num_channels=1, **kwargs):
+        return(noise_floor_trigger(level_detector(-90, num_channels), **kwargs))
+
+    def test_slowly_rising_noise(self):
+        trigger = self.make_trigger()
+        # wind picking up by 30 dB over a minute of 40 ms blocks
+        triggered = [ trigger.check(self.block_at(level))[0]
+                                    for level in np.linspace(-70, -40, 1500)]
+        self.assertFalse(any(triggered))
+        self.assertAlmostEqual(to_dBrms(trigger.noise_floor)[0], -40, delta=2)
+
+    def test_silent_first_block(self):
+        trigger = self.make_trigger()
+        trigger.check(np.zeros((100, 1)))
+        triggered = [ trigger.check(self.block_at(-40))[0] for i in range(2000)]
+        self.assertFalse(any(triggered))
+        self.assertAlmostEqual(to_dBrms(trigger.noise_floor)[0], -40, delta=0.5)
+
+    def test_noise_floor_minimum(self):
+        trigger = self.make_trigger(margin=12)
+        for i in range(2000):
+            trigger.check(np.zeros((100, 1)))
+        self.assertAlmostEqual(to_dBrms(trigger.noise_floor)[0], -102)
+        self.assertFalse(trigger.check(self.block_at(-95))[0])
+
+    def test_consecutive_blocks(self):
+        trigger = self.make_trigger(min_blocks=3)
+        for i in range(10):
+            trigger.check(self.block_at(-70))
+        # a single click does not trigger
+        self.assertFalse(trigger.check(self.block_at(-40))[0])
+        self.assertFalse(trigger.check(self.block_at(-70))[0])
+        triggered = [ trigger.check(self.block_at(-40))[0] for i in range(3)]
+        self.assertEqual(triggered, [False, False, True])
+
+    def test_hysteresis(self):
+        trigger = self.make_trigger(margin=12, hysteresis=6, min_blocks=1)
+        for i in range(10):
+            trigger.check(self.block_at(-70))
+        self.assertTrue(trigger.check(self.block_at(-50))[0])
+        # stays on between the two thresholds, with the noise floor held
+        for i in range(20):
+            self.assertTrue(trigger.check(self.block_at(-62))[0])
+        self.assertAlmostEqual(to_dBrms(trigger.noise_floor)[0], -70, places=6)
+        self.assertFalse(trigger.check(self.block_at(-66))[0])
+
+    def test_sustained_step(self):
+        trigger = self.make_trigger(max_on_blocks=50)
+        for i in range(100):
+            trigger.check(self.block_at(-60))
+        # the noise gets 20 dB louder for good
+        triggered = [ trigger.check(self.block_at(-40))[0] for i in range(1000)]
+        self.assertTrue(triggered[1])
+        self.assertEqual(sum(triggered), 49)
+        self.assertFalse(any(triggered[51:]))
+        self.assertAlmostEqual(to_dBrms(trigger.noise_floor)[0], -40, delta=0.5)
+
+    def test_trigger_level_is_the_lowest_threshold(self):
+        trigger = noise_floor_trigger(level_detector(-50, 1), min_blocks=1)
+        trigger.check(self.block_at(-90))
+        self.assertFalse(trigger.check(self.block_at(-55))[0])
+        self.assertTrue(trigger.check(self.block_at(-45))[0])
+
+    def test_per_channel_margins(self):
+        trigger = self.make_trigger(2, margin=[10, 20], min_blocks=1)
+        trigger.check(self.block_at(-70, -70))
+        above_level, mean_squared = trigger.check(self.block_at(-70, -55))
+        self.assertFalse(above_level)
+        self.assertTrue(trigger.check(self.block_at(-55, -70))[0])
+        np.testing.assert_array_equal(trigger.on, [True, False])
+
+    def test_bands(self):
+        detector = band_energy_detector([(1000, 2000), (5000, 8000)], 48000, -90, 2)
+        trigger = noise_floor_trigger(detector, min_blocks=1)
+        self.assertEqual(trigger.noise_floor.shape, (2, 2))
+        t = np.arange(1920)/48000.0
+        noise = np.random.normal(0, 0.001, (t.size, 2))
+        trigger.check(noise)
+        noise[:,1] += 0.1*np.sin(2*np.pi*6000*t)
+        self.assertTrue(trigger.check(noise)[0])
+        np.testing.assert_array_equal(trigger.on, [[False, False], [False, True]])
+
+
+class TestTriggerCascade(unittest.TestCase):
+
+    def setUp(self):
+        self.checked_blocks = []
+        def full_check(block):
+            self.checked_blocks.append(block)
+            return(bool(np.abs(block).max() > 0.1))
+        self.wakes = []
+        self.cascade = trigger_cascade(full_check, -40, stride=4, hold_blocks=2,
+                                       on_wake=lambda : self.wakes.append(True))
+        self.quiet = np.zeros((100, 2))
+        self.loud = self.quiet.copy()
+        self.loud[::4, 1] = 0.5
+
+    def test_quiet_blocks_skip_full_check(self):
+        triggered = [ self.cascade.check(self.quiet) for i in range(10)]
+        self.assertFalse(any(triggered))
+        self.assertEqual(len(self.checked_blocks), 0)
+        self.assertEqual(self.cascade.stats()['stage2_run_rate'], 0)
+
+    def test_hold_and_wake(self):
+        blocks = [self.quiet, self.loud, self.quiet, self.quiet, self.quiet, self.loud]
+        triggered = [ self.cascade.check(block) for block in blocks]
+        self.assertEqual(triggered, [False, True, False, False, False, True])
+        # the full check runs on the loud blocks and the two after the first
+        self.assertEqual(len(self.checked_blocks), 4)
+        self.assertEqual(len(self.wakes), 2)
+
+        stats = self.cascade.stats()
+        self.assertEqual(stats['blocks'], 6)
+        self.assertAlmostEqual(stats['stage1_hit_rate'], 2/6.0)
+        self.assertAlmostEqual(stats['stage2_run_rate'], 4/6.0)
+        self.assertAlmostEqual(stats['stage2_hit_rate'], 0.5)
+
+    def test_stride_misses_samples(self):
+        self.loud[::4, 1] = 0
+        self.loud[1::4, 1] = 0.5
+        self.assertFalse(self.cascade.check(self.loud))
+        self.assertFalse(trigger_cascade(None, -40, channels=[0]).prescreen(self.loud))
+        self.assertTrue(trigger_cascade(None, -40, stride=1).prescreen(-self.loud))
+
+
+if __name__ == '__main__':
+    unittest.main()
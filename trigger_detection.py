@@ -0,0 +1,651 @@
+# -*- coding: utf-8 -*-
+"""
+Helper classes and functions for the threshold based triggering in
+fieldrecorder_trigger.
+
+streaming_bandpass : a multi-channel Butterworth bandpass filter in second
+                     order sections which keeps its state across blocks.
+
+level_detector : checks whether the dB rms of any channel in a block is above a
+                 threshold, without per-channel Python loops or logarithms.
+
+band_energy_detector : checks the dB rms in one or more frequency bands from the
+                       spectrum of each block, instead of bandpass filtering it.
+
+noise_floor_trigger : triggers at a margin above a running estimate of each
+                      channel's noise floor, with hysteresis and a minimum
+                      number of consecutive blocks above it.
+
+trigger_cascade : only runs the full trigger check on blocks whose peak on a
+                  strided subsample crosses a low pre-threshold, and counts
+                  the hits and CPU time of both stages.
+
+Run this module directly to benchmark them against the older apply_along_axis
+implementations.
+
+"""
+from __future__ import division
+import time
+import timeit
+import numpy as np
+from scipy import signal
+try:
+    # keeps float32 blocks in single precision and is several times faster
+    from scipy.fft import rfft
+except ImportError:
+    from numpy.fft import rfft
+
+
+class streaming_bandpass():
+
+    def __init__(self, bandpass_freqs, fs, num_channels, order=4):
+        '''
+        Inputs:
+            bandpass_freqs : tuple. Highpass and lowpass frequencies in Hertz.
+            fs : integer. sampling rate in Hertz.
+            num_channels : integer. Number of channels that will be filtered.
+            order : integer. Order of the Butterworth filter. Defaults to 4.
+        '''
+        self.highpass_freq, self.lowpass_freq = bandpass_freqs
+        self.fs = fs
+        self.num_channels = num_channels
+
+        nyq_freq = self.fs/2.0
+        self.sos = signal.butter(order, [self.highpass_freq/nyq_freq,
+                                         self.lowpass_freq/nyq_freq],
+                                 btype='bandpass', output='sos')
+        self.reset()
+
+    def reset(self):
+        '''
+        Sets the filter state back to rest, eg. after a gap in the monitored audio.
+        '''
+        self.zi = np.zeros((self.sos.shape[0], 2, self.num_channels))
+
+    def filter(self, rec_buffer):
+        '''
+        Filters one block of audio, starting from the state at the end of the
+        previously filtered block.
+
+        Inputs:
+            rec_buffer : nsamples x num_channels np.array
+
+        Returns:
+            rec_buffer_bp : nsamples x num_channels np.array. The bandpassed audio
+        '''
+        rec_buffer_bp, self.zi = signal.sosfilt(self.sos, rec_buffer, axis=0,
+                                                zi=self.zi)
+        return(rec_buffer_bp)
+
+
+class level_detector():
+
+    def __init__(self, trigger_level, num_channels):
+        '''
+        Inputs:
+            trigger_level : float <=0. dB rms ref max at or above which a
+                            channel is considered to be above level.
+            num_channels : integer. Number of channels in each block.
+        '''
+        self.trigger_level = trigger_level
+        self.num_channels = num_channels
+        # dB rms = 10*log10(mean squared), so compare the mean squared directly
+        self.threshold_meansquared = 10**(trigger_level/10.0)
+        self.mean_squared = np.zeros(num_channels)
+
+    def check(self, rec_buffer):
+        '''
+        Calculates the mean squared value of each channel in one pass and
+        compares it to the linear threshold.
+
+        Inputs:
+            rec_buffer : nsamples x num_channels np.array
+
+        Returns:
+            above_level : Boolean. True if any channel is at or above the trigger level.
+            mean_squared : num_channels np.array. The mean squared value of
+                           each channel. Use to_dBrms to convert into dB rms.
+                           This array is overwritten by the next call to check.
+        '''
+        np.einsum('ij,ij->j', rec_buffer, rec_buffer, out=self.mean_squared,
+                  dtype=self.mean_squared.dtype, casting='same_kind')
+        self.mean_squared *= 1.0/rec_buffer.shape[0]
+        above_level = bool(np.any(self.mean_squared >= self.threshold_meansquared))
+        return(above_level, self.mean_squared)
+
+
+class band_energy_detector():
+
+    def __init__(self, bands, fs, trigger_level, num_channels, method='auto'):
+        '''
+        Frequency domain alternative to a streaming_bandpass followed by a
+        level_detector. The mean squared value of each channel in each band is
+        summed from the DFT bins of the band (Parseval's theorem), so a block
+        is only passed over once - by one real FFT of all channels, or for
+        narrow bands by the few DFT bins of the bands.
+
+        The bands are cut out with the rectangular window of the block, which
+        has steeper edges but more leakage from loud sounds outside the band
+        than the 4th order Butterworth bandpass.
+
+        Inputs:
+            bands : tuple with the highpass and lowpass frequency in Hertz, or a
+                    list of such tuples for several bands, eg. [(25000, 60000),
+                    (100000, 110000)] for separate FM and CF bat calls.
+            fs : integer. sampling rate in Hertz.
+            trigger_level : float <=0, or list with one float per band. dB rms
+                            ref max at or above which a band of a channel is
+                            considered to be above level.
+            num_channels : integer. Number of channels in each block.
+            method : string. 'fft' computes the whole spectrum with one real FFT.
+                     'goertzel' computes only the DFT bins of the bands, as a
+                     bank of Goertzel filters would, with one matrix product.
+                     'auto' uses 'goertzel' when the bands hold fewer DFT bins
+                     than the log2 of the block size, otherwise 'fft'.
+                     Defaults to 'auto'.
+        '''
+        self.bands = np.array(bands, dtype='float64').reshape(-1, 2)
+        self.fs = fs
+        self.num_channels = num_channels
+        if method not in ['auto', 'fft', 'goertzel']:
+            raise ValueError('Unknown method: '+str(method))
+        self.method = method
+
+        num_bands = self.bands.shape[0]
+        trigger_levels = np.array(trigger_level, dtype='float64')
+        if trigger_levels.size not in [1, num_bands]:
+            raise ValueError('Give one trigger level or one per band, got: '+
+                             str(trigger_level))
+        self.trigger_level = trigger_level
+        self.threshold_meansquared = np.broadcast_to(10**(trigger_levels/10.0),
+                                                     (num_bands,)).reshape(-1,1)
+        self.mean_squared = np.zeros((num_bands, num_channels))
+        # the DFT bins, band weights and method, per block size
+        self.setups = {}
+
+    def setup(self, blocksize):
+        '''
+        Finds the DFT bins of each band for a block size.
+
+        Returns:
+            setup : dictionary with the 'method', the 'bins' of all bands, the
+                    'band_weights' nbins x nbands np.array that sums their power
+                    into the mean squared value of each band and, for 'goertzel',
+                    the 'basis' blocksize x 2*nbins np.array with the cosines and
+                    sines of the bins.
+        '''
+        freqs = np.fft.rfftfreq(blocksize, 1.0/self.fs)
+        band_bins = [ np.flatnonzero((freqs >= low) & (freqs <= high))
+                                                for low, high in self.bands]
+        bins = np.unique(np.concatenate(band_bins))
+
+        # bins other than 0 Hz and the Nyquist frequency appear twice in the
+        # spectrum of a real signal
+        bin_weights = np.where((bins == 0) | (2*bins == blocksize), 1.0, 2.0)/blocksize**2
+        band_weights = np.zeros((bins.size, self.bands.shape[0]))
+        for band, each_bins in enumerate(band_bins):
+            in_band = np.isin(bins, each_bins)
+            band_weights[in_band, band] = bin_weights[in_band]
+
+        method = self.method
+        if method == 'auto':
+            method = 'goertzel' if bins.size < np.log2(blocksize) else 'fft'
+
+        setup = {'method':method, 'bins':bins, 'band_weights':band_weights}
+        if method == 'goertzel':
+            phase = 2*np.pi*np.outer(np.arange(blocksize), bins)/blocksize
+            setup['basis'] = np.float32(np.column_stack((np.cos(phase), np.sin(phase))))
+        self.setups[blocksize] = setup
+        return(setup)
+
+    def check(self, rec_buffer):
+        '''
+        Inputs:
+            rec_buffer : nsamples x num_channels np.array
+
+        Returns:
+            above_level : Boolean. True if any band of any channel is at or above
+                          its trigger level.
+            mean_squared : num_bands x num_channels np.array. The mean squared value
+                           of each channel in each band. Use to_dBrms to convert
+                           into dB rms. This array is overwritten by the next call
+                           to check.
+        '''
+        blocksize = rec_buffer.shape[0]
+        setup = self.setups.get(blocksize, None)
+        if setup is None:
+            setup = self.setup(blocksize)
+
+        if setup['method'] == 'fft':
+            spectrum = rfft(rec_buffer, axis=0)[setup['bins']]
+            power = spectrum.real**2 + spectrum.imag**2
+        else:
+            projections = np.dot(setup['basis'].T, rec_buffer)
+            power = np.square(projections)
+            power = power[:setup['bins'].size] + power[setup['bins'].size:]
+
+        np.dot(setup['band_weights'].T, power, out=self.mean_squared)
+        above_level = bool(np.any(self.mean_squared >= self.threshold_meansquared))
+        return(above_level, self.mean_squared)
+
+
+class noise_floor_trigger():
+
+    def __init__(self, detector, margin=12.0, hysteresis=6.0, min_blocks=2, **kwargs):
+        '''
+        Adaptive trigger policy on top of a level_detector or band_energy_detector.
+
+        The noise floor of each channel (and band) is tracked as a running
+        quantile of its block levels : it rises by a small step after each
+        louder block and falls after each quieter block, so it settles where
+        the given fraction of blocks is quieter. A channel turns on once it
+        has been at least margin dB above its noise floor for min_blocks
+        consecutive blocks, and stays on until it drops below
+        margin-hysteresis dB above its noise floor. The noise floor is not
+        updated while a channel is on. A channel that has been on for
+        max_on_blocks blocks is re-armed instead : its noise floor is set to
+        the level of the block and it turns off, so that a lasting step in the
+        noise (wind getting up, an insect chorus starting) does not keep it on.
+
+        The noise floor of a channel starts at its first block that is not
+        all zeros, which often open a stream, and never drops below margin dB
+        under the trigger level of the detector, where it stops making a
+        difference.
+
+        Steady wind or insect noise therefore raises the noise floor instead
+        of triggering one bout after another. The trigger level of the
+        detector is kept as the lowest threshold, so that quiet nights do not
+        trigger on faint noise. All state is preallocated, and each block
+        takes a few operations per channel.
+
+        Inputs:
+            detector : level_detector or band_energy_detector. Gives the mean
+                       squared value of each channel in a block.
+            margin : float, or array-like with one float per channel. dB above
+                     the noise floor at which a channel turns on. Defaults to 12 dB.
+            hysteresis : float. dB by which a channel has to drop below the
+                         margin to turn off again. Defaults to 6 dB.
+            min_blocks : integer >=1. Number of consecutive blocks a channel
+                         has to be above the margin to turn on. Defaults to 2.
+
+        **kwargs:
+            quantile : float between 0 and 1. Fraction of the blocks that are
+                       quieter than the noise floor. Defaults to 0.5, the median.
+            step : float. dB the noise floor moves by per block. Defaults to 0.05 dB,
+                   ie. up to about 1 dB per second with 40 ms blocks.
+            max_on_blocks : integer >=1. Number of blocks in a row a channel can be
+                            on before it is re-armed. Defaults to 250, ie. 10 seconds
+                            of 40 ms blocks.
+        '''
+        self.detector = detector
+        shape = detector.mean_squared.shape
+        quantile = kwargs.get('quantile', 0.5)
+        step = kwargs.get('step', 0.05)
+
+        margin = np.array(margin, dtype='float64')
+        self.margin_on = np.broadcast_to(10**(margin/10.0), shape)
+        self.margin_off = np.broadcast_to(10**((margin - hysteresis)/10.0), shape)
+        self.min_threshold = np.broadcast_to(detector.threshold_meansquared, shape)
+        self.min_blocks = min_blocks
+        self.max_on_blocks = kwargs.get('max_on_blocks', 250)
+        self.step_up = 10**(step*quantile/10.0)
+        self.step_down = 10**(-step*(1-quantile)/10.0)
+
+        self.floor_min = np.maximum(self.min_threshold/self.margin_on,
+                                    np.finfo('float64').tiny)
+        self.noise_floor = self.floor_min.copy()
+        self.floor_set = np.zeros(shape, dtype=bool)
+        self.consecutive_blocks = np.zeros(shape, dtype=np.int64)
+        self.on = np.zeros(shape, dtype=bool)
+        self.on_blocks = np.zeros(shape, dtype=np.int64)
+        # work arrays
+        self.threshold = np.zeros(shape)
+        self.above = np.zeros(shape, dtype=bool)
+        self.floor_steps = np.zeros(shape)
+
+    @property
+    def mean_squared(self):
+        return(self.detector.mean_squared)
+
+    def check(self, rec_buffer):
+        '''
+        Inputs:
+            rec_buffer : nsamples x num_channels np.array
+
+        Returns:
+            above_level : Boolean. True if any channel is on.
+            mean_squared : np.array. see the check method of the detector
+        '''
+        detector_above, mean_squared = self.detector.check(rec_buffer)
+        if not self.floor_set.all():
+            # start the noise floor at the first block that is not silent
+            np.greater(mean_squared, 0, out=self.above)
+            self.above &= ~self.floor_set
+            np.copyto(self.noise_floor, mean_squared, where=self.above)
+            self.floor_set |= self.above
+
+        # count the consecutive blocks above the upper threshold
+        np.multiply(self.noise_floor, self.margin_on, out=self.threshold)
+        np.maximum(self.threshold, self.min_threshold, out=self.threshold)
+        np.greater_equal(mean_squared, self.threshold, out=self.above)
+        self.consecutive_blocks += 1
+        self.consecutive_blocks *= self.above
+        self.on |= self.consecutive_blocks >= self.min_blocks
+
+        # and turn off below the lower threshold
+        np.multiply(self.noise_floor, self.margin_off, out=self.threshold)
+        np.maximum(self.threshold, self.min_threshold, out=self.threshold)
+        np.greater_equal(mean_squared, self.threshold, out=self.above)
+        self.on &= self.above
+
+        # re-arm the channels that have been on for too long at the current level
+        self.on_blocks += 1
+        self.on_blocks *= self.on
+        np.greater_equal(self.on_blocks, self.max_on_blocks, out=self.above)
+        if self.above.any():
+            np.copyto(self.noise_floor, mean_squared, where=self.above)
+            self.on &= ~self.above
+            self.on_blocks *= self.on
+            self.consecutive_blocks *= self.on
+
+        # move the noise floor of the channels that are off towards the level
+        np.greater(mean_squared, self.noise_floor, out=self.above)
+        self.floor_steps.fill(self.step_down)
+        np.copyto(self.floor_steps, self.step_up, where=self.above)
+        np.copyto(self.floor_steps, 1.0, where=self.on)
+        self.noise_floor *= self.floor_steps
+        np.maximum(self.noise_floor, self.floor_min, out=self.noise_floor)
+
+        return(bool(self.on.any()), mean_squared)
+
+
+# CPU time of the calling thread, so the writer threads are not counted
+thread_time = getattr(time, 'thread_time', time.perf_counter)
+
+class trigger_cascade():
+
+    def __init__(self, full_check, pre_level, stride=8, channels=None, **kwargs):
+        '''
+        Two-stage trigger check. The first stage takes the peak magnitude of
+        every stride-th sample of the block, which costs a small fraction of
+        the full check. Only blocks with a peak at or above pre_level wake the
+        full check (eg. bandpass + dB rms), which then also runs for the next
+        hold_blocks blocks.
+
+        The dB rms of a bandpassed block is never above its peak, so with a
+        pre_level a few dB below the trigger level the first stage only holds
+        back blocks that cannot trigger. Strided samples can miss the very peak
+        of a block, hence the few dB.
+
+        Inputs:
+            full_check : callable. Called with a block, returns True if the block
+                         triggers.
+            pre_level : float <=0. dB peak ref max at or above which the full check
+                        is run.
+            stride : integer >=1. Every stride-th sample is checked by the first
+                     stage. Defaults to 8.
+            channels : array-like with integers or None. Channels checked by the
+                       first stage. Defaults to None, which checks all channels.
+
+        **kwargs:
+            hold_blocks : integer. Number of blocks the full check keeps running
+                          for after the first stage last passed a block. Defaults
+                          to 25, ie. 1 second of 40 ms blocks.
+            on_wake : callable or None. Called before the full check runs after
+                      having been skipped, eg. to reset a bandpass filter whose
+                      state is stale. Defaults to None.
+        '''
+        self.full_check = full_check
+        self.pre_level = pre_level
+        self.pre_threshold = 10**(pre_level/20.0)
+        self.stride = stride
+        self.channels = None if channels is None else np.array(channels, dtype=np.intp)
+        self.hold_blocks = kwargs.get('hold_blocks', 25)
+        self.on_wake = kwargs.get('on_wake', None)
+
+        self.blocks_left_awake = 0
+        self.num_blocks = 0
+        self.stage1_hits = 0
+        self.stage2_blocks = 0
+        self.stage2_hits = 0
+        self.stage1_cpu = 0.0
+        self.stage2_cpu = 0.0
+
+    def prescreen(self, rec_buffer):
+        '''
+        Returns:
+            above_pre_level : Boolean. True if the peak magnitude of the strided
+                              subsample is at or above pre_level.
+        '''
+        subsample = rec_buffer[::self.stride]
+        if self.channels is not None:
+            subsample = subsample[:,self.channels]
+        return(bool(subsample.max() >= self.pre_threshold or
+                    -subsample.min() >= self.pre_threshold))
+
+    def check(self, rec_buffer):
+        '''
+        Inputs:
+            rec_buffer : nsamples x num_channels np.array
+
+        Returns:
+            above_level : Boolean. True if the full check ran and triggered.
+        '''
+        start = thread_time()
+        self.num_blocks += 1
+        if self.prescreen(rec_buffer):
+            self.stage1_hits += 1
+            if self.blocks_left_awake == 0 and self.on_wake is not None:
+                self.on_wake()
+            self.blocks_left_awake = self.hold_blocks + 1
+        stage1_end = thread_time()
+        self.stage1_cpu += stage1_end - start
+
+        if self.blocks_left_awake == 0:
+            return(False)
+        self.blocks_left_awake -= 1
+
+        above_level = self.full_check(rec_buffer)
+        self.stage2_blocks += 1
+        self.stage2_hits += above_level
+        self.stage2_cpu += thread_time() - stage1_end
+        return(above_level)
+
+    def stats(self):
+        '''
+        Returns:
+            stats : dictionary with the number of 'blocks', the fraction of blocks
+                    passed by the first stage ('stage1_hit_rate'), the fraction
+                    of blocks the full check ran on ('stage2_run_rate') and the
+                    fraction of those that triggered ('stage2_hit_rate'), the
+                    CPU time in microseconds per block of each stage ('stage1_us',
+                    'stage2_us', per block it ran on) and the 'cpu_fraction' of
+                    the CPU time the full check alone would have taken.
+        '''
+        blocks = max(self.num_blocks, 1)
+        stage2_blocks = max(self.stage2_blocks, 1)
+        stage2_us = self.stage2_cpu*10**6/stage2_blocks
+        total_us = (self.stage1_cpu + self.stage2_cpu)*10**6/blocks
+        return({'blocks':self.num_blocks,
+                'stage1_hit_rate':self.stage1_hits/blocks,
+                'stage2_run_rate':self.stage2_blocks/blocks,
+                'stage2_hit_rate':self.stage2_hits/stage2_blocks,
+                'stage1_us':self.stage1_cpu*10**6/blocks,
+                'stage2_us':stage2_us,
+                'cpu_fraction':total_us/stage2_us if stage2_us > 0 else 0.0})
+
+
+def to_dBrms(mean_squared):
+    '''
+    Converts mean squared values into dB rms. Silent channels get -999 dB rms.
+    '''
+    mean_squared = np.asarray(mean_squared, dtype='float64')
+    dB_rms = np.full(mean_squared.shape, -999.)
+    nonzero = mean_squared > 0
+    dB_rms[nonzero] = 10.0*np.log10(mean_squared[nonzero])
+    return(dB_rms)
+
+
+def benchmark_bandpass(bandpass_freqs=(20000.0, 60000.0), fs=192000,
+                       num_channels=4, blocksize=7680, num_blocks=100):
+    '''
+    Compares the time taken per block by the streaming_bandpass and the
+    apply_along_axis + lfilter bandpass filtering previously used in
+    fieldrecorder_trigger.
+
+    Inputs:
+        bandpass_freqs : tuple. Highpass and lowpass frequencies in Hertz.
+        fs : integer. sampling rate in Hertz.
+        num_channels : integer. Number of monitor channels.
+        blocksize : integer. Number of samples per block. Defaults to one
+                    25 Hz sync cycle at 192 kHz.
+        num_blocks : integer. Number of blocks to filter with each implementation.
+
+    Returns:
+        us_per_block : dictionary with the mean time in microseconds taken
+                       to filter one block by 'lfilter_apply_along_axis' and
+                       'streaming_sos'.
+    '''
+    block = np.float32(np.random.normal(0, 0.1, (blocksize, num_channels)))
+
+    nyq_freq = fs/2.0
+    b, a = signal.butter(4, [bandpass_freqs[0]/nyq_freq, bandpass_freqs[1]/nyq_freq],
+                         btype='bandpass')
+    old_bandpass = lambda : np.apply_along_axis(lambda X : signal.lfilter(b, a, X),
+                                                0, block)
+
+    bp_filter = streaming_bandpass(bandpass_freqs, fs, num_channels)
+    new_bandpass = lambda : bp_filter.filter(block)
+
+    us_per_block = {}
+    for name, function in [('lfilter_apply_along_axis', old_bandpass),
+                           ('streaming_sos', new_bandpass)]:
+        # best of 3 to reduce the influence of other processes
+        durn = min(timeit.repeat(function, number=num_blocks, repeat=3))
+        us_per_block[name] = durn*10**6/num_blocks
+
+    return(us_per_block)
+
+
+def benchmark_band_energy(bands=[(20000.0, 60000.0)], fs=192000, num_channels=4,
+                          blocksize=7680, num_blocks=100):
+    '''
+    Compares the time taken per block to check the trigger with the
+    streaming_bandpass and level_detector, and with the band_energy_detector.
+    Several bands are compared with one bandpass filter per band.
+
+    Inputs:
+        bands : list with tuples. Highpass and lowpass frequencies of each band in Hertz.
+        fs, num_channels, blocksize, num_blocks : see benchmark_bandpass
+
+    Returns:
+        us_per_block : dictionary with the mean time in microseconds taken
+                       to check one block by 'bandpass_level_detector',
+                       'band_energy_fft' and 'band_energy_goertzel'.
+    '''
+    block = np.float32(np.random.normal(0, 0.1, (blocksize, num_channels)))
+
+    bp_filters = [ streaming_bandpass(band, fs, num_channels) for band in bands]
+    detector = level_detector(-50, num_channels)
+    bandpass_check = lambda : [ detector.check(bp_filter.filter(block))
+                                                    for bp_filter in bp_filters]
+
+    checks = [('bandpass_level_detector', bandpass_check)]
+    for method in ['fft', 'goertzel']:
+        band_detector = band_energy_detector(bands, fs, -50, num_channels, method)
+        checks.append(('band_energy_'+method, lambda band_detector=band_detector :
+                                                    band_detector.check(block)))
+
+    us_per_block = {}
+    for name, function in checks:
+        durn = min(timeit.repeat(function, number=num_blocks, repeat=3))
+        us_per_block[name] = durn*10**6/num_blocks
+
+    return(us_per_block)
+
+
+def benchmark_cascade(bandpass_freqs=(20000.0, 60000.0), fs=192000, num_channels=4,
+                      blocksize=7680, num_blocks=1000, active_fraction=0.05):
+    '''
+    Compares the time taken per block by the streaming_bandpass and level_detector
+    with and without a trigger_cascade in front of them, on a quiet night with
+    short bursts of loud calls.
+
+    Inputs:
+        active_fraction : float. Fraction of the blocks that hold calls.
+        bandpass_freqs, fs, num_channels, blocksize : see benchmark_bandpass
+
+    Returns:
+        us_per_block : dictionary with the mean time in microseconds taken
+                       to check one block by 'bandpass_level_detector' and
+                       'trigger_cascade', and the stats of the cascade.
+    '''
+    quiet = np.float32(np.random.normal(0, 10**-4, (blocksize, num_channels)))
+    t = np.arange(blocksize)/float(fs)
+    loud = quiet + np.float32(0.1*np.sin(2*np.pi*40000*t)).reshape(-1,1)
+    # calls come in bursts of 10 blocks
+    num_bursts = int(active_fraction*num_blocks/10)
+    burst_starts = np.linspace(0, num_blocks-10, max(num_bursts, 1)).astype(int)
+    is_loud = np.zeros(num_blocks, dtype=bool)
+    for start in burst_starts:
+        is_loud[start:start+10] = True
+    blocks = [ loud if each else quiet for each in is_loud]
+
+    bp_filter = streaming_bandpass(bandpass_freqs, fs, num_channels)
+    detector = level_detector(-50, num_channels)
+    full_check = lambda block : detector.check(bp_filter.filter(block))[0]
+    cascade = trigger_cascade(full_check, -56, on_wake=bp_filter.reset)
+
+    us_per_block = {}
+    for name, function in [('bandpass_level_detector', full_check),
+                           ('trigger_cascade', cascade.check)]:
+        start = time.perf_counter()
+        for block in blocks:
+            function(block)
+        us_per_block[name] = (time.perf_counter() - start)*10**6/num_blocks
+    us_per_block.update(cascade.stats())
+    return(us_per_block)
+
+
+def benchmark_level_detector(num_channels=4, blocksize=7680, num_blocks=100):
+    '''
+    Compares the time taken per block by the level_detector and the
+    apply_along_axis dB rms calculation previously used in fieldrecorder_trigger.
+
+    Returns:
+        us_per_block : dictionary with the mean time in microseconds taken to
+                       check one block by 'dBrms_apply_along_axis' and 'level_detector'.
+    '''
+    block = np.random.normal(0, 0.1, (blocksize, num_channels))
+
+    def calc_dBrms(one_channel_buffer):
+        return(20.0*np.log10(np.sqrt(np.mean(np.square(one_channel_buffer)))))
+    old_check = lambda : np.any(np.apply_along_axis(calc_dBrms, 0, block) >= -50)
+
+    detector = level_detector(-50, num_channels)
+    new_check = lambda : detector.check(block)
+
+    us_per_block = {}
+    for name, function in [('dBrms_apply_along_axis', old_check),
+                           ('level_detector', new_check)]:
+        durn = min(timeit.repeat(function, number=num_blocks, repeat=3))
+        us_per_block[name] = durn*10**6/num_blocks
+
+    return(us_per_block)
+
+
+if __name__ == '__main__':
+
+    for benchmark in [benchmark_bandpass, benchmark_level_detector]:
+        for name, us in benchmark().items():
+            print(name + ' : %.1f us per block'%us)
+
+    for bands in [[(20000.0, 60000.0)], [(25000.0, 60000.0), (80000.0, 90000.0)],
+                  [(41900.0, 42100.0)]]:
+        print('Bands: '+str(bands))
+        for name, us in benchmark_band_energy(bands).items():
+            print(name + ' : %.1f us per block'%us)
+
+    print('Quiet night with 5% of the blocks holding calls:')
+    for name, value in benchmark_cascade().items():
+        print(name + ' : %.3f'%value)